@@ -2,6 +2,7 @@
 
 #   Copyright 2018 Check Point Software Technologies LTD
 
+import argparse
 import datetime
 import email.utils as eut
 import json
@@ -10,20 +11,25 @@ import re
 import socket
 import subprocess
 import sys
+import threading
+import time
 import traceback
 import filecmp
 
 import aws_ha_mode as mode
-from aws_had import update_cross_az_cluster_map, get_all_allocation_ids
+from aws_had import update_cross_az_cluster_map, get_all_allocation_ids, describe_network_interfaces_by_ip, IMDSClient
 from aws_ha_globals import AWSproperties, CROSS_AZ_CLUSTER_SEC_IP_MAP, CROSS_AZ_CLUSTER_SEC_IP_MAP_TEST, IFS, ACTIVE, \
     STANDBY, INTERNAL, TYPE, AWS_HA_CLI_COMMAND
 import aws
 
 if sys.version_info < (3,):
-    from urllib import urlencode
+    from urllib import urlencode, proxy_bypass_environment
     from urlparse import urlparse
+    import Queue as queue
 else:
     from urllib.parse import urlencode, urlparse
+    from urllib.request import proxy_bypass_environment
+    import queue
 
 
 def is_aws():
@@ -32,8 +38,12 @@ def is_aws():
 
 
 def log(msg):
-    """#TODO fixDocstring"""
-    sys.stderr.write(msg)
+    """Write msg to stderr, or to the output of the check that is running in this thread"""
+    buffer = getattr(_output, 'buffer', None)
+    if buffer is not None:
+        buffer.append(msg)
+    else:
+        sys.stderr.write(msg)
 
 
 http_proxy = urlparse(os.environ.get('http_proxy'))
@@ -53,42 +63,43 @@ else:
         subprocess.call('fw ctl set int fw_os_proxy_port 0', shell=True)
 
 
-def get(url, proxy=None):
-    """#TODO fixDocstring"""
-    cmd = ['curl_cli', '--request', 'PUT',
-           'http://169.254.169.254/latest/api/token',
-           '--header', 'X-aws-ec2-metadata-token-ttl-seconds: 60']
-    token = subprocess.check_output(cmd)
-    if not token:
-        raise Exception('Failed to get metadata token\n')
-    cmd = ['curl_cli', '-s', '-f', '-g', '-L']
-    if proxy:
-        cmd.extend(['--proxy', proxy])
-    cmd.extend(['--header', 'X-aws-ec2-metadata-token: ' + token.decode('utf-8'), url])
-    text = subprocess.check_output(cmd)
-    try:
-        return text.decode('utf-8')
-    except Exception:
-        return text
+# One metadata token for the whole test, the metadata service is reached through the proxy unless it is excluded by
+# no_proxy, as it was with curl_cli
+IMDS = IMDSClient(timeout=5, token_ttl=60, token_margin=5,
+                  proxy=HTTP_PROXY if HTTP_PROXY and not proxy_bypass_environment('169.254.169.254') else None)
 
 
-def test():
-    """#TODO fixDocstring"""
+def get(url):
+    """
+    input: Metadata url (META_DATA + path)
+    return: The value of the metadata url
+    """
+    return IMDS.get(urlparse(url).path)
+
+
+def check_environment(ctx):
+    """Verify that this is an AWS environment"""
     if not is_aws():
         raise Exception('This does not look like an AWS environment\n')
 
+
+def check_dns_config(ctx):
+    """Verify that a primary DNS server is configured"""
     log('\nTesting if DNS is configured...\n')
     try:
         dns = subprocess.check_output(
             ['/bin/clish', '-c', 'show dns primary']).decode('utf-8').strip()
     except Exception:
-        traceback.print_exc()
+        log(traceback.format_exc())
         raise
     match = re.search(r'(\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3})', dns)
     if not match:
         raise Exception('Primary DNS server is not configured\n')
     log('Primary DNS server is: %s\n' % match.group(1))
 
+
+def check_dns_resolve(ctx):
+    """Verify that DNS names are resolved"""
     log('\nTesting if DNS is working...\n')
     try:
         socket.gethostbyname('s3.amazonaws.com')
@@ -96,6 +107,9 @@ def test():
     except Exception:
         raise Exception('Failed in DNS resolving test\n')
 
+
+def check_metadata(ctx):
+    """Read the region, VPC and domain from the metadata"""
     log('\nTesting metadata connectivity...\n')
     try:
         az = get(META_DATA + '/placement/availability-zone').strip()
@@ -114,7 +128,7 @@ def test():
                      '/vpc-id').strip()
         domain = get(META_DATA + '/services/domain')
     except Exception:
-        traceback.print_exc()
+        log(traceback.format_exc())
         raise Exception('''Failed in metadata connectivity test
 Verify that outgoing connections over TCP port 80 (HTTP) to 169.254.169.254 are
 allowed by the firewall security policy.
@@ -125,28 +139,39 @@ http://docs.aws.amazon.com/AWSEC2/latest/UserGuide/ec2-instance-metadata.html
     log('Region : %s\n' % region)
     log('VPC    : %s\n' % vpc_id)
     log('Domain : %s\n' % domain)
+    return {'region': region, 'vpc_id': vpc_id, 'domain': domain}
+
 
+def check_iam_role(ctx):
+    """Read the IAM role of the instance"""
     log('\nTesting for IAM role...\n')
     try:
         role = get(META_DATA + '/iam/security-credentials/').split(
             '\n')[0].strip()
     except Exception:
-        traceback.print_exc()
+        log(traceback.format_exc())
         raise Exception('''Failed to retrieve IAM role
 Please consult sk104418
 ''')
     log('Role: %s\n' % role)
+    return {'role': role}
+
 
+def check_iam_credentials(ctx):
+    """Read the credentials of the IAM role"""
     log('\nTesting for IAM credentials...\n')
     try:
-        json.loads(get(META_DATA + '/iam/security-credentials/' + role))
+        json.loads(get(META_DATA + '/iam/security-credentials/' + ctx['role']))
     except Exception:
-        traceback.print_exc()
+        log(traceback.format_exc())
         raise Exception('''Failed to retrieve IAM credentials
 Please consult sk104418
 ''')
     log('IAM credentials retrieved successfully\n')
 
+
+def check_cphaconf(ctx):
+    """Read the cluster interfaces configuration"""
     log('\nTesting cluster interface configuration...\n')
     try:
         cphaconf = json.loads(
@@ -161,13 +186,18 @@ configuration
 Please designate at least one interface as internal in the cluster topology tab
 ''')
     log('Cluster interface configuration tested successfully\n')
-    endpoint = '.'.join(['ec2', region, domain])
+    return {'cphaconf': cphaconf}
+
+
+def check_endpoint(ctx):
+    """Open a connection to the EC2 endpoint of the region"""
+    endpoint = '.'.join(['ec2', ctx['region'], ctx['domain']])
     log('\nTesting connection to ' + endpoint + ':443...\n')
     cmd = ['nc', '-w', '5', '-z', endpoint, '443']
     try:
         subprocess.check_call(cmd)
     except Exception:
-        traceback.print_exc()
+        log(traceback.format_exc())
         raise Exception('''Failed to connect to the AWS API endpoint
 Please verify that outgoing connections over TCP port 443 (HTTPS) to the AWS
 endpoint are allowed by the firewall security policy.
@@ -176,20 +206,14 @@ http://docs.aws.amazon.com/general/latest/gr/rande.html#vpc_region
 ''')
     log('The connection was opened successfully\n')
 
+
+def check_clock(ctx):
+    """Compare the system clock to the Date of the metadata service"""
     log('\nComparing the system clock to AWS\n')
-    cmd = ['curl_cli', '--request', 'PUT',
-           'http://169.254.169.254/latest/api/token',
-           '--header', 'X-aws-ec2-metadata-token-ttl-seconds: 60']
-    token = subprocess.check_output(cmd)
-    if not token:
-        raise Exception('Failed to get metadata token\n')
-    cmd = ['curl_cli', '-Igs', '--header', 'X-aws-ec2-metadata-token: '
-           + token.decode('utf-8'), META_DATA]
-    lines = subprocess.check_output(cmd).decode('utf-8')
-    for line in lines.split('\n'):
-        if line.startswith('Date: '):
-            d = line.partition('Date: ')[2]
-            t1 = datetime.datetime(*eut.parsedate(d)[:6])
+    headers = IMDS.head(urlparse(META_DATA).path)
+    for name, value in headers.items():
+        if name.lower() == 'date':
+            t1 = datetime.datetime(*eut.parsedate(value)[:6])
             t2 = datetime.datetime.utcnow()
             log('Time difference is ' + str(abs(t2 - t1)) + '\n')
             if abs(t2 - t1) > datetime.timedelta(seconds=5):
@@ -199,29 +223,33 @@ Please set up NTP.
             break
     log('The system clock is synchronized\n')
 
+
+def check_interfaces(ctx):
+    """Verify the ENIs of the cluster interfaces of both members"""
+    cphaconf = ctx['cphaconf']
+    region = ctx['region']
+    vpc_id = ctx['vpc_id']
     log('\nTesting AWS interface configuration...\n')
-    update_cphaconf(cphaconf, region)
-    for interface in cphaconf[IFS]:
-        for attr in [AWSproperties.IPADDR.value, AWSproperties.OTHER_MEMBER_IF_IP.value]:
-            try:
-                aws_obj = aws.AWS(key_file='IAM')
-                headers, body = aws_obj.request(
-                    'ec2', region, 'GET', '/?' + urlencode({
-                        'Action': 'DescribeNetworkInterfaces',
-                        'Filter.0.Name': 'vpc-id',
-                        'Filter.0.Value': vpc_id,
-                        'Filter.1.Name': 'private-ip-address',
-                        'Filter.1.Value': interface[attr],
-                    }), '')
-                if headers.get('_code') != '200':
-                    raise Exception('Failed in AWS API request')
-                interface['aws_' + attr] = aws.listify(
-                    body, 'item')['networkInterfaceSet'][0]
-            except Exception:
-                traceback.print_exc()
-                raise Exception('''Failed to retrieve interfaces from AWS
+    try:
+        aws_obj = aws.AWS(key_file='IAM')
+    except Exception:
+        log(traceback.format_exc())
+        raise Exception('''Failed to retrieve interfaces from AWS
+Please verify that the IAM role is set up correctly.
+''')
+    update_cphaconf(cphaconf, region, aws_obj)
+    attrs = [AWSproperties.IPADDR.value, AWSproperties.OTHER_MEMBER_IF_IP.value]
+    try:
+        interfaces = describe_network_interfaces(aws_obj, region, vpc_id,
+                                                 [interface[attr] for interface in cphaconf[IFS] for attr in attrs])
+    except Exception:
+        log(traceback.format_exc())
+        raise Exception('''Failed to retrieve interfaces from AWS
 Please verify that the IAM role is set up correctly.
 ''')
+    for interface in cphaconf[IFS]:
+        for attr in attrs:
+            interface['aws_' + attr] = interfaces.get(interface[attr])
 
     for interface in cphaconf[IFS]:
         for attr in [AWSproperties.IPADDR.value, AWSproperties.OTHER_MEMBER_IF_IP.value]:
@@ -237,6 +265,10 @@ of the appropriate ENI (Elastic Network Interface)
                     'Please disable source/destination check on ' +
                     'interface with address %s\n' % interface[attr])
 
+
+def check_cross_az(ctx):
+    """Cross AZ Cluster: verify the IP pairs map and that the public IPs are associated to the active member"""
+    cphaconf = ctx['cphaconf']
     if mode.load_deploy_mode() == mode.DEPLOY_MODE_CROSS_AZ:
         if not os.path.exists(CROSS_AZ_CLUSTER_SEC_IP_MAP):
             raise Exception(
@@ -244,21 +276,27 @@ of the appropriate ENI (Elastic Network Interface)
                 f"file from another member (if exists) and run {AWS_HA_CLI_COMMAND} restart on both members")
         else:
             log('\nTesting Cross AZ Cluster IP pairs map is up to date...\n')
+            with open(CROSS_AZ_CLUSTER_SEC_IP_MAP, 'rb') as f:
+                live_map = f.read()
             for interface in cphaconf[IFS]:
                 interface[AWSproperties.PEER_INTERFACE.value] = interface[f'aws_{AWSproperties.OTHER_MEMBER_IF_IP.value}']
                 interface[AWSproperties.LOCAL_INTERFACE.value] = interface[f'aws_{AWSproperties.IPADDR.value}']
                 update_cross_az_cluster_map(interface, CROSS_AZ_CLUSTER_SEC_IP_MAP_TEST, describe_flag=False)
+            with open(CROSS_AZ_CLUSTER_SEC_IP_MAP, 'rb') as f:
+                if f.read() != live_map:
+                    raise Exception(f'The test changed the file {CROSS_AZ_CLUSTER_SEC_IP_MAP}, it must only write '
+                                    f'{CROSS_AZ_CLUSTER_SEC_IP_MAP_TEST}')
             if not filecmp.cmp(CROSS_AZ_CLUSTER_SEC_IP_MAP_TEST, CROSS_AZ_CLUSTER_SEC_IP_MAP):
                 raise Exception(f'The file {CROSS_AZ_CLUSTER_SEC_IP_MAP} is not updated. Please run '
                                 f'{AWS_HA_CLI_COMMAND} restart on both members')
             log('\nTesting all private secondary IPs on active member have associated public IP...\n')
-            for interface in cphaconf[IFS]:
-                if interface[TYPE] == INTERNAL:
-                    continue
+            external_interfaces = [interface for interface in cphaconf[IFS] if interface[TYPE] != INTERNAL]
+            if external_interfaces:
                 local_state, remote_state = mode.fetch_members_state()
                 if not local_state or not remote_state:
                     raise Exception("Failed to extract local and remote members' states. Please verify 'cphaprob stat' "
                                     "command")
+            for interface in external_interfaces:
                 if local_state == ACTIVE:
                     to_check = interface[AWSproperties.PEER_INTERFACE.value]
                 elif local_state == STANDBY:
@@ -271,17 +309,121 @@ of the appropriate ENI (Elastic Network Interface)
                         "There are secondary public IPs that are associated to private IPs of the standby member. "
                         f"For moving all of them to the active member run {AWS_HA_CLI_COMMAND} restart on both members")
 
+
+class Check(object):
+    """A check of test(), started once the checks it requires passed"""
+
+    def __init__(self, name, func, requires=(), timeout=30):
+        self.name = name
+        self.func = func
+        self.requires = requires
+        self.timeout = timeout
+
+
+# Every check returns the values it adds for the checks that require it, or raises an Exception with the error message
+CHECKS = [
+    Check('environment', check_environment, timeout=5),
+    Check('dns_config', check_dns_config, ['environment'], timeout=15),
+    Check('dns_resolve', check_dns_resolve, ['environment'], timeout=15),
+    Check('metadata', check_metadata, ['environment'], timeout=15),
+    Check('iam_role', check_iam_role, ['environment'], timeout=15),
+    Check('iam_credentials', check_iam_credentials, ['iam_role'], timeout=15),
+    Check('cphaconf', check_cphaconf, ['environment'], timeout=30),
+    Check('endpoint', check_endpoint, ['metadata'], timeout=10),
+    Check('clock', check_clock, ['environment'], timeout=10),
+    Check('interfaces', check_interfaces, ['metadata', 'iam_credentials', 'cphaconf'], timeout=60),
+    Check('cross_az', check_cross_az, ['interfaces'], timeout=120),
+]
+
+PASSED = 'passed'
+FAILED = 'failed'
+SKIPPED = 'skipped'
+
+_output = threading.local()
+
+
+def _run_check(check, ctx, output, done):
+    _output.buffer = output
+    start = time.time()
+    try:
+        values = check.func(ctx)
+        result = {'status': PASSED, 'error': None, 'values': values or {}}
+    except Exception as e:
+        result = {'status': FAILED, 'error': str(e) or repr(e)}
+    result['elapsed_ms'] = round((time.time() - start) * 1000, 1)
+    result['output'] = ''.join(output)
+    done.put((check.name, result))
+
+
+def run_checks(checks, stream=True):
+    """
+    Run every check in its own thread as soon as the checks it requires passed, a check whose required check did not
+    pass is skipped. A check that does not finish within its timeout fails.
+    stream: Write the output of every check to stderr, in the order of checks, as soon as it is known
+    return: List of (check, result) in the order of checks, result: {'status', 'elapsed_ms', 'error', 'output'}
+    """
+    ctx = {}
+    results = {}
+    running = {}
+    done = queue.Queue()
+    printed = 0
+    while len(results) < len(checks):
+        for check in checks:
+            if check.name in results or check.name in running:
+                continue
+            failed = [name for name in check.requires if name in results and results[name]['status'] != PASSED]
+            if failed:
+                results[check.name] = {'status': SKIPPED, 'elapsed_ms': 0, 'output': '',
+                                       'error': 'Requires {}'.format(', '.join(failed))}
+            elif all(name in results for name in check.requires):
+                output = []
+                thread = threading.Thread(target=_run_check, args=(check, ctx, output, done), name=check.name)
+                thread.daemon = True
+                running[check.name] = (check, time.time() + check.timeout, output)
+                thread.start()
+        if running:
+            deadline = min(expiration for _, expiration, _ in running.values())
+            try:
+                name, result = done.get(timeout=max(0, deadline - time.time()))
+                running.pop(name)
+                ctx.update(result.pop('values', None) or {})
+                results[name] = result
+            except queue.Empty:
+                now = time.time()
+                for name, (check, expiration, output) in list(running.items()):
+                    if expiration <= now:
+                        # The thread of the check is left behind, it is a daemon thread
+                        running.pop(name)
+                        results[name] = {'status': FAILED, 'elapsed_ms': check.timeout * 1000,
+                                         'output': ''.join(output),
+                                         'error': 'Timed out after {} seconds\n'.format(check.timeout)}
+        while stream and printed < len(checks) and checks[printed].name in results:
+            sys.stderr.write(results[checks[printed].name]['output'])
+            printed += 1
+    return [(check, results[check.name]) for check in checks]
+
+
+def test():
+    """
+    Run all the checks.
+    return: List of (check, result) as returned by run_checks. Exception with the errors of the failed checks if any
+    of them failed.
+    """
+    results = run_checks(CHECKS)
+    errors = [result['error'] for _, result in results if result['status'] == FAILED]
+    if errors:
+        raise Exception('\n'.join(errors))
     log('\nAll tests were successful!\n')
+    return results
 
 
-def update_cphaconf(cphaconf: dict, region: str) -> None:
+def update_cphaconf(cphaconf: dict, region: str, aws_obj) -> None:
     """
     Update the cphaconf dictionary to contain only interfaces that appear in both the original cphaconf dictionary and in
     AWS portal after fetching them by using DescribeNetworkInterfaces request with the instance-id filter
     """
-    instance_id = aws.metadata('/latest/meta-data/instance-id')
+    instance_id = IMDS.get('/latest/meta-data/instance-id')
     try:
-        aws_obj = aws.AWS(key_file='IAM')
         headers, body = aws_obj.request(
             'ec2', region, 'GET', '/?' + urlencode({
                 'Action': 'DescribeNetworkInterfaces',
@@ -300,8 +442,40 @@ def update_cphaconf(cphaconf: dict, region: str) -> None:
     cphaconf[IFS] = [interface for interface in cphaconf[IFS] if interface[AWSproperties.IPADDR.value] in ec2_private_ips]
 
 
+def parse_args():
+    parser = argparse.ArgumentParser(description='Test the cluster configuration in AWS')
+    parser.add_argument('--json', action='store_true', default=False,
+                        help='print the status and elapsed milliseconds of every check as JSON')
+    return parser.parse_args()
+
+
+def describe_network_interfaces(aws_obj, region, vpc_id, addresses):
+    """
+    input: aws.AWS client, region, VPC id and private ips of both members
+    return: Dict where key is a private ip and its value the description of the interface of vpc_id holding that ip
+    """
+    def send_request(query):
+        headers, body = aws_obj.request('ec2', region, 'GET', '/?' + query, '')
+        if headers.get('_code') != '200':
+            raise Exception('Failed in AWS API request')
+        return body
+
+    described = describe_network_interfaces_by_ip([(vpc_id, ip) for ip in addresses], send_request)
+    return {ip: interface for (_, ip), interface in described.items()}
+
+
 def main():
-    """#TODO fixDocstring"""
+    """Run the checks, exit with 1 if any of them failed"""
+    args = parse_args()
+    if args.json:
+        start = time.time()
+        results = run_checks(CHECKS, stream=False)
+        passed = all(result['status'] == PASSED for _, result in results)
+        print(json.dumps({'passed': passed, 'elapsed_ms': round((time.time() - start) * 1000, 1),
+                          'checks': [{'name': check.name, 'status': result['status'],
+                                      'elapsed_ms': result['elapsed_ms'], 'error': result['error']}
+                                     for check, result in results]}, indent=4))
+        sys.exit(0 if passed else 1)
     try:
         test()
     except Exception:
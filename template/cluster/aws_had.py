@@ -4,18 +4,30 @@
 
 import os
 import subprocess
-import multiprocessing
 import re
 import json
 import argparse
 import logging
 import logging.handlers
+import atexit
 import socket
 import select
 import time
+import threading
 import traceback
 import errno
+import copy
+import fcntl
+import stat
+import struct
+import random
 import sys
+import ssl
+import hashlib
+import hmac
+import calendar
+import xml.etree.ElementTree as ElementTree
+from concurrent.futures import ThreadPoolExecutor
 import aws_ha_mode as mode
 import ipaddress
 from aws_ha_globals import AWS_HA_TEST_COMMAND, CLOUD_VERSION_PATH, CLOUD_VERSION_JSON_PATH, MIGRATE_LOG_FILE, MIGRATED, \
@@ -43,13 +55,52 @@ except ImportError:
     import common.cpdiag.cloud_features_telemetry_config as cloud_features_config
 
 if sys.version_info < (3,):
-    from urllib import urlencode
-    from urlparse import urlparse
+    from urllib import urlencode, quote
+    from urlparse import urlparse, parse_qsl
+    import httplib as http_client
+    import Queue as queue
 else:
-    from urllib.parse import urlencode, urlparse
+    from urllib.parse import urlencode, urlparse, parse_qsl, quote
+    import http.client as http_client
+    import queue
 
 cphaconf = {}
+AWS_HAD_CONF = '/etc/fw/conf/aws_had.json'
+# aws_had tunables, they can be overridden in AWS_HAD_CONF which is reloaded upon RECONF
+HAD_CONF_DEFAULTS = {
+    'calls_in_parallel': False,
+    'parallel_pool_size': 10,
+    'route_index_max_age': 30,
+    'failover_plan_max_age': 60,
+    'failover_plan_rebuild_interval': 30,
+    'keep_alive_client': True,
+    'ec2_endpoint': '',
+    'ec2_ca_bundle': '',
+    'ec2_max_idle_connections': 10,
+    'ec2_idle_timeout': 20,
+    'ec2_max_attempts': 5,
+    'ec2_retry_base_delay': 0.2,
+    'ec2_retry_max_delay': 5,
+    'ec2_rate_limit': 50,
+    'ec2_burst': 200,
+    'event_coalesce_window': 0.02,
+    'idle_poll_interval': 30,
+    'active_poll_interval': 5,
+    'dynamic_objects_pool_size': 4,
+    'eip_association_pool_size': 8,
+    'imds_endpoint': '',
+    'failover_trace': True,
+    'log_body_max_chars': 1024,
+    'log_queue_size': 10000,
+    'route_tables_page_size': 100,
+    'route_tables_eni_filter': True,
+    'route_tables_tag': '',
+    'ec2_prewarm_interval': 10,
+    'ec2_prewarm_connections': 2,
+    'ec2_dns_ttl': 60
+}
 logFilename = '/etc/fw/log/aws_had.elg'
+FAILOVER_TRACE_FILE = '/etc/fw/log/aws_had_trace.jsonl'
 handler = logging.handlers.RotatingFileHandler(
     logFilename, maxBytes=1000000, backupCount=10)
 handler.setFormatter(logging.Formatter(
@@ -57,6 +108,8 @@ handler.setFormatter(logging.Formatter(
 logger = logging.getLogger('AWS-CP-HA')
 logger.setLevel(logging.INFO)
 logger.addHandler(handler)
+# See start_log_listener
+_log_listener = None
 
 conf = {
     'EC2_REGION': None,
@@ -65,17 +118,296 @@ conf = {
     'replace_by_interface': True,
     'always_replace_default': False,
     'replace_all_route_tables': True,
-    'calls_in_parallel': False,
     'cluster_mode': mode.CLUSTER_MODE_HIGH_AVAILABILITY,
     'deploy_mode': mode.DEPLOY_MODE_SINGLE_AZ,
     'cross_az_cluster_sec_ips_map_up_to_date': False
 }
+conf.update(HAD_CONF_DEFAULTS)
 
 _cloud_config_utils = None
 _cross_az_cluster_ip_map = {}
+_cross_az_pairs = None
 _aws = None
+_ec2_client = None
+# See start_prewarm
+_prewarm_thread = None
+_prewarm_wakeup = threading.Event()
+_executor = None
+_executor_size = None
 MIGRATE_OBJECT = MigrateParameters()
 pool_results = []
+_cluster_status = None
+_fw_os_proxy_port = None
+# Content and (mtime, size) of the json files last written by write_json_content_to_file
+_written_files = {}
+_written_files_lock = threading.Lock()
+# Outcome of the last poll, settled: it completed and left nothing to do (standby, or active and DONE reported)
+# should_work: the member had to work (None if the members state could not be read)
+_poll_status = {'time': 0, 'settled': False, 'active': None, 'states': None, 'should_work': None}
+# See load_metadata_cache
+_metadata_cache = None
+_metadata_cache_lock = threading.Lock()
+
+
+# See FailoverTrace
+_failover_trace = None
+_trace_local = threading.local()
+_trace_logger = None
+
+
+class Span(object):
+    """A timed phase of a failover, recorded to its FailoverTrace when it ends"""
+    __slots__ = ('trace', 'name', 'attrs', 'start')
+
+    def __init__(self, trace, name, attrs):
+        self.trace = trace
+        self.name = name
+        self.attrs = attrs
+        self.start = None
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        if exc_type is not None:
+            self.attrs['error'] = '{}: {}'.format(exc_type.__name__, exc_value)[:200]
+        self.trace.add(self.name, self.start, time.perf_counter(), self.attrs)
+        return False
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+
+class _NoSpan(object):
+    """Stands for a Span when no failover is traced"""
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        return False
+
+    def set(self, **attrs):
+        pass
+
+
+_NO_SPAN = _NoSpan()
+
+
+def trace_span(name, **attrs):
+    """return: Context manager timing a phase of the failover traced by this thread, a no-op if there is none"""
+    trace = getattr(_trace_local, 'trace', None)
+    if trace is None:
+        return _NO_SPAN
+    return Span(trace, name, attrs)
+
+
+class FailoverTrace(object):
+    """
+    Timeline of a failover: the spans of the polls from the one that reported IN_PROGRESS up to the one that reported
+    DONE (the EC2 calls sent by the executor threads as well), with their offsets from the start of the first poll.
+    It is written as one JSON line to FAILOVER_TRACE_FILE if the failover changed anything.
+    """
+    MAX_SPANS = 10000
+    MAX_AGE = 300
+
+    def __init__(self):
+        self.time = time.time()
+        self.start = time.perf_counter()
+        self.lock = threading.Lock()
+        self.spans = []
+        self.dropped = 0
+        self.changes = 0
+        self.polls = 0
+        self.in_progress = False
+        self.done = False
+
+    def add(self, name, start, end, attrs):
+        span = {'name': name, 'start_ms': round((start - self.start) * 1000, 3),
+                'end_ms': round((end - self.start) * 1000, 3), 'thread': threading.current_thread().name}
+        span.update(attrs)
+        with self.lock:
+            if name == 'ec2' and 'error' not in attrs and not (attrs.get('action') or '').startswith('Describe'):
+                self.changes += 1
+            if len(self.spans) < self.MAX_SPANS:
+                self.spans.append(span)
+            else:
+                self.dropped += 1
+
+    def age(self):
+        return time.perf_counter() - self.start
+
+    def record(self, outcome):
+        with self.lock:
+            spans = list(self.spans)
+        return {'time': time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(self.time)) +
+                '.{:03d}Z'.format(int(self.time * 1000) % 1000),
+                'outcome': outcome, 'duration_ms': round(self.age() * 1000, 3), 'polls': self.polls,
+                'changes': self.changes, 'dropped_spans': self.dropped, 'spans': spans}
+
+
+def begin_poll_trace():
+    """return: The trace of the failover in progress, or a new one, set as the trace of this thread"""
+    trace = _failover_trace or FailoverTrace()
+    _trace_local.trace = trace
+    return trace
+
+
+def end_poll_trace(trace, should_work):
+    """Keep the trace while the failover is in progress, write it once it is done or stopped"""
+    global _failover_trace
+    _trace_local.trace = None
+    trace.polls += 1
+    if not trace.in_progress:
+        _failover_trace = None
+        return
+    if trace.done or not should_work or trace.age() > trace.MAX_AGE:
+        _failover_trace = None
+        if trace.changes:
+            write_failover_trace(trace.record('done' if trace.done else 'stopped' if not should_work else 'timeout'))
+        return
+    _failover_trace = trace
+
+
+def write_failover_trace(record):
+    global _trace_logger
+    if not conf['failover_trace']:
+        return
+    try:
+        if _trace_logger is None:
+            trace_handler = logging.handlers.RotatingFileHandler(FAILOVER_TRACE_FILE, maxBytes=1000000, backupCount=5)
+            trace_handler.setFormatter(logging.Formatter('%(message)s'))
+            trace_logger = logging.getLogger('AWS-CP-HA-TRACE')
+            trace_logger.setLevel(logging.INFO)
+            trace_logger.propagate = False
+            trace_logger.addHandler(trace_handler)
+            _trace_logger = trace_logger
+        _trace_logger.info(json.dumps(record, separators=(',', ':')))
+    except (OSError, ValueError):
+        logger.error('Failed to write the failover trace\n{}'.format(traceback.format_exc()))
+
+
+def _call_traced(trace, fn, *args, **kwargs):
+    _trace_local.trace = trace
+    try:
+        return fn(*args, **kwargs)
+    finally:
+        _trace_local.trace = None
+
+
+class TracedThreadPoolExecutor(ThreadPoolExecutor):
+    """ThreadPoolExecutor whose calls record their spans to the failover trace of the thread that submitted them"""
+
+    def submit(self, fn, *args, **kwargs):
+        trace = getattr(_trace_local, 'trace', None)
+        if trace is None:
+            return super(TracedThreadPoolExecutor, self).submit(fn, *args, **kwargs)
+        return super(TracedThreadPoolExecutor, self).submit(_call_traced, trace, fn, *args, **kwargs)
+
+
+class LogJSON(object):
+    """Log argument written as the JSON of a value, cut after limit characters without encoding the rest of it"""
+    __slots__ = ('value', 'limit')
+
+    def __init__(self, value, limit=None):
+        self.value = value
+        self.limit = limit
+
+    def __str__(self):
+        if not self.limit:
+            return json.dumps(self.value)
+        parts = []
+        try:
+            _encode_json_until(self.value, parts, [self.limit])
+        except _LogJSONCut:
+            return ''.join(parts)[:self.limit] + '... (cut at {} characters)'.format(self.limit)
+        return ''.join(parts)
+
+
+class _LogJSONCut(Exception):
+    pass
+
+
+def _encode_json_until(value, parts, budget):
+    """Append the JSON of value to parts, raise _LogJSONCut once more than budget[0] characters were appended"""
+    if isinstance(value, dict):
+        items = value.items()
+        chunks = ('{', '}')
+    elif isinstance(value, (list, tuple)):
+        items = ((None, item) for item in value)
+        chunks = ('[', ']')
+    else:
+        items = None
+        chunks = (json.dumps(value, default=str), '')
+    parts.append(chunks[0])
+    budget[0] -= len(chunks[0])
+    if items is not None:
+        for i, (key, item) in enumerate(items):
+            if budget[0] < 0:
+                raise _LogJSONCut()
+            chunk = (', ' if i else '') + ('' if key is None else json.dumps(str(key)) + ': ')
+            parts.append(chunk)
+            budget[0] -= len(chunk)
+            _encode_json_until(item, parts, budget)
+        parts.append(chunks[1])
+        budget[0] -= 1
+    if budget[0] < 0:
+        raise _LogJSONCut()
+
+
+class _LogQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that drops records, and logs how many, rather than wait while the queue is full"""
+
+    def __init__(self, log_queue):
+        super(_LogQueueHandler, self).__init__(log_queue)
+        self.dropped = 0
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+            return
+        if self.dropped:
+            notice = logging.LogRecord(record.name, logging.WARNING, __file__, 0,
+                                       '{} log records were dropped, the log file was written too slowly'.format(
+                                           self.dropped), None, None)
+            self.dropped = 0
+            try:
+                self.queue.put_nowait(notice)
+            except queue.Full:
+                pass
+
+
+def start_log_listener():
+    """
+    Write the records of the daemon logger from a background thread, so that the fail over never waits on the log
+    file. Records are dropped if more than log_queue_size are waiting to be written.
+    """
+    global _log_listener
+    if _log_listener:
+        return
+    log_queue = queue.Queue(max(1, int(conf['log_queue_size'])))
+    _log_listener = logging.handlers.QueueListener(log_queue, handler, respect_handler_level=True)
+    _log_listener.start()
+    logger.addHandler(_LogQueueHandler(log_queue))
+    logger.removeHandler(handler)
+    atexit.register(stop_log_listener)
+
+
+def stop_log_listener():
+    """Write the records left in the queue, the next ones are written by the caller thread again"""
+    global _log_listener
+    if not _log_listener:
+        return
+    logger.addHandler(handler)
+    for h in list(logger.handlers):
+        if isinstance(h, _LogQueueHandler):
+            logger.removeHandler(h)
+    _log_listener.stop()
+    _log_listener = None
 
 
 class Server(object):
@@ -119,40 +451,787 @@ class Server(object):
         with open(self.pidFileName, 'w') as f:
             f.write(str(os.getpid()))
 
+    def _receive(self, events):
+        """
+        Read the pending datagrams into events: {event name: member state}. Senders may carry the new member state
+        in the datagram ("CHANGED:active"), the state is None when any of the coalesced datagrams did not.
+        """
+        while True:
+            try:
+                dgram = self.sock.recv(1024).decode('utf-8')
+            except socket.error as e:
+                if e.args[0] in [errno.EAGAIN, errno.EWOULDBLOCK]:
+                    return events
+                raise
+            logger.debug('received: %s', dgram)
+            name, _, state = dgram.strip().partition(':')
+            state = state.strip().lower() or None
+            if state:
+                self.state_events = True
+            elif name == 'CHANGED':
+                self.stateless_events = True
+            if name in events and events[name] is None:
+                continue
+            events[name] = state
+
+    def _coalesce(self, events, window):
+        """Add the events received within window seconds, so that a burst of events is handled once"""
+        deadline = time.monotonic() + window
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return
+            rl, wl, xl = select.select([self.sock], [], [], remaining)
+            if rl:
+                self._receive(events)
+
     def run(self):
         """Run events server and handles events"""
         handlers = [('RECONF', reconf), ('CHANGED', poll)]
+        self.state_events = False
+        # A CHANGED datagram without state was received: some sender does not include it, and a change it signals in
+        # a datagram that gets lost is only found by comparing the members state of "cphaprob stat" on idle ticks
+        self.stateless_events = False
         while True:
             rl, wl, xl = select.select([self.sock], [], [], self.timeout)
-            events = set()
-            while True:
-                try:
-                    dgram = self.sock.recv(1024).decode('utf-8')
-                    logger.debug('received: {}'.format(dgram))
-                    events.add(dgram)
-                except socket.error as e:
-                    if e.args[0] in [errno.EAGAIN, errno.EWOULDBLOCK]:
-                        events.add('CHANGED')
-                        break
-                    raise
+            events = self._receive({})
+            if events and conf['event_coalesce_window'] > 0:
+                self._coalesce(events, conf['event_coalesce_window'])
+            if events:
+                _members_state_reader.invalidate()
+            if not events and is_poll_needed(probe=self.stateless_events or not self.state_events):
+                events['CHANGED'] = None
             for h in handlers:
-                if h[0] in events:
-                    h[1]()
+                if h[0] not in events:
+                    continue
+                if h[0] == 'CHANGED' and events['CHANGED'] and not is_poll_needed(state=events['CHANGED']):
+                    logger.debug('Member state %s did not change', events['CHANGED'])
+                    continue
+                h[1]()
             if 'STOP' in events:
                 logger.debug('Leaving...')
                 break
 
 
+class RouteIndex(object):
+    """
+    Reverse index of the VPC route tables: ENI ID -> routes (route table ID, CIDR, prefix list) pointing to it.
+    It is filled while the member is standby, so upon fail over only the routes of the peer ENI are replaced
+    without describing and walking all the route tables of the VPC.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._by_eni = {}
+        self._tables = {}
+        self._refreshed = {}
+        self._scopes = {}
+        self._moves = 0
+        # Incremented whenever an indexed route changes, see FailoverPlan
+        self.version = 0
+
+    def invalidate(self):
+        """Drop the whole index (called upon RECONF)"""
+        with self._lock:
+            self.version += 1
+            self._by_eni.clear()
+            self._tables.clear()
+            self._refreshed.clear()
+            self._scopes.clear()
+
+    def invalidate_route_table(self, route_table_id):
+        """Force the next refresh of the VPC of route_table_id to describe its route tables again"""
+        with self._lock:
+            for vpc_id, tables in self._tables.items():
+                if route_table_id in tables:
+                    self._refreshed.pop(vpc_id, None)
+
+    def is_fresh(self, vpc_id, max_age, scope=None):
+        """return: True if vpc_id was indexed less than max_age seconds ago, with the same scope"""
+        with self._lock:
+            refreshed = self._refreshed.get(vpc_id)
+            same_scope = self._scopes.get(vpc_id) == scope
+        return refreshed is not None and same_scope and time.time() - refreshed < max_age
+
+    def refresh(self, vpc_id, route_tables, scope=None):
+        """
+        input: vpc id, its DescribeRouteTables result and the scope of that result (the ENIs it was filtered by)
+        Re-index only the route tables that were added, removed or changed since the previous refresh. The VPC is not
+        marked as fresh if routes were moved while its route tables were described, the result may predate them.
+        """
+        with self._lock:
+            moves = self._moves
+        tables = {}
+        for route_table in route_tables:
+            entries = set()
+            for route in route_table.get('routeSet') or []:
+                cidr = route.get(AWSproperties.CIDR.value)
+                eni = route.get(AWSproperties.ENI_ID.value)
+                prefix_list = route.get(AWSproperties.PREFIX_LIST_ID.value)
+                if (not cidr and not prefix_list) or not eni:
+                    continue
+                entries.add((cidr, prefix_list, eni))
+            tables[route_table[AWSproperties.RTB_ID.value]] = frozenset(entries)
+        with self._lock:
+            old_tables = self._tables.get(vpc_id, {})
+            changed = 0
+            for rtb_id in set(old_tables) | set(tables):
+                old_entries = old_tables.get(rtb_id, frozenset())
+                new_entries = tables.get(rtb_id, frozenset())
+                if old_entries == new_entries:
+                    continue
+                changed += 1
+                for cidr, prefix_list, eni in old_entries - new_entries:
+                    self._by_eni.get(eni, set()).discard((rtb_id, cidr, prefix_list))
+                for cidr, prefix_list, eni in new_entries - old_entries:
+                    self._by_eni.setdefault(eni, set()).add((rtb_id, cidr, prefix_list))
+            self._tables[vpc_id] = tables
+            if changed:
+                self.version += 1
+            if self._moves == moves:
+                self._refreshed[vpc_id] = time.time()
+            else:
+                self._refreshed.pop(vpc_id, None)
+            self._scopes[vpc_id] = scope
+        logger.debug('Route index of {} refreshed: {} route tables, {} changed'.format(vpc_id, len(tables), changed))
+
+    def points_to_any(self, enis):
+        """return: True if any indexed route points to one of enis"""
+        with self._lock:
+            return any(self._by_eni.get(eni) for eni in enis)
+
+    def lookup(self, eni):
+        """return: sorted list of (route table id, cidr, prefix list id) pointing to eni"""
+        with self._lock:
+            return sorted(self._by_eni.get(eni, ()), key=lambda entry: tuple(e or '' for e in entry))
+
+    def move(self, route_table_id, cidr, prefix_list, src_eni, dst_eni):
+        """
+        Update the index after a route of route_table_id was replaced to point to dst_eni.
+        The VPC of the route table is described again on the next refresh to confirm the index.
+        """
+        with self._lock:
+            self._moves += 1
+            self.version += 1
+            if src_eni:
+                self._by_eni.get(src_eni, set()).discard((route_table_id, cidr, prefix_list))
+            self._by_eni.setdefault(dst_eni, set()).add((route_table_id, cidr, prefix_list))
+            for vpc_id, tables in self._tables.items():
+                if route_table_id in tables:
+                    entries = {e for e in tables[route_table_id] if e[:2] != (cidr, prefix_list)}
+                    entries.add((cidr, prefix_list, dst_eni))
+                    tables[route_table_id] = frozenset(entries)
+                    self._refreshed.pop(vpc_id, None)
+
+
+_route_index = RouteIndex()
+
+
+class FailoverPlan(object):
+    """
+    Ready to run list of the mutating calls (ReplaceRoute, AssignPrivateIpAddresses, AssociateAddress) that the
+    member makes when it becomes active. The standby member rebuilds it in the background, so upon fail over the
+    plan is executed without any Describe* call before the traffic is moved.
+    """
+    def __init__(self, generation):
+        self.generation = generation
+        self.created = time.time()
+        # replace_route() arguments
+        self.routes = []
+        # (assign_private_ip_addresses / associate_public_ip_addresses, interface snapshot)
+        self.interfaces = []
+        # The peer interfaces described for the plan, and the version of the route index it was built from
+        self.peers = None
+        self.route_index_version = None
+
+    def same_topology(self, other):
+        """return: True if other was built from the same peer interfaces and planned the same routes"""
+        return self.peers == other.peers and self.routes == other.routes
+
+    def age(self):
+        return time.time() - self.created
+
+
+_failover_plan = None
+_failover_plan_lock = threading.Lock()
+_failover_plan_builder = None
+# Topology generation and time of the last failover plan build, see schedule_failover_plan
+_failover_plan_scheduled = (None, 0)
+_topology_generation = 0
+
+
+IMDS_ENDPOINT = 'http://169.254.169.254'
+# Instance metadata that does not change while the instance exists
+INTERFACE_METADATA_ATTRIBUTES = ['vpc-id', 'subnet-id', 'interface-id']
+
+
+class IMDSError(Exception):
+    """Error returned by the instance metadata service, status is the HTTP status code"""
+    def __init__(self, msg, status=None):
+        super(IMDSError, self).__init__(msg)
+        self.status = status
+
+
+class IMDSClient(object):
+    """
+    IMDSv2 client. The session token is requested once and reused until token_margin seconds before its TTL expires
+    (or the service rejects it), instead of a new token for every read. It is safe to use from several threads.
+    proxy: "host:port" of an HTTP proxy the requests are sent through, aws_had reads the metadata service directly
+    """
+    def __init__(self, endpoint='', timeout=2, token_ttl=21600, token_margin=60, proxy=None):
+        self.endpoint = endpoint
+        self.host = urlparse(endpoint or IMDS_ENDPOINT).netloc
+        self.proxy = proxy
+        self.timeout = timeout
+        self.token_ttl = token_ttl
+        self.token_margin = token_margin
+        self._lock = threading.Lock()
+        self._token = None
+        self._token_expiration = 0
+
+    def _request(self, method, path, headers):
+        """return: Status, body and headers of the response"""
+        if self.proxy:
+            conn = http_client.HTTPConnection(self.proxy, timeout=self.timeout)
+            path = 'http://{}{}'.format(self.host, path)
+        else:
+            conn = http_client.HTTPConnection(self.host, timeout=self.timeout)
+        try:
+            conn.request(method, path, headers=headers)
+            response = conn.getresponse()
+            return response.status, response.read().decode('utf-8'), dict(response.getheaders())
+        finally:
+            conn.close()
+
+    def _get_token(self, renew=False):
+        with self._lock:
+            if renew or not self._token or time.time() > self._token_expiration:
+                status, body, _ = self._request('PUT', '/latest/api/token',
+                                                {'X-aws-ec2-metadata-token-ttl-seconds': str(self.token_ttl)})
+                if status != 200:
+                    raise IMDSError('Failed to get an IMDSv2 token: {}'.format(status), status)
+                self._token = body
+                self._token_expiration = time.time() + self.token_ttl - self.token_margin
+            return self._token
+
+    def _send(self, method, path, check=True):
+        for attempt in range(2):
+            status, body, headers = self._request(method, path,
+                                                  {'X-aws-ec2-metadata-token': self._get_token(renew=attempt > 0)})
+            if status != 401:
+                break
+        if check and status != 200:
+            raise IMDSError('{} {}'.format(status, path), status)
+        return body, headers
+
+    def get(self, path):
+        """
+        path: Metadata path, as passed to aws.metadata ("/latest/meta-data/instance-id")
+        return: The value, IMDSError if it is not found
+        """
+        return self._send('GET', path)[0]
+
+    def head(self, path):
+        """return: Headers of the response to a HEAD request of the metadata path (its Date for example), whatever its
+        status is"""
+        return self._send('HEAD', path, check=False)[1]
+
+
+_imds_client = IMDSClient()
+
+
+def metadata(path):
+    """
+    Read an instance metadata path with the IMDSv2 client, or with aws.metadata if the metadata service could not be
+    reached by it.
+    return: The value as str, RequestException or IMDSError if it is not found
+    """
+    try:
+        return _imds_client.get(path)
+    except (OSError, http_client.HTTPException) as e:
+        logger.debug('Failed to read {} ({}), reading it with aws.py'.format(path, e))
+    value = aws.metadata(path)
+    return value if isinstance(value, str) else value.decode('utf-8')
+
+
+def configure_imds_client():
+    """Create the IMDSv2 client again if imds_endpoint was changed"""
+    global _imds_client
+    if _imds_client.endpoint != conf['imds_endpoint']:
+        _imds_client = IMDSClient(conf['imds_endpoint'])
+
+
+def get_metadata_cache_path():
+    return os.path.join(os.environ['FWDIR'], 'tmp', 'aws_had_metadata.json')
+
+
+def load_metadata_cache():
+    """
+    return: The cache of the metadata that does not change while the instance exists (availability zone, and the
+    INTERFACE_METADATA_ATTRIBUTES per MAC address), read from its file if that was written for this instance:
+    {"instance-id": "i-...", "availability-zone": "us-east-1a", "macs": {"0e:...": {"vpc-id": "vpc-...", ...}}}
+    None if the instance id could not be read.
+    """
+    global _metadata_cache
+    with _metadata_cache_lock:
+        if _metadata_cache is None:
+            try:
+                instance_id = metadata('{}/instance-id'.format(aws.META_DATA)).strip()
+            except (RequestException, IMDSError, OSError):
+                logger.error('Failed to read the instance id\n{}'.format(traceback.format_exc()))
+                return None
+            cache = None
+            try:
+                with open(get_metadata_cache_path()) as f:
+                    cache = json.load(f)
+            except (OSError, ValueError):
+                pass
+            if not isinstance(cache, dict) or cache.get('instance-id') != instance_id or \
+                    not isinstance(cache.get('macs'), dict):
+                cache = {'instance-id': instance_id, 'macs': {}}
+            _metadata_cache = cache
+        return _metadata_cache
+
+
+def save_metadata_cache():
+    try:
+        write_json_content_to_file(get_metadata_cache_path(), _metadata_cache)
+    except OSError:
+        logger.error('Failed to write {}\n{}'.format(get_metadata_cache_path(), traceback.format_exc()))
+
+
+def get_instance_id():
+    """return: Id of this instance"""
+    cache = load_metadata_cache()
+    if cache:
+        return cache['instance-id']
+    return metadata('{}/instance-id'.format(aws.META_DATA)).strip()
+
+
+class StaticCredentials(object):
+    """Access keys given in remote mode"""
+    def __init__(self, access_key, secret_key):
+        self._credentials = (access_key, secret_key, None)
+
+    def refresh(self, ahead=0):
+        pass
+
+    def get(self):
+        return self._credentials
+
+
+class RoleCredentials(object):
+    """Temporary credentials of the instance IAM role, read from the instance metadata and renewed before they expire"""
+    def __init__(self, refresh_margin=300):
+        self.refresh_margin = refresh_margin
+        self._lock = threading.Lock()
+        self._credentials = None
+        self._expiration = 0
+
+    @staticmethod
+    def _metadata(path):
+        return metadata('{}/iam/security-credentials/{}'.format(aws.META_DATA, path)).strip()
+
+    def refresh(self, ahead=0):
+        """Read the credentials again if they expire within refresh_margin + ahead seconds"""
+        with self._lock:
+            if not self._credentials or time.time() > self._expiration - self.refresh_margin - ahead:
+                role = self._metadata('').split('\n')[0].strip()
+                data = json.loads(self._metadata(role))
+                self._credentials = (data['AccessKeyId'], data['SecretAccessKey'], data.get('Token'))
+                self._expiration = calendar.timegm(time.strptime(data['Expiration'], '%Y-%m-%dT%H:%M:%SZ'))
+                logger.debug('Credentials of role {} expire at {}'.format(role, data['Expiration']))
+            return self._credentials
+
+    def get(self):
+        return self.refresh()
+
+
+def _xml_to_dict(element):
+    """Convert an EC2 response element the way aws.py does: repeated tags become a list, empty tags become ''"""
+    children = list(element)
+    if not children:
+        return element.text or ''
+    result = {}
+    for child in children:
+        tag = child.tag.split('}', 1)[-1]
+        value = _xml_to_dict(child)
+        if tag not in result:
+            result[tag] = value
+        elif isinstance(result[tag], list):
+            result[tag].append(value)
+        else:
+            result[tag] = [result[tag], value]
+    return result
+
+
+class EC2Client(object):
+    """
+    EC2 Query API client keeping persistent (keep-alive) connections to the regional endpoint,
+    so that consecutive calls do not pay a new TCP and TLS handshake each. It is thread safe: every call
+    takes an idle connection from the pool (or opens a new one) and returns it when the response was read.
+    """
+    API_VERSION = '2016-11-15'
+
+    def __init__(self, region, credentials, endpoint=None, proxy=None, max_idle=10, idle_timeout=20,
+                 ca_bundle=None):
+        self.region = region
+        self.credentials = credentials
+        if not endpoint:
+            domain = 'amazonaws.com.cn' if region.startswith('cn-') else 'amazonaws.com'
+            endpoint = 'https://ec2.{}.{}'.format(region, domain)
+        url = urlparse(endpoint if '://' in endpoint else 'https://' + endpoint)
+        self.scheme = url.scheme
+        self.host = url.hostname
+        self.port = url.port or (443 if self.scheme == 'https' else 80)
+        self.proxy = proxy
+        self.max_idle = max_idle
+        self.idle_timeout = idle_timeout
+        self.ssl_context = ssl.create_default_context(cafile=ca_bundle or None)
+        self._idle = queue.LifoQueue()
+        # Addresses of the endpoint resolved by resolve(), and when
+        self._addresses = None
+        self._resolved = 0
+
+    @property
+    def host_header(self):
+        if self.port in (443, 80):
+            return self.host
+        return '{}:{}'.format(self.host, self.port)
+
+    def set_proxy(self, proxy):
+        """Change the proxy ("host:port" or None), connections opened through the previous one are dropped"""
+        if proxy != self.proxy:
+            self.proxy = proxy
+            self.close()
+
+    def close(self):
+        """Close all idle connections"""
+        while True:
+            try:
+                conn, _ = self._idle.get_nowait()
+            except queue.Empty:
+                return
+            conn.close()
+
+    def _connect(self):
+        if self.proxy:
+            proxy_host, proxy_port = self.proxy.rsplit(':', 1)
+            host, port = proxy_host, int(proxy_port)
+        else:
+            host, port = self.host, self.port
+        if self.scheme == 'https':
+            conn = http_client.HTTPSConnection(host, port, timeout=MAX_TIMEOUT, context=self.ssl_context)
+        else:
+            conn = http_client.HTTPConnection(host, port, timeout=MAX_TIMEOUT)
+        if self.proxy:
+            conn.set_tunnel(self.host, self.port)
+        elif self._addresses:
+            # The TLS server name and the Host header stay the endpoint name
+            conn._create_connection = self._create_connection
+        return conn
+
+    def _create_connection(self, address, timeout=MAX_TIMEOUT, source_address=None):
+        """Connect to an address of the endpoint found by resolve(), resolve its name again if none answers"""
+        for resolved in self._addresses or ():
+            try:
+                return socket.create_connection(resolved, timeout, source_address)
+            except OSError:
+                continue
+        self._addresses = None
+        return socket.create_connection(address, timeout, source_address)
+
+    def resolve(self, ttl=60):
+        """Resolve the endpoint name if it was not in the last ttl seconds, new connections use the addresses found"""
+        if self.proxy or (self._addresses and time.time() - self._resolved < ttl):
+            return
+        infos = socket.getaddrinfo(self.host, self.port, 0, socket.SOCK_STREAM)
+        self._addresses = [info[4][:2] for info in infos]
+        self._resolved = time.time()
+
+    def prewarm(self, connections=1, fresh_for=0, ahead=0, dns_ttl=60):
+        """
+        Get the next calls ready to be sent at once: renew the credentials if they expire within ahead seconds (more
+        than refresh_margin), resolve the endpoint name again after dns_ttl seconds, and open connections (TCP and TLS
+        handshakes done) until that many idle ones can still be used for fresh_for seconds. Idle connections older than
+        idle_timeout are closed first: calls take the newest ones, so these would otherwise stay in the pool for good.
+        return: Number of connections opened
+        """
+        self.credentials.refresh(ahead)
+        self.resolve(dns_ttl)
+        with self._idle.mutex:
+            now = time.time()
+            expired = [conn for conn, last_used in self._idle.queue if now - last_used >= self.idle_timeout]
+            self._idle.queue[:] = [(conn, last_used) for conn, last_used in self._idle.queue
+                                   if now - last_used < self.idle_timeout]
+            live = len(self._idle.queue)
+            fresh = sum(1 for _, last_used in self._idle.queue if now - last_used < self.idle_timeout - fresh_for)
+        for conn in expired:
+            conn.close()
+        opened = 0
+        for _ in range(min(connections - fresh, self.max_idle - live)):
+            conn = self._connect()
+            try:
+                conn.connect()
+            except Exception:
+                conn.close()
+                raise
+            self._release(conn)
+            opened += 1
+        return opened
+
+    def _acquire(self):
+        """return: a connection and whether it was already used"""
+        while True:
+            try:
+                conn, last_used = self._idle.get_nowait()
+            except queue.Empty:
+                return self._connect(), False
+            if time.time() - last_used < self.idle_timeout:
+                return conn, True
+            conn.close()
+
+    def _release(self, conn):
+        if self._idle.qsize() < self.max_idle:
+            self._idle.put((conn, time.time()))
+        else:
+            conn.close()
+
+    def _sign(self, method, query, payload):
+        """Sign the request with AWS Signature Version 4, return: the request headers"""
+        access_key, secret_key, token = self.credentials.get()
+        now = time.gmtime()
+        amz_date = time.strftime('%Y%m%dT%H%M%SZ', now)
+        date = time.strftime('%Y%m%d', now)
+        headers = {'host': self.host_header, 'x-amz-date': amz_date}
+        if token:
+            headers['x-amz-security-token'] = token
+        signed_headers = ';'.join(sorted(headers))
+        canonical_request = '\n'.join([
+            method, '/', query,
+            ''.join('{}:{}\n'.format(k, headers[k]) for k in sorted(headers)),
+            signed_headers, hashlib.sha256(payload.encode('utf-8')).hexdigest()])
+        scope = '{}/{}/ec2/aws4_request'.format(date, self.region)
+        string_to_sign = '\n'.join([
+            'AWS4-HMAC-SHA256', amz_date, scope, hashlib.sha256(canonical_request.encode('utf-8')).hexdigest()])
+        key = ('AWS4' + secret_key).encode('utf-8')
+        for part in (date, self.region, 'ec2', 'aws4_request'):
+            key = hmac.new(key, part.encode('utf-8'), hashlib.sha256).digest()
+        signature = hmac.new(key, string_to_sign.encode('utf-8'), hashlib.sha256).hexdigest()
+        headers['Authorization'] = 'AWS4-HMAC-SHA256 Credential={}/{}, SignedHeaders={}, Signature={}'.format(
+            access_key, scope, signed_headers, signature)
+        return headers
+
+    def request(self, method, path, body=''):
+        """
+        Send a Query API call.
+        path: "/?Action=..." as passed to aws.AWS.request
+        return: headers (with _code, _reason and _parsed) and the parsed body, as aws.AWS.request does
+        """
+        params = parse_qsl(urlparse(path).query, keep_blank_values=True)
+        if not any(k == 'Version' for k, _ in params):
+            params.append(('Version', self.API_VERSION))
+        query = '&'.join('{}={}'.format(quote(k, safe='-_.~'), quote(v, safe='-_.~')) for k, v in sorted(params))
+        headers = self._sign(method, query, body)
+        headers['Connection'] = 'keep-alive'
+        while True:
+            conn, reused = self._acquire()
+            try:
+                conn.request(method, '/?' + query, body=body or None, headers=headers)
+                response = conn.getresponse()
+                data = response.read()
+            except (http_client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+                conn.close()
+                if reused:
+                    # The endpoint closed the idle connection, send the call again over a new one
+                    logger.debug('Connection to {} was closed, reconnecting'.format(self.host))
+                    continue
+                raise
+            except Exception:
+                conn.close()
+                raise
+            break
+        if response.will_close:
+            conn.close()
+        else:
+            self._release(conn)
+        result_headers = {k.lower(): v for k, v in response.getheaders()}
+        result_headers.update({'_code': str(response.status), '_reason': response.reason, '_parsed': False})
+        try:
+            result = _xml_to_dict(ElementTree.fromstring(data))
+            result_headers['_parsed'] = True
+        except ElementTree.ParseError:
+            result = data.decode('utf-8', 'replace')
+        return result_headers, result
+
+
+# EC2 error codes of throttling and of transient server side failures, the call is sent again after a backoff
+THROTTLING_ERROR_CODES = {'RequestLimitExceeded', 'Throttling', 'ThrottlingException', 'RequestThrottled'}
+TRANSIENT_ERROR_CODES = {'InternalError', 'InternalFailure', 'ServiceUnavailable', 'Unavailable'}
+
+
+class EC2Error(Exception):
+    """Error returned by the EC2 API, code is the EC2 error code (None if the response could not be parsed)"""
+    def __init__(self, msg, code=None, http_code=None, request_id=None):
+        super(EC2Error, self).__init__(msg)
+        self.code = code
+        self.http_code = http_code
+        self.request_id = request_id
+
+    @property
+    def throttled(self):
+        return self.code in THROTTLING_ERROR_CODES or self.http_code == '429'
+
+    @property
+    def retryable(self):
+        return self.throttled or self.code in TRANSIENT_ERROR_CODES or \
+            (not self.code and str(self.http_code).startswith('5'))
+
+
+def is_retryable_error(e):
+    """return: True if the call failed because of throttling or a transient error and may succeed if sent again"""
+    if isinstance(e, EC2Error):
+        return e.retryable
+    return isinstance(e, (socket.timeout, ConnectionError, http_client.HTTPException, RequestException))
+
+
+class RequestLimiter(object):
+    """
+    Process wide limiter of the EC2 calls, shared by the poll loop, the failover plan builder and the executor threads.
+    A token bucket caps the rate of the calls and a window caps the calls in flight, both are adjusted with AIMD:
+    when EC2 throttles (at most once per DECREASE_INTERVAL) the window and the rate are halved and the bucket is
+    emptied, the window grows by one call once a window of calls succeeded and the rate grows back to the configured
+    rate within RATE_RECOVERY seconds.
+    """
+    DECREASE_INTERVAL = 1.0
+    RATE_RECOVERY = 30.0
+
+    def __init__(self, rate, burst, max_in_flight):
+        self._cond = threading.Condition()
+        self._in_flight = 0
+        self.configure(rate, burst, max_in_flight)
+
+    def configure(self, rate, burst, max_in_flight):
+        """rate: calls per second (0 for no limit), burst: bucket size, max_in_flight: upper bound of the window"""
+        with self._cond:
+            self.rate = rate
+            self.current_rate = float(rate)
+            self.burst = max(1, burst)
+            self.max_in_flight = max(1, max_in_flight)
+            self.window = float(self.max_in_flight)
+            self._tokens = float(self.burst)
+            self._stamp = time.monotonic()
+            self._successes = 0
+            self._last_decrease = 0
+            self._cond.notify_all()
+
+    def _refill(self):
+        now = time.monotonic()
+        elapsed = now - self._stamp
+        self._stamp = now
+        self.current_rate = min(self.rate, self.current_rate + elapsed * self.rate / self.RATE_RECOVERY)
+        self._tokens = min(self.burst, self._tokens + elapsed * self.current_rate)
+
+    def acquire(self):
+        """Wait for a free slot in the window and for a token"""
+        with self._cond:
+            while self._in_flight >= int(self.window):
+                self._cond.wait()
+            self._in_flight += 1
+            if not self.rate:
+                return
+            while True:
+                self._refill()
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                self._cond.wait((1 - self._tokens) / self.current_rate)
+
+    def release(self, throttled=False):
+        with self._cond:
+            self._in_flight -= 1
+            if throttled:
+                now = time.monotonic()
+                if now - self._last_decrease >= self.DECREASE_INTERVAL:
+                    self._last_decrease = now
+                    self.window = max(1.0, self.window / 2)
+                    self._successes = 0
+                    if self.rate:
+                        self._refill()
+                        self.current_rate = max(1.0, self.current_rate / 2)
+                        self._tokens = 0
+                    logger.info('EC2 throttling, limited to {} calls in flight and {:.1f} calls per second'.format(
+                        int(self.window), self.current_rate))
+            else:
+                self._successes += 1
+                if self._successes >= self.window and self.window < self.max_in_flight:
+                    self.window = min(self.max_in_flight, self.window + 1)
+                    self._successes = 0
+            self._cond.notify_all()
+
+
+_request_limiter = RequestLimiter(HAD_CONF_DEFAULTS['ec2_rate_limit'], HAD_CONF_DEFAULTS['ec2_burst'],
+                                  HAD_CONF_DEFAULTS['parallel_pool_size'])
+
+
+ACTION_RE = re.compile(r'(?:^|&)Action=([^&]*)')
+
+
 def request(url):
-    """Performs api request to AWS API endpoints (EC2, VPC). This function use aws.py for sending requests"""
-    aws_obj = _aws
-    headers, body = aws_obj.request(
-        'ec2', conf['EC2_REGION'], 'GET', '/?{}'.format(url), '',
-        max_time=MAX_TIMEOUT, timeout_method=TimeoutMethod.POOL)
-    logger.info('headers: {}\nbody: {}'.format(json.dumps(headers),
-                                               json.dumps(body)))
+    """
+    Performs api request to AWS API endpoints (EC2, VPC) through the request limiter.
+    Throttled calls and calls that failed on a transient error are sent again after a full jitter exponential backoff,
+    up to ec2_max_attempts attempts.
+    """
+    attempts = max(1, int(conf['ec2_max_attempts']))
+    action = ACTION_RE.search(url)
+    with trace_span('ec2', action=action.group(1) if action else None) as span:
+        for attempt in range(attempts):
+            throttled = False
+            _request_limiter.acquire()
+            try:
+                body = _send_request(url)
+                span.set(attempts=attempt + 1, request_id=body.get('requestId') if isinstance(body, dict) else None)
+                return body
+            except Exception as e:
+                throttled = isinstance(e, EC2Error) and e.throttled
+                if attempt == attempts - 1 or not is_retryable_error(e):
+                    span.set(attempts=attempt + 1, request_id=getattr(e, 'request_id', None))
+                    raise
+                delay = random.uniform(0, min(conf['ec2_retry_max_delay'],
+                                              conf['ec2_retry_base_delay'] * 2 ** attempt))
+                logger.info('{}, sending again in {:.2f} seconds (attempt {}/{})'.format(
+                    e, delay, attempt + 2, attempts))
+            finally:
+                _request_limiter.release(throttled)
+            time.sleep(delay)
+
+
+def _send_request(url):
+    """Send a single api request. This function use aws.py for sending requests, or the keep-alive EC2Client when it
+    is enabled"""
+    global _ec2_client
+    client = _ec2_client
+    headers = body = None
+    if client:
+        try:
+            headers, body = client.request('GET', '/?{}'.format(url), '')
+        except ssl.SSLCertVerificationError:
+            logger.error('Failed to verify the certificate of {}, sending requests with aws.py\n{}'.format(
+                client.host, traceback.format_exc()))
+            _ec2_client = None
+            client.close()
+    if headers is None:
+        aws_obj = _aws
+        headers, body = aws_obj.request(
+            'ec2', conf['EC2_REGION'], 'GET', '/?{}'.format(url), '',
+            max_time=MAX_TIMEOUT, timeout_method=TimeoutMethod.POOL)
     if headers.get('_code') == '200':
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug('headers: %s\nbody: %s', LogJSON(headers), LogJSON(body))
+        else:
+            logger.info('headers: %s\nbody: %s', LogJSON(headers), LogJSON(body, conf['log_body_max_chars']))
         return body
+    logger.info('headers: %s\nbody: %s', LogJSON(headers), LogJSON(body))
     error = None
     code = None
     if headers.get('_parsed'):
@@ -167,7 +1246,10 @@ def request(url):
             headers.get('_reason', '-'), headers.get('_code', '-'))
     else:
         msg = '{}: {}'.format(code, error.get('Message', '-'))
-    raise Exception(msg)
+    request_id = None
+    if headers.get('_parsed') and isinstance(body, dict):
+        request_id = body.get('RequestID') or body.get('RequestId')
+    raise EC2Error(msg, code, headers.get('_code'), request_id)
 
 
 def get_private_local_ip(interface, interface_pos):
@@ -183,11 +1265,10 @@ def get_private_local_ip(interface, interface_pos):
         return
     if interface_pos != 0:
         interface += ':' + str(interface_pos)
-    cmd = "/sbin/ifconfig " + interface
-    cmd_res = subprocess.check_output(cmd, shell=True).decode(
-        'utf-8').strip()
-    pos = cmd_res.find("inet addr:")
-    ip = ((cmd_res.split("inet addr:", pos))[1].split(" "))[0]
+    try:
+        ip = get_interface_address(interface)
+    except OSError as e:
+        logger.error('Failed to read the address of {}: {}'.format(interface, e))
     if ip:
         return ip
     else:
@@ -195,6 +1276,19 @@ def get_private_local_ip(interface, interface_pos):
     return None
 
 
+SIOCGIFADDR = 0x8915
+
+
+def get_interface_address(interface):
+    """return: IPv4 address of interface (an alias such as "eth0:1" as well), read with the SIOCGIFADDR ioctl"""
+    s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    try:
+        ifreq = fcntl.ioctl(s.fileno(), SIOCGIFADDR, struct.pack('256s', interface[:15].encode('utf-8')))
+    finally:
+        s.close()
+    return socket.inet_ntoa(ifreq[20:24])
+
+
 def get_all_allocation_ids(interface):
     """
     input: Interface description of peer member
@@ -231,25 +1325,191 @@ def associate_public_ip_addresses(interface):
     peer_private_ips_to_allocation_ids = get_all_allocation_ids(peer_if)
     secondary_ippdr = get_secondary_ip_map()
     if secondary_ippdr and peer_private_ips_to_allocation_ids:
+        associations = []
         for peer_private_ip, peer_allocation_id in peer_private_ips_to_allocation_ids.items():
             local_private_ip = secondary_ippdr[peer_private_ip][LOCAL_MEM_PRIVATE_IP]
             logger.debug(f"Allocation ID {peer_allocation_id} of remote private {peer_private_ip} "
                          f"changed to local private {local_private_ip}")
-            q_params = urlencode({'Action': 'AssociateAddress', 'AllowReassociation': 'true',
-                                  'NetworkInterfaceId': interface['interface-id'],
-                                  'PrivateIpAddress': local_private_ip,
-                                  'AllocationId': peer_allocation_id})
-            try:
-                request(q_params)
-            except Exception:
-                logger.error(f"Failed to change Allocation ID {peer_allocation_id} of remote private {peer_private_ip} "
-                             f" to local private {local_private_ip}")
+            associations.append((peer_private_ip, peer_allocation_id, local_private_ip))
+        # The cluster VIP is associated first, before the other public VIPs
+        try:
+            remote_private_vip = get_remote_private_ip_associated_to_vip()
+        except (OSError, KeyError):
+            remote_private_vip = None
+        associations.sort(key=lambda association: association[0] != remote_private_vip)
+        associate_addresses(interface['interface-id'], associations)
     else:
         logger.debug('Cloud not find allocation id, no address to associate')
         return True
     return False
 
 
+def associate_address(interface_id, association):
+    """
+    input: Interface id of the local member and (remote private ip, allocation id, local private ip)
+    return: True if the allocation id was associated to the local private ip, False otherwise
+    Note: This is called only for Cross AZ Cluster
+    """
+    peer_private_ip, peer_allocation_id, local_private_ip = association
+    q_params = urlencode({'Action': 'AssociateAddress', 'AllowReassociation': 'true',
+                          'NetworkInterfaceId': interface_id,
+                          'PrivateIpAddress': local_private_ip,
+                          'AllocationId': peer_allocation_id})
+    try:
+        request(q_params)
+    except Exception:
+        logger.error(f"Failed to change Allocation ID {peer_allocation_id} of remote private {peer_private_ip} "
+                     f" to local private {local_private_ip}")
+        return False
+    return True
+
+
+def associate_addresses(interface_id, associations):
+    """
+    input: Interface id of the local member and list of (remote private ip, allocation id, local private ip)
+    return: Dictionary of allocation id to True if it was associated, False otherwise
+    The first association is sent alone, the others eip_association_pool_size at a time. The associations that failed
+    are sent once more.
+    Note: This is called only for Cross AZ Cluster
+    """
+    results = {}
+    pending = list(associations)
+    for attempt in range(2):
+        if not pending:
+            break
+        if attempt == 0:
+            results[pending[0][1]] = associate_address(interface_id, pending[0])
+            rest = pending[1:]
+        else:
+            logger.info('Sending again {} failed EIP associations'.format(len(pending)))
+            rest = pending
+        size = min(max(1, int(conf['eip_association_pool_size'])), len(rest))
+        if size > 1:
+            with TracedThreadPoolExecutor(max_workers=size, thread_name_prefix='aws_had-eip') as eip_pool:
+                associated = list(eip_pool.map(lambda association: associate_address(interface_id, association),
+                                               rest))
+        else:
+            associated = [associate_address(interface_id, association) for association in rest]
+        for association, result in zip(rest, associated):
+            results[association[1]] = result
+        pending = [association for association in pending if not results[association[1]]]
+    logger.info('EIP associations: {} succeeded, {} failed{}'.format(
+        sum(1 for result in results.values() if result), len(pending),
+        ' ({})'.format(', '.join(association[1] for association in pending)) if pending else ''))
+    return results
+
+
+class CrossAZMapStore(object):
+    """
+    The cross AZ cluster IP map file kept in memory. The file is parsed again only when its mtime or size changed,
+    and aws_had writes it only through save().
+    """
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._stamp = None
+        self._data = None
+        self._error = None
+
+    def load(self):
+        """
+        return: The map, shared by all the callers and not to be modified
+        Raises FileNotFoundError if the file does not exist and json.JSONDecodeError if it is empty or corrupted
+        """
+        st = os.stat(self.path)
+        stamp = (st.st_mtime_ns, st.st_size)
+        with self._lock:
+            if stamp != self._stamp:
+                try:
+                    with open(self.path, "r") as file:
+                        self._data, self._error = json.load(file), None
+                except json.JSONDecodeError as e:
+                    self._data, self._error = None, e
+                self._stamp = stamp
+                logger.debug(f"File {self.path} loaded")
+            if self._error:
+                raise self._error
+            return self._data
+
+    def save(self, data):
+        """Write data to the file and keep a copy of it"""
+        with self._lock:
+            write_json_content_to_file(self.path, data)
+            st = os.stat(self.path)
+            self._stamp = (st.st_mtime_ns, st.st_size)
+            self._data, self._error = copy.deepcopy(data), None
+
+
+_cross_az_map_store = CrossAZMapStore(CROSS_AZ_CLUSTER_SEC_IP_MAP)
+
+
+class CrossAZPairs(object):
+    """
+    Pairs of the Cross AZ Cluster map indexed by remote ip (the key of the map), local ip and EIP, so that adding,
+    removing and looking up a pair does not scan the map. The map is updated in place.
+    Note: This is called only for Cross AZ Cluster
+    """
+
+    def __init__(self, ip_map):
+        self.map = ip_map
+        self.by_local = {}
+        self.by_eip = {}
+        for remote_ip, pair in ip_map.items():
+            self._index(remote_ip, pair)
+
+    def _index(self, remote_ip, pair):
+        self.by_local[pair[LOCAL_MEM_PRIVATE_IP]] = remote_ip
+        self.by_eip[pair[EIP]] = remote_ip
+
+    def _unindex(self, remote_ip, pair):
+        if self.by_local.get(pair[LOCAL_MEM_PRIVATE_IP]) == remote_ip:
+            del self.by_local[pair[LOCAL_MEM_PRIVATE_IP]]
+        if self.by_eip.get(pair[EIP]) == remote_ip:
+            del self.by_eip[pair[EIP]]
+
+    def add(self, local_ip, remote_ip, eip):
+        """return: The new pair of remote_ip, replacing its previous pair if any"""
+        if remote_ip in self.map:
+            self.remove(remote_ip)
+        if eip in self.by_eip:
+            logger.warning(f"EIP {eip} is already paired with remote private {self.by_eip[eip]}")
+        pair = {LOCAL_MEM_PRIVATE_IP: local_ip,
+                REMOTE_MEM_PRIVATE_IP: remote_ip,
+                EIP: eip,
+                DYNAMIC_OBJECT_NAME: "LocalGatewayExternal" + "-" + eip}
+        self.map[remote_ip] = pair
+        self._index(remote_ip, pair)
+        return pair
+
+    def remove(self, remote_ip):
+        """return: The removed pair of remote_ip, None if it is not paired"""
+        pair = self.map.pop(remote_ip, None)
+        if pair:
+            self._unindex(remote_ip, pair)
+        return pair
+
+    def remove_local_ip(self, local_ip):
+        """return: The removed pair of the local secondary ip, None if it is not paired"""
+        remote_ip = self.by_local.get(local_ip)
+        return self.remove(remote_ip) if remote_ip is not None else None
+
+    def remove_stale(self, local_ips, remote_ips):
+        """
+        input: All the secondary ips of the local member and of the remote member
+        return: The removed pairs, whose local ip or remote ip is no longer a secondary ip of its member
+        """
+        local_ips = set(local_ips)
+        remote_ips = set(remote_ips)
+        stale = [remote_ip for remote_ip, pair in self.map.items()
+                 if pair[LOCAL_MEM_PRIVATE_IP] not in local_ips or pair[REMOTE_MEM_PRIVATE_IP] not in remote_ips]
+        return [self.remove(remote_ip) for remote_ip in stale]
+
+    def unpaired(self, secondary_ips, is_local):
+        """return: The secondary ips of the member (is_local: 0 = peer member, 1 = current member) that have no pair"""
+        paired = self.by_local if is_local else self.map
+        return [ip for ip in secondary_ips if ip not in paired]
+
+
 def get_secondary_ip_map():
     """
     return: Dictionary of mapping of peer private ip to pair of local ip, EIP, dynamic object name
@@ -270,10 +1530,9 @@ def get_secondary_ip_map():
     Note: This is called only for Cross AZ Cluster
     """
     try:
-        with open(CROSS_AZ_CLUSTER_SEC_IP_MAP, "r") as file:
-            data = json.load(file)
-            logger.debug(f"File {CROSS_AZ_CLUSTER_SEC_IP_MAP} contains: {data}")
-            return data
+        data = _cross_az_map_store.load()
+        logger.debug('File %s contains: %s', CROSS_AZ_CLUSTER_SEC_IP_MAP, data)
+        return data
     except FileNotFoundError:
         logger.error(f"The file {CROSS_AZ_CLUSTER_SEC_IP_MAP} does not exist. "
                      f"Please run {AWS_HA_CLI_COMMAND} restart on both members")
@@ -285,13 +1544,13 @@ def get_secondary_ip_map():
 
 def is_cross_az_map_file_empty(json_file: str) -> bool:
     """
-    Check if file exists and not empty. In case the file is not empty and exists assign its content to
+    Check if file exists and not empty. In case the file is not empty and exists assign a copy of its content to
     _cross_az_cluster_ip_map variable.
     """
-    global _cross_az_cluster_ip_map
+    global _cross_az_cluster_ip_map, _cross_az_pairs
     try:
-        with open(json_file, "r") as file:
-            _cross_az_cluster_ip_map = json.load(file)
+        _cross_az_cluster_ip_map = copy.deepcopy(_cross_az_map_store.load())
+        _cross_az_pairs = CrossAZPairs(_cross_az_cluster_ip_map)
     except FileNotFoundError:
         logger.error(f"The file {CROSS_AZ_CLUSTER_SEC_IP_MAP} does not exist. "
                      f"Please run {AWS_HA_CLI_COMMAND} restart on both members")
@@ -346,23 +1605,28 @@ def update_cross_az_cluster_map(interface, map_path, describe_flag=True):
     remote_secondary_ips = get_secondary_ips(interface[AWSproperties.PEER_INTERFACE.value])
     remote_secondary_ips_with_eip = get_secondary_ips_with_eip(interface[AWSproperties.PEER_INTERFACE.value])
     local_secondary_ips_with_eip = get_secondary_ips_with_eip(interface[AWSproperties.LOCAL_INTERFACE.value])
-    remove_invalid_pair_from_exist_cross_az_cluster_ip_map(local_secondary_ips, remote_secondary_ips)
+    batch = DynamicObjectBatch()
+    remove_invalid_pair_from_exist_cross_az_cluster_ip_map(local_secondary_ips, remote_secondary_ips, batch)
 
     remain_local_secondary_ips = remain_secondary_ips(local_secondary_ips, 1)
     remain_remote_secondary_ips = remain_secondary_ips(remote_secondary_ips, 0)
-    result = 0
     if not _cross_az_cluster_ip_map:
-        result = clear_all_dynamic_objects_created_by_had_script()
+        clear_all_dynamic_objects_created_by_had_script(batch)
 
-    result += create_updated_cross_az_cluster_ip_map(remain_local_secondary_ips, remain_remote_secondary_ips,
-                                                     local_secondary_ips_with_eip, remote_secondary_ips_with_eip,
-                                                     remote_private_vip)
+    result = create_updated_cross_az_cluster_ip_map(remain_local_secondary_ips, remain_remote_secondary_ips,
+                                                    local_secondary_ips_with_eip, remote_secondary_ips_with_eip,
+                                                    remote_private_vip, batch)
+    result += batch.apply()
 
     if result != 0:
         logger.error("Updating Cross AZ Cluster map Failed")
         return
 
-    write_json_content_to_file(map_path, _cross_az_cluster_ip_map)
+    if map_path == _cross_az_map_store.path:
+        _cross_az_map_store.save(_cross_az_cluster_ip_map)
+    else:
+        # aws_ha_test writes the map it computed to a file of its own, the live map is left as it is
+        write_json_content_to_file(map_path, _cross_az_cluster_ip_map)
     conf['cross_az_cluster_sec_ips_map_up_to_date'] = True
     logger.info("Updating Cross AZ Cluster map finished successfully")
 
@@ -379,17 +1643,15 @@ def get_remote_private_ip_associated_to_vip():
         return None
 
 
-def clear_all_dynamic_objects_created_by_had_script():
+def clear_all_dynamic_objects_created_by_had_script(batch):
     """
-    Description: This function delete all the dynamic objects that has been created by had script
+    Description: This function adds all the dynamic objects that has been created by had script to the deletes of batch
     Note: This is called only for Cross AZ Cluster
     """
     dynamic_objects = _cloud_config_utils.get_dynamic_objects_list()
-    result = 0
     for do in dynamic_objects:
         if do != "LocalGatewayExternal" and do.startswith("LocalGatewayExternal"):
-            result += delete_dynamic_object(do)
-    return result
+            batch.delete(do)
 
 
 def delete_dynamic_object(dynamic_object_name):
@@ -398,7 +1660,7 @@ def delete_dynamic_object(dynamic_object_name):
     return: Delete dynamic object that his name as dynamic_object_name from tha GW
     Note: This is called only for Cross AZ Cluster
     """
-    logger.debug(f"Deleting dynamic object {dynamic_object_name}")
+    logger.debug('Deleting dynamic object %s', dynamic_object_name)
     result = _cloud_config_utils.delete_dynamic_object(dynamic_object_name)
 
     if result != 0:
@@ -409,18 +1671,127 @@ def delete_dynamic_object(dynamic_object_name):
     return 0
 
 
+def create_dynamic_object(local_ip, dynamic_object_name):
+    """
+    input: Private ip of the local member and dynamic object name
+    return: Create dynamic object that his name as dynamic_object_name with local_ip on the GW
+    Note: This is called only for Cross AZ Cluster
+    """
+    logger.debug('Creating dynamic object %s', dynamic_object_name)
+    result = _cloud_config_utils.create_dynamic_object(local_ip, dynamic_object_name)
+
+    if result != 0:
+        logger.error(f"Failed to create dynamic object {dynamic_object_name}")
+        return result
+
+    logger.info(f"Created dynamic object {dynamic_object_name}")
+    return 0
+
+
+class DynamicObjectBatch(object):
+    """
+    Dynamic objects to delete and create on the GW, collected while the Cross AZ Cluster map is rebuilt and applied
+    together by apply(). Every dynamic object is a gateway CLI call, they are run dynamic_objects_pool_size at a time,
+    all the deletes before the creates (an object of an invalid pair may be created again for a new pair).
+    Note: This is called only for Cross AZ Cluster
+    """
+
+    def __init__(self):
+        # name -> True if a failure to delete fails the map update
+        self.deletes = {}
+        # name -> local ip
+        self.creates = {}
+        # (action, name) -> result of the gateway call
+        self.results = {}
+
+    def delete(self, dynamic_object_name, check=True):
+        self.deletes[dynamic_object_name] = self.deletes.get(dynamic_object_name, False) or check
+
+    def create(self, local_ip, dynamic_object_name):
+        self.creates[dynamic_object_name] = local_ip
+
+    def _run(self, pool, action, calls):
+        names = list(calls)
+        if pool:
+            results = list(pool.map(lambda args: args[0](*args[1:]), calls.values()))
+        else:
+            results = [call[0](*call[1:]) for call in calls.values()]
+        for name, result in zip(names, results):
+            self.results[(action, name)] = result
+
+    def apply(self):
+        """return: Number of failed deletes (of checked ones) and creates, 0 if all succeeded"""
+        if not self.deletes and not self.creates:
+            return 0
+        start = time.time()
+        size = min(max(1, int(conf['dynamic_objects_pool_size'])), max(len(self.deletes), len(self.creates)))
+        pool = TracedThreadPoolExecutor(max_workers=size, thread_name_prefix='aws_had-do') if size > 1 else None
+        try:
+            with trace_span('dynamic_objects', deletes=len(self.deletes), creates=len(self.creates)):
+                self._run(pool, 'delete', {name: (delete_dynamic_object, name) for name in self.deletes})
+                self._run(pool, 'create',
+                          {name: (create_dynamic_object, ip, name) for name, ip in self.creates.items()})
+        finally:
+            if pool:
+                pool.shutdown(wait=True)
+        failed = [(action, name) for (action, name), result in self.results.items()
+                  if result != 0 and (action == 'create' or self.deletes[name])]
+        logger.info('Dynamic objects: {} deleted, {} created, {} failed in {:.1f} seconds'.format(
+            sum(1 for (action, _), result in self.results.items() if action == 'delete' and result == 0),
+            sum(1 for (action, _), result in self.results.items() if action == 'create' and result == 0),
+            len(failed), time.time() - start))
+        if failed:
+            logger.error('Failed dynamic objects: {}'.format(
+                ', '.join('{} {}'.format(action, name) for action, name in failed)))
+        return len(failed)
+
+
 def write_json_content_to_file(filename, data):
-    """Write data to a json file"""
-    logger.info(f"Writing data: {data} to file: {filename}")
-    with open(filename, "w") as outfile:
-        json_data = json.dumps(data, indent=4)
-        outfile.write(json_data)
+    """
+    Write data to a json file, unless the file already holds the same content. The file is written to a temporary
+    file which is then renamed, so that readers (aws_ha_test.py) never see it half written.
+    """
+    json_data = json.dumps(data, indent=4)
+    with _written_files_lock:
+        try:
+            st = os.stat(filename)
+        except FileNotFoundError:
+            st = None
+        if st:
+            stamp = (st.st_mtime_ns, st.st_size)
+            written = _written_files.get(filename)
+            if written is None:
+                with open(filename, "r") as infile:
+                    written = (infile.read(), stamp)
+            if written == (json_data, stamp):
+                _written_files[filename] = written
+                logger.debug('File %s is up to date', filename)
+                return
+        logger.info('Writing data: %s to file: %s', LogJSON(data, conf['log_body_max_chars']), filename)
+        tmp_filename = '{}.{}.tmp'.format(filename, os.getpid())
+        try:
+            with open(tmp_filename, "w") as outfile:
+                outfile.write(json_data)
+                outfile.flush()
+                os.fsync(outfile.fileno())
+            if st:
+                os.chmod(tmp_filename, stat.S_IMODE(st.st_mode))
+            os.replace(tmp_filename, filename)
+        except OSError:
+            try:
+                os.remove(tmp_filename)
+            except OSError:
+                pass
+            raise
+        st = os.stat(filename)
+        _written_files[filename] = (json_data, (st.st_mtime_ns, st.st_size))
 
 
-def insert_to_cross_az_cluster_ip_map(local_ip, remote_ip, eip):
+def insert_to_cross_az_cluster_ip_map(local_ip, remote_ip, eip, batch):
     """
     input: Current cross_az_cluster_ip_map as json object with new pair to add
-    return: Updates the cross_az_cluster_ip_map with a pair of ips, EIP , dynamic object name
+    return: Updates the cross_az_cluster_ip_map with a pair of ips, EIP , dynamic object name, the dynamic object is
+    added to the creates of batch
     Note: This is called only for Cross AZ Cluster
     {
         "remote_ip": {
@@ -431,29 +1802,21 @@ def insert_to_cross_az_cluster_ip_map(local_ip, remote_ip, eip):
         }
     }
     """
-    _cross_az_cluster_ip_map[remote_ip] = {}
-    _cross_az_cluster_ip_map[remote_ip][LOCAL_MEM_PRIVATE_IP] = local_ip
-    _cross_az_cluster_ip_map[remote_ip][REMOTE_MEM_PRIVATE_IP] = remote_ip
-    _cross_az_cluster_ip_map[remote_ip][EIP] = eip
-    _cross_az_cluster_ip_map[remote_ip][DYNAMIC_OBJECT_NAME] = "LocalGatewayExternal" + "-" + eip
-    result = _cloud_config_utils.create_dynamic_object(_cross_az_cluster_ip_map[remote_ip][LOCAL_MEM_PRIVATE_IP],
-                                                       _cross_az_cluster_ip_map[remote_ip][DYNAMIC_OBJECT_NAME])
-    if result != 0:
-        logger.error(f"Failed to create dynamic object {_cross_az_cluster_ip_map[remote_ip][DYNAMIC_OBJECT_NAME]}")
-    else:
-        logger.info(f"Created dynamic object {_cross_az_cluster_ip_map[remote_ip][DYNAMIC_OBJECT_NAME]}")
-    return result
+    pair = _cross_az_pairs.add(local_ip, remote_ip, eip)
+    batch.create(pair[LOCAL_MEM_PRIVATE_IP], pair[DYNAMIC_OBJECT_NAME])
+    return 0
 
 
 def create_updated_cross_az_cluster_ip_map(remain_local_secondary_ips, remain_remote_secondary_ips,
                                            local_secondary_ips_with_eip, remote_secondary_ips_with_eip,
-                                           other_member_private_vip):
+                                           other_member_private_vip, batch):
     """
     input: remain_local_secondary_ips: List of Non-paired secondary IPs on current Cross AZ Cluster member,
     remain_remote_secondary_ips: List of Non-Paired secondary IPs on remote Cross AZ Cluster member,
     local_secondary_ips_with_eip: Dictionary of local secondary IPs that have EIP associated to it,
     remote_secondary_ips_with_eip: Dictionary of remote secondary IPs that have EIP associated to it,
-    other_member_private_vip: private ip on remote Cross AZ Cluster that associated to Cluster VIP
+    other_member_private_vip: private ip on remote Cross AZ Cluster that associated to Cluster VIP,
+    batch: DynamicObjectBatch the dynamic objects of the new pairs are added to
     return: Create and updates the global parameter _cross_az_cluster_ip_map with pairs of ips, EIP, dynamic object name
     Note: This is called only for Cross AZ Cluster
     """
@@ -467,17 +1830,18 @@ def create_updated_cross_az_cluster_ip_map(remain_local_secondary_ips, remain_re
     if other_member_private_vip in remain_remote_secondary_ips:
         result += _prioritize_map_of_cross_az_cluster_vip_ips(other_member_private_vip, local_secondary_private_vip,
                                                               remain_locals_with_eip, remain_remotes_without_eip,
-                                                              remain_locals_without_eip, remain_remotes_with_eip)
-    result += create_ip_pairs(remain_locals_without_eip, remain_remotes_with_eip, 0)
-    result += create_ip_pairs(remain_remotes_without_eip, remain_locals_with_eip, 1)
+                                                              remain_locals_without_eip, remain_remotes_with_eip, batch)
+    result += create_ip_pairs(remain_locals_without_eip, remain_remotes_with_eip, 0, batch)
+    result += create_ip_pairs(remain_remotes_without_eip, remain_locals_with_eip, 1, batch)
     return result
 
 
-def create_ip_pairs(ips_without_eip, ips_with_eip, local_have_eip):
+def create_ip_pairs(ips_without_eip, ips_with_eip, local_have_eip, batch):
     """
     input: ips_without_eip: List of Non-Paired secondary IPs on other Cross AZ Cluster member,
     ips_with_eip: Dictionary of local secondary IPs that have EIP associated to it,
-    local_have_eip: Indicates if second parameter "ips_with_eip" is pointing to IPs on local member.
+    local_have_eip: Indicates if second parameter "ips_with_eip" is pointing to IPs on local member,
+    batch: DynamicObjectBatch the dynamic objects of the pairs are added to.
     Description: Perform parallel iteration on the ips_without_eip and ips_with_eip to create mapping pairs of IPs and EIP,
     Return: 0 if all pairs created successfully, 1 if at least one pair wasn't created as expected.
     Note: This is called only for Cross AZ Cluster
@@ -489,16 +1853,16 @@ def create_ip_pairs(ips_without_eip, ips_with_eip, local_have_eip):
         return 1
     for ip_without_eip, ip_with_eip in zip(ips_without_eip, ips_with_eip.keys()):
         if local_have_eip:
-            result += insert_to_cross_az_cluster_ip_map(ip_with_eip, ip_without_eip, ips_with_eip[ip_with_eip])
+            result += insert_to_cross_az_cluster_ip_map(ip_with_eip, ip_without_eip, ips_with_eip[ip_with_eip], batch)
         else:
-            result += insert_to_cross_az_cluster_ip_map(ip_without_eip, ip_with_eip, ips_with_eip[ip_with_eip])
+            result += insert_to_cross_az_cluster_ip_map(ip_without_eip, ip_with_eip, ips_with_eip[ip_with_eip], batch)
 
     return result
 
 
 def _prioritize_map_of_cross_az_cluster_vip_ips(other_member_private_vip, local_secondary_private_vip,
                                                 remain_locals_with_eip, remain_remotes_without_eip,
-                                                remain_locals_without_eip, remain_remotes_with_eip):
+                                                remain_locals_without_eip, remain_remotes_with_eip, batch):
     """
     The purpose of the function is to insert secondary private IPs associated with cluster original VIP to the top of
     _cross_az_cluster_ip_map
@@ -508,13 +1872,13 @@ def _prioritize_map_of_cross_az_cluster_vip_ips(other_member_private_vip, local_
     # If local private ip is associated to Cross AZ Cluster VIP
     if local_secondary_private_vip in remain_locals_with_eip:
         result = insert_to_cross_az_cluster_ip_map(local_secondary_private_vip, other_member_private_vip,
-                                                   remain_locals_with_eip[local_secondary_private_vip])
+                                                   remain_locals_with_eip[local_secondary_private_vip], batch)
         remain_remotes_without_eip.remove(other_member_private_vip)
         del remain_locals_with_eip[local_secondary_private_vip]
     # If remote private that is assumed as associated to VIP ip is associated to Cross AZ Cluster VIP
     if local_secondary_private_vip in remain_locals_without_eip:
         result = insert_to_cross_az_cluster_ip_map(local_secondary_private_vip, other_member_private_vip,
-                                                   remain_remotes_with_eip[other_member_private_vip])
+                                                   remain_remotes_with_eip[other_member_private_vip], batch)
         remain_locals_without_eip.remove(local_secondary_private_vip)
         del remain_remotes_with_eip[other_member_private_vip]
     return result
@@ -529,7 +1893,7 @@ def _get_remains_ips_with_and_without_eips(remain_ips, secondary_ips_with_eip):
     remain_without_eip = []
     remain_with_eip = {}
     for ip in remain_ips:
-        if ip in secondary_ips_with_eip.keys():
+        if ip in secondary_ips_with_eip:
             remain_with_eip[ip] = secondary_ips_with_eip[ip]
         else:
             remain_without_eip.append(ip)
@@ -540,37 +1904,25 @@ def _get_remains_ips_with_and_without_eips(remain_ips, secondary_ips_with_eip):
 def remain_secondary_ips(secondary_ips, is_local):
     """
     input: current cross_az_cluster_ip_map, all secondary ips of the member as is_local (0 = peer member, 1 = current member)
-    return: return list of non-paired IPs
+    return: return list of non-paired IPs (a new list, in the order of secondary_ips)
     Note: This is called only for Cross AZ Cluster
     """
     if not _cross_az_cluster_ip_map:
-        return secondary_ips
-    remain_ips = secondary_ips
-    for key, value in _cross_az_cluster_ip_map.items():
-        if is_local and value[LOCAL_MEM_PRIVATE_IP] in secondary_ips:
-            remain_ips.remove(value[LOCAL_MEM_PRIVATE_IP])
-        else:
-            if value[REMOTE_MEM_PRIVATE_IP] in secondary_ips:
-                remain_ips.remove(value[REMOTE_MEM_PRIVATE_IP])
-    return remain_ips
+        return list(secondary_ips)
+    return _cross_az_pairs.unpaired(secondary_ips, is_local)
 
 
-def remove_invalid_pair_from_exist_cross_az_cluster_ip_map(local_secondary_ips, remote_secondary_ips):
+def remove_invalid_pair_from_exist_cross_az_cluster_ip_map(local_secondary_ips, remote_secondary_ips, batch):
     """
     input: Current cross_az_cluster_ip_map, all secondary ips of the both members
-    return: Filter current cross_az_cluster_ip_map from invalid pairs
+    return: Filter current cross_az_cluster_ip_map from invalid pairs, their dynamic objects are added to the deletes
+    of batch
     Note: This is called only for Cross AZ Cluster
     """
     if not _cross_az_cluster_ip_map:
         return None
-    invalid_pairs = []
-    for key, value in _cross_az_cluster_ip_map.items():
-        if value[LOCAL_MEM_PRIVATE_IP] not in local_secondary_ips or \
-                value[REMOTE_MEM_PRIVATE_IP] not in remote_secondary_ips:
-            delete_dynamic_object(value[DYNAMIC_OBJECT_NAME])
-            invalid_pairs.append(key)
-    for invalid_pair in invalid_pairs:
-        del _cross_az_cluster_ip_map[invalid_pair]
+    for pair in _cross_az_pairs.remove_stale(local_secondary_ips, remote_secondary_ips):
+        batch.delete(pair[DYNAMIC_OBJECT_NAME], check=False)
 
 
 def get_secondary_ips_with_eip(interface):
@@ -616,12 +1968,10 @@ def assign_private_ip_addresses(interface):
     q_params = {'Action': 'AssignPrivateIpAddresses',
                 'AllowReassignment': 'true',
                 'NetworkInterfaceId': interface['interface-id']}
-    logger.debug('Addresses to assign : {}'.format(
-        peer_if['privateIpAddressesSet']))
+    logger.debug('Addresses to assign : %s', peer_if['privateIpAddressesSet'])
     # If interface has only primary address
     if len(peer_if['privateIpAddressesSet']) <= 1:
-        logger.debug('No secondary private addresses for interface {}'.format(
-            interface[NAME]))
+        logger.debug('No secondary private addresses for interface %s', interface[NAME])
         return True
     for index, addrObj in enumerate(peer_if['privateIpAddressesSet']):
         if addrObj['primary'] == 'true':
@@ -645,13 +1995,18 @@ def create_route(route_table_id: str, destination_cidr_block: str, network_inter
     else:
         params[AWSRequestParameters.CIDR.value] = destination_cidr_block
     q_params = urlencode(params)
-    logger.debug('{}'.format(repr(q_params)))
+    logger.debug('%r', q_params)
     request(q_params)
 
 
 def replace_route(route_table_id: str, destination_cidr_block: str, dst_network_interface_id: str,
-                  destination_prefix_list_id: str = None, src_network_interface_id: str = None) -> None:
-    """Replace route entry upon fail over to point to the new active member eni"""
+                  destination_prefix_list_id: str = None, src_network_interface_id: str = None,
+                  create_if_missing: bool = True) -> None:
+    """
+    Replace route entry upon fail over to point to the new active member eni.
+    create_if_missing=False is used for routes served from the route index, which may have been deleted since the
+    index was refreshed: instead of re-creating such a route the index is refreshed on the next poll.
+    """
     logger.debug('replace_route called')
     params = {AWSRequestParameters.ACTION.value: AWSRequestParameters.REPLACE_ROUTE.value,
               AWSRequestParameters.RTB_ID.value: route_table_id,
@@ -662,14 +2017,14 @@ def replace_route(route_table_id: str, destination_cidr_block: str, dst_network_
     else:
         params[AWSRequestParameters.CIDR.value] = destination_cidr_block
     q_params = urlencode(params)
-    logger.debug('{}'.format(repr(q_params)))
+    logger.debug('%r', q_params)
     try:
         request(q_params)
-        logger.debug(
-            'replace route called: rtb_id={}, {}, eni_id={}'.format(
-                route_table_id, 'prefix_list_id={}'.format(
-                    destination_prefix_list_id) if destination_prefix_list_id else 'cidr={}'.format(
-                    destination_cidr_block), dst_network_interface_id))
+        logger.debug('replace route called: rtb_id=%s, %s=%s, eni_id=%s', route_table_id,
+                     'prefix_list_id' if destination_prefix_list_id else 'cidr',
+                     destination_prefix_list_id or destination_cidr_block, dst_network_interface_id)
+        _route_index.move(route_table_id, destination_cidr_block, destination_prefix_list_id,
+                          src_network_interface_id, dst_network_interface_id)
         if MIGRATE_OBJECT.is_migrated:
             MIGRATE_OBJECT.add_changed_route({AWSproperties.RTB_ID.value: route_table_id,
                                               AWSproperties.PREFIX_LIST_ID.value if destination_prefix_list_id else
@@ -677,7 +2032,7 @@ def replace_route(route_table_id: str, destination_cidr_block: str, dst_network_
                                                   destination_prefix_list_id if destination_prefix_list_id else
                                                   destination_cidr_block,
                                               AWSproperties.ENI_ID.value: src_network_interface_id})
-    except Exception:
+    except Exception as e:
         if MIGRATE_OBJECT.is_migrated:
             MIGRATE_OBJECT.add_not_changed_route({AWSproperties.RTB_ID.value: route_table_id,
                                                   AWSproperties.PREFIX_LIST_ID.value if destination_prefix_list_id else
@@ -685,44 +2040,40 @@ def replace_route(route_table_id: str, destination_cidr_block: str, dst_network_
                                                       destination_prefix_list_id if destination_prefix_list_id else
                                                       destination_cidr_block,
                                                   AWSproperties.ENI_ID.value: src_network_interface_id})
+        elif not create_if_missing or is_retryable_error(e):
+            # The route may still exist (the call was throttled or failed on a transient error), creating it would
+            # fail as well - the route is still found pointing to the peer and replaced again on the next poll
+            logger.error('{}'.format(traceback.format_exc()))
+            _route_index.invalidate_route_table(route_table_id)
         else:
             try:
-                logger.debug('{}'.format(traceback.format_exc()))
+                logger.debug('%s', traceback.format_exc())
                 create_route(
                     route_table_id, destination_cidr_block, dst_network_interface_id, destination_prefix_list_id)
             except Exception:
                 logger.error('{}'.format(traceback.format_exc()))
 
 
-def update_route_table(interface):
+def get_route_table_replacements(interface):
     """
-    Replace all required route tables entries upon fail over to point to the new active member eni.
-    return: True if the route table updating is finished and False if request for replacing route was send.
+    Find the route tables entries of the interface subnet that should point to the local member eni.
+    return: List of (route table id, cidr, eni id, prefix list id) to replace
     """
-    logger.info('update_route_table called')
-    route_replaced = False
-    q_params = {'Action': 'DescribeRouteTables',
-                'Filter.0.Name': 'vpc-id',
-                'Filter.0.Value': interface['vpc-id']}
-
+    filters = [('vpc-id', [interface['vpc-id']])]
+    subnet_filters = []
     if (conf['cluster_mode'] == mode.CLUSTER_MODE_HIGH_AVAILABILITY and
             conf['deploy_mode'] == mode.DEPLOY_MODE_SINGLE_AZ):
-        q_params['Filter.1.Name'] = 'association.subnet-id'
-        q_params['Filter.1.Value.0'] = interface['subnet-id']
-
-    b = request(urlencode(q_params))
+        subnet_filters = [('association.subnet-id', [interface['subnet-id']])]
 
-    route_tables = aws.listify(b, 'item')['routeTableSet']
+    route_tables = list(iter_route_tables(filters + subnet_filters))
     if not route_tables:
-        q_params['Filter.1.Name'] = 'association.main'
-        q_params['Filter.1.Value.0'] = 'true'
-        b = request(urlencode(q_params))
-        route_tables = aws.listify(b, 'item')['routeTableSet']
+        route_tables = list(iter_route_tables(filters + [('association.main', ['true'])]))
         if not route_tables:
             raise Exception('could not find route table')
 
+    replacements = []
     for rtb in route_tables:
-        logger.debug('{}'.format(json.dumps(rtb)))
+        logger.debug('%s', LogJSON(rtb))
         for route in rtb.get('routeSet'):
             cidr = route.get(AWSproperties.CIDR.value)
             prefix_list = route.get(AWSproperties.PREFIX_LIST_ID.value)
@@ -736,22 +2087,29 @@ def update_route_table(interface):
                     r_interface == peer_interface
                     or
                     conf['always_replace_default'] and cidr == '0.0.0.0/0'):
-                replace_route(rtb[AWSproperties.RTB_ID.value], cidr,
-                              interface[AWSproperties.INTERFACE_ID.value], prefix_list)
-                route_replaced = True
-                continue
+                replacements.append((rtb[AWSproperties.RTB_ID.value], cidr,
+                                     interface[AWSproperties.INTERFACE_ID.value], prefix_list))
+    return replacements
+
+
+def update_route_table(interface):
+    """
+    Replace all required route tables entries upon fail over to point to the new active member eni.
+    return: True if the route table updating is finished and False if request for replacing route was send.
+    """
+    logger.info('update_route_table called')
+    route_replaced = False
+    for rtb_id, cidr, eni, prefix_list in get_route_table_replacements(interface):
+        replace_route(rtb_id, cidr, eni, prefix_list)
+        route_replaced = True
     return not route_replaced
 
 
 def get_routes(rtb):
     """Get relevant routes for desired route table from AWS account"""
-    logger.debug('get_routes called: {}'.format(rtb))
+    logger.debug('get_routes called: %s', rtb)
 
-    q_params = urlencode(
-        {'Action': 'DescribeRouteTables', 'RouteTableId': rtb})
-    b = request(q_params)
-
-    route_tables = aws.listify(b, 'item')['routeTableSet'][0]['routeSet']
+    route_tables = next(iter_route_tables(route_table_ids=[rtb]), {}).get('routeSet')
     if not route_tables:
         raise Exception('could not find route table')
     routes = {}
@@ -762,57 +2120,185 @@ def get_routes(rtb):
             continue
         rinterface = r.get('networkInterfaceId', 'invalid')
         routes[cidr] = rinterface
-    logger.debug('{}'.format(repr(routes)))
+    logger.debug('%r', routes)
     return routes
 
 
-def get_all_route_tables(vpc_id):
-    """Get all route tables for specified VPC ID"""
+# Fields of the routes that are kept by iter_route_tables
+ROUTE_FIELDS = (AWSproperties.CIDR.value, AWSproperties.PREFIX_LIST_ID.value, AWSproperties.ENI_ID.value)
+
+
+def iter_route_tables(filters=(), route_table_ids=()):
+    """
+    input: DescribeRouteTables filters as (name, values) pairs, or route table ids
+    return: Generator of the route tables, described a page of route_tables_page_size at a time (MaxResults and
+    NextToken), with only their id and the route fields of ROUTE_FIELDS, so that a single page is held in memory
+    """
+    q_params = {'Action': 'DescribeRouteTables'}
+    for i, (name, values) in enumerate(filters):
+        q_params['Filter.{}.Name'.format(i)] = name
+        for j, value in enumerate(values):
+            q_params['Filter.{}.Value.{}'.format(i, j)] = value
+    for i, rtb_id in enumerate(route_table_ids):
+        q_params['RouteTableId.{}'.format(i)] = rtb_id
+    # MaxResults cannot be used together with route table ids
+    if not route_table_ids:
+        q_params['MaxResults'] = min(100, max(5, int(conf['route_tables_page_size'])))
+    pages = 0
+    while True:
+        body = aws.listify(request(urlencode(q_params)), 'item')
+        pages += 1
+        for route_table in body.get('routeTableSet') or []:
+            yield {AWSproperties.RTB_ID.value: route_table[AWSproperties.RTB_ID.value],
+                   'routeSet': [{field: route[field] for field in ROUTE_FIELDS if route.get(field)}
+                                for route in route_table.get('routeSet') or []]}
+        next_token = body.get('nextToken')
+        if not next_token:
+            break
+        q_params['NextToken'] = next_token
+        body = None
+    logger.debug('%s: %d pages of route tables described', filters or route_table_ids, pages)
+
+
+def get_all_route_tables(vpc_id, enis=None):
+    """
+    Get the route tables of the specified VPC ID, see iter_route_tables. EC2 returns only the route tables with a
+    route to one of enis if they are given (and route_tables_eni_filter is set), and only the ones tagged with
+    route_tables_tag if it is set.
+    """
     logger.debug('get_all_route_tables called')
-    q_params = urlencode({'Action': 'DescribeRouteTables',
-                          'Filter.0.Name': 'vpc-id',
-                          'Filter.0.Value': vpc_id})
-    body = request(q_params)
-    route_tables = aws.listify(body, 'item')['routeTableSet']
-    return route_tables
+    filters = [('vpc-id', [vpc_id])]
+    if enis and conf['route_tables_eni_filter']:
+        filters.append(('route.network-interface-id', sorted(enis)))
+    if conf['route_tables_tag']:
+        key, sep, value = conf['route_tables_tag'].partition('=')
+        filters.append(('tag:' + key, [value]) if sep else ('tag-key', [key]))
+    return iter_route_tables(filters)
+
+
+def get_peer_interface_ids(interface):
+    """return: ENI IDs of the other member (the old cluster members when migrating) for the interface"""
+    if MIGRATE_OBJECT.is_migrated:
+        return [e.get('networkInterfaceId') for e in interface[AWSproperties.PEER_INTERFACE.value]]
+    return [interface['peer-interface'].get('networkInterfaceId')]
+
+
+def get_stale_route_index_scopes(max_age, standby=False, interfaces=None):
+    """
+    Find the VPCs of the cluster interfaces whose route index was not refreshed in the last max_age seconds.
+    On a standby member a VPC is also stale while the index has routes pointing to the local member ENIs: such
+    entries are left from the last time this member was active and the peer is expected to move them.
+    return: Dict where key is a VPC ID and its value the ENIs its route tables are described by (None for all)
+    """
+    vpcs = {}
+    peers = {}
+    for interface in cphaconf[IFS] if interfaces is None else interfaces:
+        if interface.get('vpc-id'):
+            vpcs.setdefault(interface['vpc-id'], []).append(interface.get(AWSproperties.INTERFACE_ID.value))
+            peers.setdefault(interface['vpc-id'], []).extend(
+                get_peer_interface_ids(interface) if interface.get(AWSproperties.PEER_INTERFACE.value) else [None])
+    scopes = {}
+    for vpc_id, local_enis in sorted(vpcs.items()):
+        # Only the route tables with routes to the ENIs of both members are indexed, all the route tables are
+        # described if one of the ENIs is not known
+        enis = local_enis + peers[vpc_id]
+        scope = frozenset(enis) if all(enis) and conf['route_tables_eni_filter'] else None
+        if _route_index.is_fresh(vpc_id, max_age, scope) and \
+                not (standby and _route_index.points_to_any(local_enis)):
+            continue
+        scopes[vpc_id] = scope
+    return scopes
+
+
+def refresh_route_index(max_age, standby=False, interfaces=None, scopes=None, on_route_table=None):
+    """
+    Refresh the route index of the VPCs of scopes, the stale ones (see get_stale_route_index_scopes) if not given.
+    The VPCs are described concurrently, on_route_table(route table) is called for every route table as soon as its
+    page is described.
+    return: Set of the VPC IDs that were described by this call
+    """
+    if scopes is None:
+        scopes = get_stale_route_index_scopes(max_age, standby, interfaces)
+
+    def refresh(vpc_id):
+        route_tables = get_all_route_tables(vpc_id, scopes[vpc_id])
+        if on_route_table:
+            route_tables = _observe_route_tables(route_tables, on_route_table)
+        _route_index.refresh(vpc_id, route_tables, scopes[vpc_id])
+
+    size = min(len(scopes), max(1, int(conf['parallel_pool_size'])))
+    if size > 1:
+        with TracedThreadPoolExecutor(max_workers=size, thread_name_prefix='aws_had-rtb') as describe_pool:
+            list(describe_pool.map(refresh, sorted(scopes)))
+    else:
+        for vpc_id in scopes:
+            refresh(vpc_id)
+    return set(scopes)
+
+
+def _observe_route_tables(route_tables, on_route_table):
+    for route_table in route_tables:
+        on_route_table(route_table)
+        yield route_table
 
 
 def set_all_route_tables(pool):
     """
     Upon fail over update all route tables entries to eni of new active member.
+    The routes are taken from the route index that is kept up to date while the member is standby. The VPCs whose
+    index is stale are described in the background meanwhile, and the routes of every described page are replaced
+    while the next pages are described.
     return: True if the all route tables updating is finished and False if request for replacing route was send.
     """
-    vpcs = set()
     route_replaced = False
+    local_enis = {}
     for interface in cphaconf[IFS]:
-        vpcs.add(interface['vpc-id'])
-    for vpc_id in vpcs:
-        for routeTable in get_all_route_tables(vpc_id):
-            for route in routeTable['routeSet']:
-                cidr = route.get(AWSproperties.CIDR.value)
-                eni = route.get(AWSproperties.ENI_ID.value)
-                prefix_list = route.get(AWSproperties.PREFIX_LIST_ID.value)
-                if (not cidr and not prefix_list) or not eni:
-                    continue
-                # Check if eni variable is in one of the interface's peer list
-                for interface in cphaconf[IFS]:
-                    if MIGRATE_OBJECT.is_migrated:
-                        peer_interfaces_ids = [e.get('networkInterfaceId') for
-                                               e in interface[AWSproperties.PEER_INTERFACE.value]]
-                        if eni not in peer_interfaces_ids:
-                            continue
-                    else:
-                        if eni != interface['peer-interface'].get('networkInterfaceId'):
-                            continue
+        for eni in get_peer_interface_ids(interface):
+            if eni:
+                local_enis[eni] = interface[AWSproperties.INTERFACE_ID.value]
+    scopes = get_stale_route_index_scopes(conf['route_index_max_age'])
+    # Routes found by the description of the stale VPCs (args of replace_route), None once all were described
+    described = queue.Queue()
+
+    def on_route_table(route_table):
+        for route in route_table['routeSet']:
+            src_eni = route.get(AWSproperties.ENI_ID.value)
+            cidr = route.get(AWSproperties.CIDR.value)
+            prefix_list = route.get(AWSproperties.PREFIX_LIST_ID.value)
+            if src_eni in local_enis and (cidr or prefix_list):
+                described.put((route_table[AWSproperties.RTB_ID.value], cidr, local_enis[src_eni], prefix_list,
+                               src_eni, True))
 
-                    if pool:
-                        pool_results.append(pool.apply_async(replace_route, (
-                            routeTable[AWSproperties.RTB_ID.value], cidr, interface[AWSproperties.INTERFACE_ID.value],
-                            prefix_list, eni)))
-                    else:
-                        replace_route(routeTable[AWSproperties.RTB_ID.value], cidr,
-                                      interface[AWSproperties.INTERFACE_ID.value], prefix_list, eni)
-                        route_replaced = True
+    def describe():
+        try:
+            refresh_route_index(conf['route_index_max_age'], scopes=scopes, on_route_table=on_route_table)
+        finally:
+            described.put(None)
+
+    def replace(args):
+        nonlocal route_replaced
+        if pool:
+            pool_results.append(pool.submit(replace_route, *args))
+        else:
+            replace_route(*args)
+            route_replaced = True
+
+    with TracedThreadPoolExecutor(max_workers=1, thread_name_prefix='aws_had-discovery') as discovery:
+        describing = discovery.submit(describe) if scopes else None
+        # Routes of the fresh VPCs are taken from the index. They may be stale, they must not be re-created.
+        for interface in cphaconf[IFS]:
+            if interface.get('vpc-id') in scopes:
+                continue
+            for eni in get_peer_interface_ids(interface):
+                if not eni:
+                    continue
+                for route_table_id, cidr, prefix_list in _route_index.lookup(eni):
+                    replace((route_table_id, cidr, interface[AWSproperties.INTERFACE_ID.value], prefix_list, eni,
+                             False))
+        if describing:
+            for args in iter(described.get, None):
+                replace(args)
+            describing.result()
     return not route_replaced
 
 
@@ -824,116 +2310,314 @@ def describe_network_interfaces(vpc_id, private_ip):
     Note: This is called only for Cross AZ Cluster
     """
     logger.debug('describe_network_interfaces called')
-    body = request(urlencode({'Action': 'DescribeNetworkInterfaces',
-                              'Filter.0.Name': 'vpc-id',
-                              'Filter.0.Value': vpc_id,
-                              'Filter.1.Name': 'private-ip-address',
-                              'Filter.1.Value': private_ip}))
-
-    interfaces = aws.listify(body, 'item')['networkInterfaceSet']
-    if not interfaces:
-        logger.debug('No network interface found for the other member gateway '
-                     'by IP {}'.format(private_ip))
-        return None
-
-    interface = interfaces[0]
-    logger.info('Interface id for IP {} is {}'.format(
-        private_ip, interface['networkInterfaceId']))
-    return interface
+    return describe_network_interfaces_by_ip([(vpc_id, private_ip)]).get((vpc_id, private_ip))
+
+
+# Values of a single DescribeNetworkInterfaces filter
+MAX_FILTER_VALUES = 200
+
+
+def describe_network_interfaces_by_ip(addresses, send_request=None):
+    """
+    input: (vpc id, private ip) pairs, and the function sending the query string and returning the response body
+    (request when not given)
+    return: Dict where key is a (vpc id, private ip) pair and its value the description of the interface holding that
+    ip, all the pairs are resolved by a single DescribeNetworkInterfaces call with multi valued filters
+    """
+    send_request = send_request or request
+    addresses = sorted({(vpc_id, ip) for vpc_id, ip in addresses if vpc_id and ip})
+    result = {}
+    for start in range(0, len(addresses), MAX_FILTER_VALUES):
+        chunk = set(addresses[start:start + MAX_FILTER_VALUES])
+        q_params = {'Action': 'DescribeNetworkInterfaces',
+                    'Filter.0.Name': 'vpc-id',
+                    'Filter.1.Name': 'private-ip-address'}
+        for i, vpc_id in enumerate(sorted({vpc_id for vpc_id, _ in chunk})):
+            q_params['Filter.0.Value.{}'.format(i)] = vpc_id
+        for i, ip in enumerate(sorted({ip for _, ip in chunk})):
+            q_params['Filter.1.Value.{}'.format(i)] = ip
+        body = send_request(urlencode(q_params))
+        for interface in aws.listify(body, 'item')['networkInterfaceSet'] or []:
+            ips = {interface.get(AWSproperties.PRIVATE_IP_ADDRESS.value)}
+            ips.update(addr.get(AWSproperties.PRIVATE_IP_ADDRESS.value)
+                       for addr in interface.get(AWSproperties.PRIVATE_IP_ADDRESS_SET.value) or [])
+            for ip in ips:
+                key = (interface.get('vpcId'), ip)
+                if key in chunk and key not in result:
+                    logger.info('Interface id for IP {} is {}'.format(ip, interface['networkInterfaceId']))
+                    result[key] = interface
+    for vpc_id, ip in addresses:
+        if (vpc_id, ip) not in result:
+            logger.debug('No network interface found for the other member gateway by IP {}'.format(ip))
+    return result
 
 
 def update_interfaces_dictionary(pool, should_work):
     """Update required data for local and remote members interfaces"""
+    if should_work:
+        # Only the poll that promotes the member uses a plan, the ones built or being built since are dropped
+        plan = take_failover_plan() if _poll_status['should_work'] is False else None
+        invalidate_failover_plan()
+        if plan:
+            logger.debug('Updating cluster status file with %s status', IN_PROGRESS)
+            set_cluster_status(IN_PROGRESS)
+            with trace_span('failover_plan', routes=len(plan.routes), interfaces=len(plan.interfaces)):
+                execute_failover_plan(pool, plan)
     logger.debug('Updating interfaces metadata')
     if conf['cross_az_cluster_sec_ips_map_up_to_date'] and not should_work and \
             conf['deploy_mode'] == mode.DEPLOY_MODE_CROSS_AZ:
         return
-    get_interface_meta_data()
+    with trace_span('metadata'):
+        get_interface_meta_data()
+
+    # The local interfaces are described as well when the cross AZ map is going to be updated
+    describe_local = not conf['cross_az_cluster_sec_ips_map_up_to_date'] and \
+        conf['deploy_mode'] == mode.DEPLOY_MODE_CROSS_AZ
+    addresses = []
+    for interface in cphaconf[IFS]:
+        vpc_id = interface.get(AWSproperties.VPC_ID.value)
+        addresses.append((vpc_id, interface.get(AWSproperties.OTHER_MEMBER_IF_IP.value)))
+        if describe_local:
+            addresses.append((vpc_id, interface.get(AWSproperties.IPADDR.value)))
+    with trace_span('describe_interfaces', addresses=len(addresses)):
+        described = describe_network_interfaces_by_ip(addresses)
 
     for interface in cphaconf[IFS]:
         if AWSproperties.OTHER_MEMBER_IF_IP.value not in interface or AWSproperties.VPC_ID.value not in interface:
             interface[AWSproperties.PEER_INTERFACE.value] = {}
             continue
-        interface[AWSproperties.PEER_INTERFACE.value] = describe_network_interfaces(
-            interface[AWSproperties.VPC_ID.value], interface[AWSproperties.OTHER_MEMBER_IF_IP.value])
+        vpc_id = interface[AWSproperties.VPC_ID.value]
+        interface[AWSproperties.PEER_INTERFACE.value] = described.get(
+            (vpc_id, interface[AWSproperties.OTHER_MEMBER_IF_IP.value]))
         if not conf['cross_az_cluster_sec_ips_map_up_to_date'] and conf['deploy_mode'] == mode.DEPLOY_MODE_CROSS_AZ:
-            update_cross_az_cluster_map(interface, CROSS_AZ_CLUSTER_SEC_IP_MAP)
+            interface[AWSproperties.LOCAL_INTERFACE.value] = described.get(
+                (vpc_id, interface.get(AWSproperties.IPADDR.value)))
+            with trace_span('cross_az_map', interface=interface.get(NAME)):
+                update_cross_az_cluster_map(interface, CROSS_AZ_CLUSTER_SEC_IP_MAP, describe_flag=False)
             get_diagnostics()
     if should_work:
         set_local_active(pool)
 
 
+def get_interfaces_to_update_routes(interfaces):
+    """return: Interfaces whose subnet route tables are updated when replace_all_route_tables is off"""
+    result = []
+    for interface in interfaces:
+        logger.debug('interface name: {}'.format(interface[NAME]))
+
+        if (conf['cluster_mode'] == mode.CLUSTER_MODE_HIGH_AVAILABILITY and
+                conf['deploy_mode'] == mode.DEPLOY_MODE_SINGLE_AZ):
+            # HA only internal addresses
+            if interface['type'] not in ['internal']:
+                logger.debug('Interface is not internal')
+                continue
+        if 'subnet-id' not in interface:
+            logger.debug('No subnet id')
+            continue
+        result.append(interface)
+    return result
+
+
+def get_replace_interface_function():
+    """return: Function that moves the secondary addresses of an interface (HA only) or None"""
+    if conf['cluster_mode'] != mode.CLUSTER_MODE_HIGH_AVAILABILITY:
+        return None
+    # HA only secondary ips in single az or public VIP in cross az
+    if conf['deploy_mode'] == mode.DEPLOY_MODE_CROSS_AZ:
+        return associate_public_ip_addresses
+    return assign_private_ip_addresses
+
+
 def set_local_active(pool):
     """Set member as active"""
     logger.info('set_local_active called')
 
-    logger.debug('Updating cluster status file with %s status', IN_PROGRESS)
-    update_cluster_status_file(IN_PROGRESS)
+    # The polls of the active member that check and repair its routes and addresses leave DONE as it is
+    if _cluster_status != DONE:
+        logger.debug('Updating cluster status file with %s status', IN_PROGRESS)
+        set_cluster_status(IN_PROGRESS)
     failover_finished = True
     if conf['replace_all_route_tables']:
-        failover_finished &= set_all_route_tables(pool)
+        with trace_span('route_tables'):
+            failover_finished &= set_all_route_tables(pool)
     elif 'rtbs' in cphaconf:
         for rtb in cphaconf['rtbs']:
             routes = get_routes(rtb)
             for route in cphaconf['rtbs'][rtb]:
                 if route['target'] != routes.get(route['destination']):
                     if pool:
-                        pool_results.append(pool.apply_async(replace_route, (
-                            rtb, route['destination'], route['target'])))
+                        pool_results.append(pool.submit(
+                            replace_route, rtb, route['destination'], route['target']))
                     else:
                         replace_route(rtb, route['destination'],
                                       route['target'])
                         failover_finished &= False
                 else:
-                    logger.debug('{}: {} {} already set'.format(
-                        rtb, route['destination'], route['target']))
+                    logger.debug('%s: %s %s already set', rtb, route['destination'], route['target'])
     else:
-        for interface in cphaconf[IFS]:
-            logger.debug('interface name: {}'.format(interface[NAME]))
-
-            if (conf['cluster_mode'] == mode.CLUSTER_MODE_HIGH_AVAILABILITY and
-                    conf['deploy_mode'] == mode.DEPLOY_MODE_SINGLE_AZ):
-                # HA only internal addresses
-                if interface['type'] not in ['internal']:
-                    logger.debug('Interface is not internal')
-                    continue
-            if 'subnet-id' not in interface:
-                logger.debug('No subnet id')
-                continue
+        for interface in get_interfaces_to_update_routes(cphaconf[IFS]):
             if pool:
-                pool_results.append(pool.apply_async(update_route_table, (interface,)))
+                pool_results.append(pool.submit(update_route_table, interface))
             else:
                 failover_finished &= update_route_table(interface)
-    if conf['cluster_mode'] == mode.CLUSTER_MODE_HIGH_AVAILABILITY:
-        # HA only secondary ips in single az or public VIP in cross az
-        if conf['deploy_mode'] == mode.DEPLOY_MODE_CROSS_AZ:
-            replace_if_function = associate_public_ip_addresses
-        else:
-            replace_if_function = assign_private_ip_addresses
+    replace_if_function = get_replace_interface_function()
+    if replace_if_function:
         for interface in cphaconf[IFS]:
             if pool:
-                pool_results.append(pool.apply_async(replace_if_function, (interface,)))
+                pool_results.append(pool.submit(replace_if_function, interface))
             else:
                 failover_finished &= replace_if_function(interface)
-    if failover_finished:
+    # With calls_in_parallel DONE is reported by poll() once the submitted calls are finished
+    if failover_finished and not pool_results:
         logger.debug('Updating cluster status file with %s status', DONE)
-        update_cluster_status_file(DONE)
+        set_cluster_status(DONE)
 
 
-def add_enis_to_peer_list(interface: dict, ip_peer_list: list) -> None:
+def build_failover_plan(interfaces, generation):
+    """
+    input: Snapshot of the cluster interfaces (with metadata) and the topology generation it belongs to
+    Describe the peer interfaces and the route tables and store the list of calls to make upon fail over
+    """
+    try:
+        plan = FailoverPlan(generation)
+        described = describe_network_interfaces_by_ip(
+            [(interface.get(AWSproperties.VPC_ID.value), interface.get(AWSproperties.OTHER_MEMBER_IF_IP.value))
+             for interface in interfaces])
+        for interface in interfaces:
+            if AWSproperties.OTHER_MEMBER_IF_IP.value not in interface or AWSproperties.VPC_ID.value not in interface:
+                interface[AWSproperties.PEER_INTERFACE.value] = {}
+                continue
+            interface[AWSproperties.PEER_INTERFACE.value] = described.get(
+                (interface[AWSproperties.VPC_ID.value], interface[AWSproperties.OTHER_MEMBER_IF_IP.value]))
+
+        plan.peers = json.dumps([interface[AWSproperties.PEER_INTERFACE.value] for interface in interfaces],
+                                sort_keys=True)
+
+        if conf['replace_all_route_tables']:
+            refresh_route_index(conf['route_index_max_age'], standby=True, interfaces=interfaces)
+            plan.route_index_version = _route_index.version
+            for interface in interfaces:
+                peer_eni = (interface[AWSproperties.PEER_INTERFACE.value] or {}).get('networkInterfaceId')
+                if not peer_eni:
+                    continue
+                for route_table_id, cidr, prefix_list in _route_index.lookup(peer_eni):
+                    plan.routes.append((route_table_id, cidr, interface[AWSproperties.INTERFACE_ID.value],
+                                        prefix_list, peer_eni, False))
+        elif 'rtbs' in cphaconf:
+            for rtb in cphaconf['rtbs']:
+                routes = get_routes(rtb)
+                for route in cphaconf['rtbs'][rtb]:
+                    if route['target'] != routes.get(route['destination']):
+                        plan.routes.append((rtb, route['destination'], route['target']))
+        else:
+            for interface in get_interfaces_to_update_routes(interfaces):
+                if interface[AWSproperties.PEER_INTERFACE.value]:
+                    plan.routes.extend(get_route_table_replacements(interface))
+
+        replace_if_function = get_replace_interface_function()
+        if replace_if_function:
+            plan.interfaces = [(replace_if_function, interface) for interface in interfaces]
+    except Exception:
+        logger.error('Failed to build failover plan\n{}'.format(traceback.format_exc()))
+        return
+
+    global _failover_plan, _topology_generation, _failover_plan_scheduled
+    with _failover_plan_lock:
+        if generation != _topology_generation:
+            logger.debug('Topology changed while building failover plan, dropping it')
+            return
+        if _failover_plan and not plan.same_topology(_failover_plan):
+            _topology_generation += 1
+            plan.generation = _topology_generation
+            _failover_plan_scheduled = (_topology_generation, _failover_plan_scheduled[1])
+            logger.info('Topology changed since the failover plan was built, replacing it')
+        _failover_plan = plan
+    logger.debug('Failover plan built: {} routes, {} interfaces'.format(len(plan.routes), len(plan.interfaces)))
+
+
+def schedule_failover_plan():
+    """
+    Rebuild the failover plan in the background on the first standby poll of a topology generation (RECONF, back from
+    active) and then every failover_plan_rebuild_interval seconds. Every build describes the peer interfaces (and the
+    route tables once the route index is older than route_index_max_age), a plan built from another topology replaces
+    the current one. No plan is built while failover_plan_max_age is 0.
+    """
+    global _failover_plan_builder, _failover_plan_scheduled
+    if conf['failover_plan_max_age'] <= 0:
+        return
+    with _failover_plan_lock:
+        if _failover_plan_builder and _failover_plan_builder.is_alive():
+            return
+        generation, started = _failover_plan_scheduled
+        if generation == _topology_generation and time.time() - started < conf['failover_plan_rebuild_interval']:
+            return
+        _failover_plan_scheduled = (_topology_generation, time.time())
+        interfaces = [dict(interface) for interface in cphaconf[IFS]]
+        _failover_plan_builder = threading.Thread(target=build_failover_plan, name='failover-plan',
+                                                  args=(interfaces, _topology_generation))
+        _failover_plan_builder.daemon = True
+        _failover_plan_builder.start()
+
+
+def take_failover_plan():
+    """return: The failover plan if it is up to date (it can be executed once), None otherwise"""
+    global _failover_plan
+    with _failover_plan_lock:
+        plan, _failover_plan = _failover_plan, None
+    if not plan:
+        return None
+    if plan.generation != _topology_generation or plan.age() >= conf['failover_plan_max_age']:
+        logger.info('Failover plan is outdated ({:.1f} seconds old)'.format(plan.age()))
+        return None
+    if plan.route_index_version is not None and plan.route_index_version != _route_index.version:
+        logger.info('Route index changed since the failover plan was built, not using it')
+        return None
+    return plan
+
+
+def invalidate_failover_plan():
+    """Drop the failover plan, a plan that is being built is dropped when it is done"""
+    global _failover_plan, _topology_generation
+    with _failover_plan_lock:
+        _failover_plan = None
+        _topology_generation += 1
+
+
+def execute_failover_plan(pool, plan):
+    """
+    Make the calls of the failover plan (through pool if given) and wait for them. The fail over is not done then:
+    the routes and addresses are described and verified afterwards, as without a plan, and DONE is reported by that.
+    """
+    logger.info('Executing failover plan built {:.1f} seconds ago: {} routes, {} interfaces'.format(
+        plan.age(), len(plan.routes), len(plan.interfaces)))
+    calls = [(replace_route, args) for args in plan.routes]
+    calls.extend((replace_if_function, (interface,)) for replace_if_function, interface in plan.interfaces)
+    if pool:
+        calls = [(pool.submit(func, *args).result, ()) for func, args in calls]
+    for func, args in calls:
+        try:
+            func(*args)
+        except Exception:
+            logger.error('{}'.format(traceback.format_exc()))
+
+
+def add_enis_to_peer_list(interface: dict, ip_peer_list: list, described: dict = None) -> None:
     """
     Args:
         interface: the current machine interface
         ip_peer_list: list of target ips that their eni must be
         added to the interface's peer list
+        described: result of describe_network_interfaces_by_ip for these ips, described here if not given
 
     The function will find the enis that associated with the ips
     in the ip_peer_list and add it to the interface's peer list
 
     """
+    vpc_id = interface[AWSproperties.VPC_ID.value]
+    if described is None:
+        described = describe_network_interfaces_by_ip([(vpc_id, peer_ip) for peer_ip in ip_peer_list])
     for peer_ip in ip_peer_list:
-        interface[AWSproperties.PEER_INTERFACE.value].append(
-            describe_network_interfaces(interface[AWSproperties.VPC_ID.value], peer_ip))
+        interface[AWSproperties.PEER_INTERFACE.value].append(described.get((vpc_id, peer_ip)))
 
 
 def move_routes_from_old_cluster_rtb(pool) -> None:
@@ -946,6 +2630,16 @@ def move_routes_from_old_cluster_rtb(pool) -> None:
     """
     args = MIGRATE_OBJECT.args
     get_interface_meta_data()
+    # Describe the ENIs of the other member and of both peer lists at once
+    addresses = []
+    for interface in cphaconf[IFS]:
+        vpc_id = interface.get(AWSproperties.VPC_ID.value)
+        addresses.append((vpc_id, interface.get(AWSproperties.OTHER_MEMBER_IF_IP.value)))
+        if interface[NAME] == AWSproperties.ETH0.value:
+            addresses.extend((vpc_id, peer_ip) for peer_ip in args.eth0_peer_list)
+        elif interface[NAME] == AWSproperties.ETH1.value:
+            addresses.extend((vpc_id, peer_ip) for peer_ip in args.eth1_peer_list)
+    described = describe_network_interfaces_by_ip(addresses)
     for interface in cphaconf[IFS]:
         # initiate the peer list to empty list
         interface[AWSproperties.PEER_INTERFACE.value] = []
@@ -953,46 +2647,118 @@ def move_routes_from_old_cluster_rtb(pool) -> None:
             continue
         # adding the other member's eni to the peer list
         interface[AWSproperties.PEER_INTERFACE.value].append(
-            describe_network_interfaces(interface[AWSproperties.VPC_ID.value],
-                                        interface[AWSproperties.OTHER_MEMBER_IF_IP.value]))
+            described.get((interface[AWSproperties.VPC_ID.value], interface[AWSproperties.OTHER_MEMBER_IF_IP.value])))
         # if the interface is 'eth0' add all the eth0_peer_list to peer list
         if interface[NAME] == AWSproperties.ETH0.value:
-            add_enis_to_peer_list(interface, args.eth0_peer_list)
+            add_enis_to_peer_list(interface, args.eth0_peer_list, described)
         # if the interface is 'eth1' add all the eth1_peer_list to peer list
         elif interface[NAME] == AWSproperties.ETH1.value:
-            add_enis_to_peer_list(interface, args.eth1_peer_list)
+            add_enis_to_peer_list(interface, args.eth1_peer_list, described)
     # change all the routes from peer list ENIs to the current interfaces
     set_all_route_tables(pool)
 
 
+class MembersStateReader(object):
+    """
+    Reads the state of the members from "cphaprob stat". A result is reused for ttl seconds, unless invalidated, so
+    that an idle tick and the poll it triggers run the command once.
+    """
+    LINE = re.compile(r'\d+\s+(\(local\)\s+)?([\d.]+)\s+\S+\s+(\S+)')
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self._result = None
+        self._time = 0
+
+    def invalidate(self):
+        """Forget the last result (called upon every ha.sock event)"""
+        self._result = None
+
+    def read(self):
+        if self._result and time.monotonic() - self._time < self.ttl:
+            return self._result
+        cphaprob = subprocess.check_output(['cphaprob', 'stat'])
+        cphaprob = cphaprob if isinstance(cphaprob, str) else cphaprob.decode('utf-8')
+        local_state = local_ip_addr = remote_state = remote_ip_addr = None
+        for line in cphaprob.split('\n'):
+            m = self.LINE.match(line)
+            if m:
+                pos = _get_interface_position(ETH0)
+                if m.group(1):
+                    local_state = m.group(3).lower()
+                    local_ip_addr = _get_ip_address(pos, AWSproperties.IPADDR.value)
+                else:
+                    remote_state = m.group(3).lower()
+                    remote_ip_addr = _get_ip_address(pos, AWSproperties.OTHER_MEMBER_IF_IP.value)
+        self._result = (local_state, local_ip_addr, remote_state, remote_ip_addr)
+        self._time = time.monotonic()
+        return self._result
+
+
+_members_state_reader = MembersStateReader(1.0)
+
+
 def fetch_members_state() -> (str, str, str, str):
     """
     Returns the state of the current member and the state of another member and their private ip addresses
     """
-    cphaprob = subprocess.check_output(['cphaprob', 'stat'])
-    cphaprob = cphaprob if isinstance(cphaprob, str) else cphaprob.decode('utf-8')
-    local_state = local_ip_addr = remote_state = remote_ip_addr = None
-    for line in cphaprob.split('\n'):
-        m = re.match(r'\d+\s+(\(local\)\s+)?([\d.]+)\s+\S+\s+(\S+)', line)
-        if m:
-            pos = _get_interface_position(ETH0)
-            if m.group(1):
-                local_state = m.group(3).lower()
-                local_ip_addr = _get_ip_address(pos, AWSproperties.IPADDR.value)
-            else:
-                remote_state = m.group(3).lower()
-                remote_ip_addr = _get_ip_address(pos, AWSproperties.OTHER_MEMBER_IF_IP.value)
+    return _members_state_reader.read()
+
 
-    return local_state, local_ip_addr, remote_state, remote_ip_addr
+def set_cluster_status(status):
+    """Update the cluster status file, unless it already holds status, and keep the status for poll()"""
+    global _cluster_status
+    trace = getattr(_trace_local, 'trace', None)
+    if trace:
+        trace.in_progress |= status == IN_PROGRESS
+        trace.done = status == DONE
+    if status == _cluster_status:
+        return
+    with trace_span('status', status=status):
+        update_cluster_status_file(status)
+    _cluster_status = status
+
+
+def is_poll_needed(state=None, probe=False):
+    """
+    Polls are skipped while the last poll settled less than idle_poll_interval seconds ago (active_poll_interval if
+    the member works, so that its routes and addresses are checked and repaired as often) and the member state did
+    not change.
+    state: the new member state carried by the event
+    probe: compare the members state of "cphaprob stat" with the one of the last poll (the event carries no state)
+    """
+    status = _poll_status
+    interval = conf['active_poll_interval'] if status['should_work'] else conf['idle_poll_interval']
+    if not status['settled'] or time.time() - status['time'] >= interval:
+        return True
+    if state:
+        # The event tells the local member state only, which is not enough to decide in Active Active mode
+        return conf['cluster_mode'] == mode.CLUSTER_MODE_ACTIVE_ACTIVE or \
+            state.startswith('active') != status['active']
+    if probe:
+        try:
+            local_state, _, remote_state, _ = fetch_members_state()
+        except Exception:
+            logger.error('{}'.format(traceback.format_exc()))
+            return True
+        return (local_state, remote_state) != status['states']
+    return False
 
 
 def poll():
     """Set cluster type and initiate fail over process is needed"""
     global pool_results
     pool = None
+    states = None
+    should_work = False
+    completed = False
+    trace = begin_poll_trace()
+    poll_span = trace_span('poll').__enter__()
     try:
         logger.info('poll called')
-        local_state, local_ip_addr, remote_state, remote_ip_addr = fetch_members_state()
+        with trace_span('cphaprob'):
+            local_state, local_ip_addr, remote_state, remote_ip_addr = fetch_members_state()
+        states = (local_state, remote_state)
 
         if conf['cluster_mode'] not in mode.CLUSTER_MODES:
             msg = ('Unknown cluster mode "{}". Please verify cluster configuration'.format(conf['cluster_mode']))
@@ -1003,7 +2769,6 @@ def poll():
         if not local_ip_addr or not local_state or not remote_ip_addr or not remote_state:
             raise Exception('Failed to extract local and remote ip addresses. Please verify "cphaprob stat" command')
 
-        should_work = False
         local_state = local_state.startswith('active')
         remote_state = remote_state.startswith('active')
         if conf['cluster_mode'] == mode.CLUSTER_MODE_ACTIVE_ACTIVE:
@@ -1021,35 +2786,67 @@ def poll():
 
         if not should_work:
             logger.debug('Updating cluster status file with %s status', NOT_STARTED)
-            update_cluster_status_file(NOT_STARTED)
+            set_cluster_status(NOT_STARTED)
 
         if should_work or conf['deploy_mode'] == mode.DEPLOY_MODE_CROSS_AZ:
             logger.debug('Active/Active Attention mode detected')
             if conf['calls_in_parallel']:
-                pool = multiprocessing.Pool(10)
+                pool = _executor
                 pool_results = []
             if MIGRATE_OBJECT.is_migrated:
                 if should_work:
                     MIGRATE_LOGGER.info("Updating route tables...")
                     move_routes_from_old_cluster_rtb(pool)
+                    wait_for_pool_results()
                     log_updated_route_tables_info()
                 else:
                     logger.debug('Updating cluster status file with %s status', NOT_STARTED)
-                    update_cluster_status_file(NOT_STARTED)
+                    set_cluster_status(NOT_STARTED)
                     MIGRATE_LOGGER.info("Check route tables updating information on the other member")
             else:
                 update_interfaces_dictionary(pool, should_work)
+        if not should_work and not MIGRATE_OBJECT.is_migrated:
+            # Keep a failover plan ready while standby, so that fail over makes no Describe* call
+            get_interface_meta_data()
+            schedule_failover_plan()
+        completed = True
     except Exception:
-        if pool:
-            pool.terminate()
+        for result in pool_results:
+            result.cancel()
         logger.error('{}'.format(traceback.format_exc()))
     finally:
-        if pool:
-            pool.close()
-            pool.join()
-            if all([result.get() for result in pool_results]):
+        if pool_results:
+            with trace_span('wait_pool_results', calls=len(pool_results)):
+                finished = wait_for_pool_results()
+            if finished:
                 logger.debug('Updating cluster status file with %s status', DONE)
-                update_cluster_status_file(DONE)
+                set_cluster_status(DONE)
+        pool_results = []
+        poll_span.__exit__(None, None, None)
+        end_poll_trace(trace, should_work)
+        local_active = bool(states and states[0] and states[0].startswith('active'))
+        _poll_status.update(time=time.time(), states=states, active=local_active,
+                            should_work=should_work if states else None,
+                            settled=completed and not MIGRATE_OBJECT.is_migrated and
+                            (not should_work or _cluster_status == DONE))
+
+
+def wait_for_pool_results():
+    """
+    Wait for all the calls submitted to the executor in this poll
+    return: True if all of them finished and reported that there was nothing to change
+    """
+    finished = True
+    for result in pool_results:
+        if result.cancelled():
+            finished = False
+            continue
+        try:
+            finished &= bool(result.result())
+        except Exception:
+            logger.error('{}'.format(traceback.format_exc()))
+            finished = False
+    return finished
 
 
 def _get_interface_position(interface: str) -> int:
@@ -1084,32 +2881,166 @@ def _ip_compare(local_ip_addr: str, remote_ip_addr: str) -> bool:
 
 
 def get_interface_meta_data():
-    """Get eni data from metadata"""
+    """Get eni data from the metadata cache, the attributes that are not cached are read from metadata concurrently"""
     logger.debug('Number of interfaces {}'.format(len(cphaconf[IFS])))
+    missing = [(interface, attr) for interface in cphaconf[IFS] for attr in INTERFACE_METADATA_ATTRIBUTES
+               if not interface.get(attr)]
+    if missing:
+        cache = load_metadata_cache()
+        macs = cache['macs'] if cache else {}
+        queries = []
+        for interface, attr in missing:
+            value = macs.get(interface['mac-addr'], {}).get(attr)
+            if value:
+                interface[attr] = value
+            else:
+                queries.append((interface, attr))
+        if queries:
+            size = min(len(queries), max(1, int(conf['parallel_pool_size'])))
+            with TracedThreadPoolExecutor(max_workers=size, thread_name_prefix='aws_had-imds') as imds_pool:
+                values = list(imds_pool.map(lambda query: get_interface_attribute(*query), queries))
+            for (interface, attr), value in zip(queries, values):
+                if value is None:
+                    logger.debug('Maximum retries reached - skipping attribute {}'.format(attr))
+                    continue
+                interface[attr] = value
+                macs.setdefault(interface['mac-addr'], {})[attr] = value
+            if cache:
+                save_metadata_cache()
     for interface in cphaconf[IFS]:
-        prefix = '{}/network/interfaces/macs/{}/'.format(aws.META_DATA, interface['mac-addr'])
-        for attr in ['vpc-id', 'subnet-id', 'interface-id']:
-            if attr in interface and interface[attr]:
-                continue
-            for r in range(10):
-                logger.debug('Query {} - retry #{}'.format(attr, r + 1))
-                try:
-                    res = aws.metadata(''.join([prefix, attr]))
-                    res = res if isinstance(res, str) else res.decode('utf-8')
-                    logger.debug('{} = {}'.format(attr, res))
-                    interface[attr] = res
-                    break
-                except RequestException:
-                    logger.debug('Attribute {} not found in MEDADATA'.format(attr))
-                    time.sleep(5)
-            if attr not in interface:
-                logger.debug('Maximum retries reached - skipping attribute {}'.format(attr))
-        logger.debug('{}'.format(repr(interface)))
+        logger.debug('%r', interface)
+
+
+def get_interface_attribute(interface, attr):
+    """return: Value of the metadata attribute of the interface mac address, None if it was not found"""
+    path = '{}/network/interfaces/macs/{}/{}'.format(aws.META_DATA, interface['mac-addr'], attr)
+    for r in range(10):
+        logger.debug('Query {} - retry #{}'.format(attr, r + 1))
+        try:
+            res = metadata(path)
+            logger.debug('{} = {}'.format(attr, res))
+            return res
+        except (RequestException, IMDSError):
+            logger.debug('Attribute {} not found in MEDADATA'.format(attr))
+            time.sleep(5)
+    return None
+
+
+def _is_valid_conf_value(default, value):
+    """return: True if value has the same type as the default value of the tunable"""
+    if isinstance(default, bool):
+        return isinstance(value, bool)
+    if isinstance(default, (int, float)):
+        return isinstance(value, (int, float)) and not isinstance(value, bool)
+    return isinstance(value, type(default))
+
+
+def load_had_conf():
+    """Load the aws_had tunables from AWS_HAD_CONF, missing or invalid values fall back to their defaults"""
+    values = dict(HAD_CONF_DEFAULTS)
+    if os.path.exists(AWS_HAD_CONF):
+        try:
+            with open(AWS_HAD_CONF) as f:
+                data = json.load(f)
+            for key, value in data.items():
+                default = HAD_CONF_DEFAULTS.get(key)
+                if default is None:
+                    logger.warning('Unknown key {} in {}'.format(key, AWS_HAD_CONF))
+                elif not _is_valid_conf_value(default, value):
+                    logger.warning('Invalid value {} for {} in {}'.format(repr(value), key, AWS_HAD_CONF))
+                else:
+                    values[key] = value
+        except (ValueError, OSError):
+            logger.error('Failed to load {}\n{}'.format(AWS_HAD_CONF, traceback.format_exc()))
+    conf.update(values)
+
+
+def configure_executor():
+    """Create the executor used for calls_in_parallel, or replace it if its size was changed"""
+    global _executor, _executor_size
+    size = max(1, int(conf['parallel_pool_size']))
+    if _executor and _executor_size == size:
+        return
+    old_executor = _executor
+    _executor = TracedThreadPoolExecutor(max_workers=size, thread_name_prefix='aws_had')
+    _executor_size = size
+    logger.debug('Executor created with {} threads'.format(size))
+    if old_executor:
+        # Calls already submitted to the old executor are completed by its threads
+        old_executor.shutdown(wait=False)
+
+
+def configure_ec2_client():
+    """Create the keep-alive EC2 client if keep_alive_client is set, requests are sent with aws.py otherwise"""
+    global _ec2_client
+    old_client = _ec2_client
+    _ec2_client = None
+    if old_client:
+        old_client.close()
+    if not conf['keep_alive_client']:
+        return
+    if conf['remote']:
+        credentials = StaticCredentials(conf['AWS_ACCESS_KEY'], conf['AWS_SECRET_KEY'])
+    else:
+        credentials = RoleCredentials()
+    try:
+        _ec2_client = EC2Client(conf['EC2_REGION'], credentials, endpoint=conf['ec2_endpoint'],
+                                proxy=conf.get('proxy'), max_idle=conf['ec2_max_idle_connections'],
+                                idle_timeout=conf['ec2_idle_timeout'], ca_bundle=conf['ec2_ca_bundle'])
+    except (ssl.SSLError, OSError, ValueError):
+        logger.error('Failed to create the EC2 client, sending requests with aws.py\n{}'.format(
+            traceback.format_exc()))
+        return
+    logger.debug('EC2 client created for {}'.format(_ec2_client.host))
+
+
+def prewarm_ec2_client():
+    """
+    Keep the keep-alive EC2 client ready for the first calls of a fail over, every ec2_prewarm_interval seconds (and
+    at least twice per ec2_idle_timeout): role credentials renewed ahead of their refresh, the endpoint name resolved
+    and ec2_prewarm_connections connections open, so that such a call takes one round trip. No EC2 call is sent.
+    """
+    while True:
+        client = _ec2_client
+        interval = conf['ec2_prewarm_interval']
+        wait = None
+        if client and interval > 0:
+            wait = min(interval, client.idle_timeout / 2.0)
+            try:
+                opened = client.prewarm(int(conf['ec2_prewarm_connections']), fresh_for=wait, ahead=2 * interval,
+                                        dns_ttl=conf['ec2_dns_ttl'])
+                if opened:
+                    logger.debug('Opened %s connections to %s ahead of the next calls', opened, client.host)
+            except Exception:
+                logger.warning('Failed to prepare the EC2 client\n{}'.format(traceback.format_exc()))
+        _prewarm_wakeup.wait(wait)
+        _prewarm_wakeup.clear()
+
+
+def start_prewarm():
+    """Start the background task of prewarm_ec2_client, or wake it up to apply the tunables and EC2 client of reconf"""
+    global _prewarm_thread
+    if _prewarm_thread:
+        _prewarm_wakeup.set()
+        return
+    _prewarm_thread = threading.Thread(target=prewarm_ec2_client, name='aws_had-prewarm')
+    _prewarm_thread.daemon = True
+    _prewarm_thread.start()
+
+
+def configure_request_limiter():
+    """Apply the rate limit tunables to the request limiter"""
+    _request_limiter.configure(conf['ec2_rate_limit'], conf['ec2_burst'], conf['parallel_pool_size'])
 
 
 def reconf():
     """Initiate clusters interfaces data and call pool function"""
-    global cphaconf
+    global cphaconf, _fw_os_proxy_port
+
+    load_had_conf()
+    configure_executor()
+    configure_request_limiter()
+    configure_imds_client()
 
     http_proxy = urlparse(os.environ.get('http_proxy'))
     proxy_address = http_proxy.hostname or ''
@@ -1117,13 +3048,18 @@ def reconf():
 
     if proxy_address != '' and proxy_port.isdigit():
         conf['proxy'] = ':'.join([proxy_address, proxy_port])
-        if not os.path.exists('/opt/CPsuite-R77'):
-            subprocess.call('fw ctl set int fw_os_proxy_port {}'.format(
-                proxy_port), shell=True)
     else:
         conf['proxy'] = None
-        if not os.path.exists('/opt/CPsuite-R77'):
-            subprocess.call('fw ctl set int fw_os_proxy_port 0', shell=True)
+        proxy_port = '0'
+    if not os.path.exists('/opt/CPsuite-R77') and proxy_port != _fw_os_proxy_port:
+        try:
+            if subprocess.call(['fw', 'ctl', 'set', 'int', 'fw_os_proxy_port', proxy_port]) == 0:
+                _fw_os_proxy_port = proxy_port
+        except OSError:
+            logger.error('Failed to set fw_os_proxy_port\n{}'.format(traceback.format_exc()))
+
+    configure_ec2_client()
+    start_prewarm()
 
     if conf['remote']:
         with open('cphaconf.txt') as f:
@@ -1132,32 +3068,44 @@ def reconf():
         cphaconf = json.loads(
             subprocess.check_output(['cphaconf', 'aws_mode']))
     update_cphaconf()
+    get_interface_meta_data()
+    _route_index.invalidate()
+    invalidate_failover_plan()
     aws_rtb = '/etc/fw/conf/aws_rtb.json'
     if (not MIGRATE_OBJECT.is_migrated) and os.path.exists(aws_rtb):
         with open(aws_rtb) as f:
             rtbs = json.load(f)
-        logger.debug('route-tables:\n{}'.format(repr(rtbs)))
-        name2eni = {}
-        for interface in cphaconf[IFS]:
-            name2eni[interface[NAME]] = interface.get('interface-id')
-        cphaconf['rtbs'] = {}
-        for rtb in rtbs:
-            cphaconf['rtbs'][rtb] = []
-            for route in rtbs[rtb]:
-                target = route['target']
-                if not target.startswith('eni-'):
-                    eni = name2eni[target]
-                    if not eni:
-                        logger.info('No interface found for {}'.format(target))
-                        continue
-                    route['target'] = eni
-                cphaconf['rtbs'][rtb].append(route)
-
-    logger.debug('cphaconf:\n{}'.format(repr(cphaconf)))
+        logger.debug('route-tables:\n%r', rtbs)
+        cphaconf['rtbs'] = translate_route_tables(rtbs)
+
+    logger.debug('cphaconf:\n%r', cphaconf)
 
     poll()
 
 
+def translate_route_tables(rtbs):
+    """
+    input: aws_rtb.json content, the routes of every route table with their target as eni id or interface name
+    return: The routes of every route table with the interface names replaced by the eni id of the local member
+    """
+    name2eni = {}
+    for interface in cphaconf[IFS]:
+        name2eni[interface[NAME]] = interface.get('interface-id')
+    translated = {}
+    for rtb in rtbs:
+        translated[rtb] = []
+        for route in rtbs[rtb]:
+            target = route['target']
+            if not target.startswith('eni-'):
+                eni = name2eni[target]
+                if not eni:
+                    logger.info('No interface found for {}'.format(target))
+                    continue
+                route['target'] = eni
+            translated[rtb].append(route)
+    return translated
+
+
 def load_aws_client(args):
     """Init AWS class object (AWS SDK)"""
     global _aws
@@ -1180,9 +3128,13 @@ def init_conf(args):
         conf['remote'] = True
     else:
         conf['remote'] = False
-        r = aws.metadata(
-            '{}/placement/availability-zone'.format(aws.META_DATA))
-        az = r.strip()
+        cache = load_metadata_cache()
+        az = cache.get('availability-zone') if cache else None
+        if not az:
+            az = metadata('{}/placement/availability-zone'.format(aws.META_DATA)).strip()
+            if cache:
+                cache['availability-zone'] = az
+                save_metadata_cache()
         az_parts = az.split('-')
         if len(az_parts) >= 3:
             # Normal AZ example: "us-east-1a" -> region is "us-east-1" (strip trailing letter)
@@ -1202,7 +3154,7 @@ def init_conf(args):
     for key in conf.keys():
         if key in ['AWS_ACCESS_KEY', 'AWS_SECRET_KEY']:
             continue
-        logger.debug('{}: {}'.format(key, repr(conf[key])))
+        logger.debug('%s: %r', key, conf[key])
 
 
 def parse_args():
@@ -1322,23 +3274,23 @@ def update_cphaconf() -> None:
     AWS portal after fetching them by using DescribeNetworkInterfaces request with the instance-id filter
     """
     logger.debug('update_cphaconf called')
-    instance_id = aws.metadata('/latest/meta-data/instance-id')
+    instance_id = get_instance_id()
     logger.debug(f"Instance id: {instance_id}")
     q_params = urlencode({'Action': 'DescribeNetworkInterfaces',
                           'Filter.0.Name': 'attachment.instance-id',
                           'Filter.0.Value': instance_id})
     logger.debug("Fetching interfaces of the instance from AWS...")
-    logger.debug('{}'.format(repr(q_params)))
+    logger.debug('%r', q_params)
     logger.debug("The interfaces of the instance that were fetched from AWS are:")
     body = request(q_params)
     ec2_private_ips = []
     for item in body['networkInterfaceSet']['item']:
         ec2_private_ips.append(item['privateIpAddress'])
     logger.debug("The interfaces of the instance that were fetched from cphaconf file are:")
-    logger.debug(json.dumps(cphaconf[IFS]))
+    logger.debug('%s', LogJSON(cphaconf[IFS]))
     cphaconf[IFS] = [interface for interface in cphaconf[IFS] if interface[AWSproperties.IPADDR.value] in ec2_private_ips]
     logger.debug("The updated interfaces in cphaconf dictionary after the intersection are:")
-    logger.debug(json.dumps(cphaconf[IFS]))
+    logger.debug('%s', LogJSON(cphaconf[IFS]))
 
 
 def get_diagnostics() -> None:
@@ -1355,14 +3307,13 @@ def multiple_vips_diagnostic() -> None:
     logger.debug(f"Updating {CLOUD_FEATURES_JSON_PATH} with multiple vips feature status")
     try:
         key = AWS_MULTIPLE_VIPS
-        with open(CROSS_AZ_CLUSTER_SEC_IP_MAP, "r") as file:
-            xaz_ip_map = json.load(file)
-            if len(xaz_ip_map) > 1:
-                output_set, error_set, status_set = cloud_features_config.set_attribute(key, 1)
-                logger.debug(error_set) if status_set == 1 else None
-            else:
-                output_set, error_set, status_set = cloud_features_config.set_attribute(key, 0)
-                logger.debug(error_set) if status_set == 1 else None
+        xaz_ip_map = _cross_az_map_store.load()
+        if len(xaz_ip_map) > 1:
+            output_set, error_set, status_set = cloud_features_config.set_attribute(key, 1)
+            logger.debug(error_set) if status_set == 1 else None
+        else:
+            output_set, error_set, status_set = cloud_features_config.set_attribute(key, 0)
+            logger.debug(error_set) if status_set == 1 else None
     except FileNotFoundError:
         logger.debug(f"The file {CROSS_AZ_CLUSTER_SEC_IP_MAP} does not exist. Failed to send multiple VIPs statistic.")
     except json.JSONDecodeError:
@@ -1378,6 +3329,11 @@ def main():
         handle_migrate_environment(args)
     else:
         logger.info('Started')
+    load_had_conf()
+    start_log_listener()
+    configure_executor()
+    configure_request_limiter()
+    configure_imds_client()
     while True:
         try:
             init_conf(args)
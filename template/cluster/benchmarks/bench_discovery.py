@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+
+#   Copyright 2018 Check Point Software Technologies LTD
+
+"""
+Route discovery benchmark for aws_had.py.
+
+Times refresh_route_index() (the DescribeRouteTables pages of a VPC and the route index built from them) against the
+fake EC2 endpoint, for a VPC with a few route tables pointing to the cluster members and a growing number of route
+tables of other appliances. Modes:
+    all     - every route table of the VPC is described and filtered locally (route_tables_eni_filter off)
+    eni     - EC2 returns only the route tables with a route to the ENIs of the members (route.network-interface-id)
+    eni+tag - as eni, and only the route tables with the cluster tag (route_tables_tag)
+
+For example:
+    python3 benchmarks/bench_discovery.py --other-tables 0 100 1000 5000 --rtt-ms 20
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import fake_aws  # noqa: E402
+
+MODES = {'all': {'route_tables_eni_filter': False, 'route_tables_tag': ''},
+         'eni': {'route_tables_eni_filter': True, 'route_tables_tag': ''},
+         'eni+tag': {'route_tables_eni_filter': True, 'route_tables_tag': '='.join(fake_aws.CLUSTER_TAG)}}
+
+
+def configure(aws_had, topology, server):
+    from aws_ha_globals import IFS, NAME
+    aws_had.conf.update({'EC2_REGION': 'us-east-1', 'remote': True, 'AWS_ACCESS_KEY': 'AKIDEXAMPLE',
+                         'AWS_SECRET_KEY': 'secret', 'keep_alive_client': True,
+                         'ec2_endpoint': 'http://' + server.address, 'ec2_rate_limit': 0})
+    aws_had.configure_ec2_client()
+    aws_had.configure_request_limiter()
+    aws_had.cphaconf = {IFS: [{NAME: i['name'], 'vpc-id': i['vpc'], 'interface-id': i['local_eni'],
+                               'peer-interface': {'networkInterfaceId': i['peer_eni']}}
+                              for i in topology.interfaces]}
+
+
+def measure(aws_had, topology, state, server, repeat):
+    """return: best seconds of a refresh_route_index() from an empty index, and the calls and bytes of one"""
+    peer_enis = [i['peer_eni'] for i in topology.interfaces]
+    best = None
+    for _ in range(repeat):
+        aws_had._route_index.invalidate()
+        state.clear_calls()
+        sent = server.bytes_sent
+        start = time.perf_counter()
+        aws_had.refresh_route_index(0)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+        calls = state.calls.get('DescribeRouteTables', 0)
+        size = server.bytes_sent - sent
+    routes = sum(len(aws_had._route_index.lookup(eni)) for eni in peer_enis)
+    return best, calls, size, routes
+
+
+def run(args):
+    import aws_had
+    aws_had.logger.setLevel(args.log_level)
+    results = []
+    for other_tables in args.other_tables:
+        topology = fake_aws.Topology(route_tables=args.route_tables, other_tables=other_tables,
+                                     other_routes=args.other_routes)
+        state = fake_aws.FakeEC2State(topology)
+        with fake_aws.FakeServer(fake_aws.FakeEC2(state), rtt=args.rtt_ms / 1000.0) as server:
+            configure(aws_had, topology, server)
+            for mode, tunables in MODES.items():
+                aws_had.conf.update(tunables)
+                seconds, calls, size, routes = measure(aws_had, topology, state, server, args.repeat)
+                results.append({'route_tables': args.route_tables + other_tables, 'mode': mode,
+                                'ms': round(seconds * 1000, 1), 'pages': calls, 'kb': round(size / 1024.0, 1),
+                                'peer_routes': routes})
+        if len({r['peer_routes'] for r in results if r['route_tables'] == args.route_tables + other_tables}) != 1:
+            raise SystemExit('{} route tables: the modes found different routes'.format(
+                args.route_tables + other_tables))
+    return results
+
+
+def report(results, args):
+    if args.json:
+        print(json.dumps({'rtt_ms': args.rtt_ms, 'cluster_route_tables': args.route_tables, 'results': results},
+                         indent=4))
+        return
+    print('rtt={}ms, {} route tables point to the cluster members'.format(args.rtt_ms, args.route_tables))
+    line = '{:>12} {:>8} {:>10} {:>6} {:>10} {:>12}'
+    print(line.format('route tables', 'mode', 'ms', 'pages', 'KB', 'peer routes'))
+    for r in results:
+        print(line.format(r['route_tables'], r['mode'], r['ms'], r['pages'], r['kb'], r['peer_routes']))
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='aws_had.py route discovery benchmark')
+    parser.add_argument('--route-tables', type=int, default=10, help='route tables pointing to the cluster members')
+    parser.add_argument('--other-tables', type=int, nargs='+', default=[0, 100, 1000],
+                        help='route tables of other appliances in the same VPC, to measure')
+    parser.add_argument('--other-routes', type=int, default=20, help='unrelated routes per table')
+    parser.add_argument('--rtt-ms', type=float, default=0.0, help='emulated round trip to the EC2 endpoint')
+    parser.add_argument('--repeat', type=int, default=3, help='runs per mode, the best one is reported')
+    parser.add_argument('--log-level', default='WARNING', help='aws_had logger level during the run')
+    parser.add_argument('--json', action='store_true', default=False, help='print results as JSON')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    report(run(args), args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,217 @@
+#!/usr/bin/env python3
+
+#   Copyright 2018 Check Point Software Technologies LTD
+
+"""
+ha.sock event handling micro-benchmark for aws_had.py.
+
+Runs the real Server.run() loop with poll() replaced by a stand-in that only reads "cphaprob stat" (a scripted one)
+and measures:
+    burst   - datagrams handled per second and polls run for a burst of events, per event_coalesce_window
+    latency - time from a CHANGED:active datagram to poll(), per event_coalesce_window
+    idle    - cost of an idle tick (select timeout), for senders with and without the member state in the datagram
+
+For example:
+    python3 benchmarks/bench_events.py --events 10000 --windows 0 0.02 0.1
+"""
+
+import argparse
+import json
+import os
+import shutil
+import socket
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import fake_aws  # noqa: E402
+from bench_failover import percentile  # noqa: E402
+
+
+class EventBench(object):
+    """A Server.run() loop whose poll() only fetches the members state"""
+
+    def __init__(self, aws_had, work_dir):
+        from aws_ha_globals import IFS, NAME, TYPE, AWSproperties
+        self.aws_had = aws_had
+        self.polls = []
+        self.probes = 0
+        self.ticks = []
+        bin_dir = os.path.join(work_dir, 'bin')
+        os.makedirs(os.path.join(work_dir, 'tmp'), exist_ok=True)
+        os.makedirs(bin_dir, exist_ok=True)
+        topology = fake_aws.Topology(route_tables=1)
+        eth0 = topology.interfaces[0]
+        self.cluster = fake_aws.ScriptedCluster(bin_dir, eth0['local_ip'], eth0['peer_ip'])
+        os.environ['PATH'] = bin_dir + os.pathsep + os.environ.get('PATH', '')
+        os.environ['FWDIR'] = work_dir
+        aws_had.cphaconf = topology.cphaconf(IFS, NAME, TYPE, AWSproperties.IPADDR.value,
+                                             AWSproperties.OTHER_MEMBER_IF_IP.value)
+        self._fetch_members_state = aws_had.fetch_members_state
+        self._is_poll_needed = aws_had.is_poll_needed
+        aws_had.fetch_members_state = self._fetch
+        aws_had.is_poll_needed = self._timed_is_poll_needed
+        aws_had.poll = self._poll
+        aws_had.reconf = lambda: None
+
+    def _fetch(self):
+        self.probes += 1
+        return self._fetch_members_state()
+
+    def _timed_is_poll_needed(self, state=None, probe=False):
+        start = time.perf_counter()
+        try:
+            return self._is_poll_needed(state=state, probe=probe)
+        finally:
+            if state is None:
+                self.ticks.append(time.perf_counter() - start)
+
+    def _poll(self):
+        self.polls.append(time.perf_counter())
+        local_state, _, remote_state, _ = self._fetch_members_state()
+        self.aws_had._poll_status.update(time=time.time(), states=(local_state, remote_state),
+                                         active=local_state.startswith('active'), settled=True)
+
+    def start(self, timeout=5.0):
+        self.server = self.aws_had.Server()
+        self.server.timeout = timeout
+        self.thread = threading.Thread(target=self.server.run, name='aws_had-server')
+        self.thread.daemon = True
+        self.thread.start()
+        self.sender = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+
+    def send(self, event):
+        self.sender.sendto(event.encode('utf-8'), self.server.sockpath)
+
+    def stop(self):
+        self.send('STOP')
+        self.thread.join(30)
+        self.sender.close()
+        self.server.__exit__(None, None, None)
+
+    def reset(self):
+        self.polls = []
+        self.probes = 0
+        self.ticks = []
+
+
+def bench_burst(bench, aws_had, window, events, event):
+    aws_had.conf['event_coalesce_window'] = window
+    bench.cluster.set_local(active=False)
+    bench.start()
+    bench.send('CHANGED')
+    time.sleep(0.02 + window)
+    bench.reset()
+    start = time.perf_counter()
+    for _ in range(events):
+        bench.send(event)
+    bench.stop()
+    elapsed = time.perf_counter() - start
+    return {'window': window, 'event': event, 'events': events, 'seconds': round(elapsed, 3),
+            'events_per_second': int(events / elapsed), 'polls': len(bench.polls)}
+
+
+def bench_latency(bench, aws_had, window, samples):
+    aws_had.conf['event_coalesce_window'] = window
+    bench.start()
+    latencies = []
+    for _ in range(samples):
+        bench.cluster.set_local(active=False)
+        bench.send('CHANGED')
+        time.sleep(0.02 + window)
+        bench.reset()
+        bench.cluster.set_local(active=True)
+        start = time.perf_counter()
+        bench.send('CHANGED:active')
+        deadline = start + 5
+        while not bench.polls and time.perf_counter() < deadline:
+            time.sleep(0.0005)
+        if bench.polls:
+            latencies.append(bench.polls[0] - start)
+    bench.stop()
+    return {'window': window, 'samples': len(latencies),
+            'p50_ms': round(percentile(latencies, 50) * 1000, 2) if latencies else None,
+            'p99_ms': round(percentile(latencies, 99) * 1000, 2) if latencies else None}
+
+
+def bench_idle(bench, aws_had, state_events, seconds, tick):
+    aws_had.conf['event_coalesce_window'] = 0
+    bench.cluster.set_local(active=False)
+    bench.start(timeout=tick)
+    bench.send('CHANGED:standby' if state_events else 'CHANGED')
+    time.sleep(0.1)
+    bench.reset()
+    time.sleep(seconds)
+    ticks, polls, probes = list(bench.ticks), len(bench.polls), bench.probes
+    bench.stop()
+    return {'sender': 'CHANGED:<state>' if state_events else 'CHANGED', 'ticks': len(ticks),
+            'polls': polls, 'state_reads': probes,
+            'tick_us': round(sum(ticks) / len(ticks) * 1e6, 1) if ticks else None}
+
+
+def run(args):
+    import aws_had
+    aws_had.logger.setLevel(args.log_level)
+    # Settled standby polls are skipped for idle_poll_interval, make sure it does not expire during a run
+    aws_had.conf['idle_poll_interval'] = 3600
+    work_dir = tempfile.mkdtemp(prefix='aws_had_events_')
+    try:
+        bench = EventBench(aws_had, work_dir)
+        results = {'burst': [], 'latency': [], 'idle': []}
+        for window in args.windows:
+            for event in ('CHANGED', 'CHANGED:standby'):
+                results['burst'].append(bench_burst(bench, aws_had, window, args.events, event))
+            results['latency'].append(bench_latency(bench, aws_had, window, args.samples))
+        for state_events in (False, True):
+            results['idle'].append(bench_idle(bench, aws_had, state_events, args.idle_seconds, args.tick))
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return results
+
+
+def report(results, args):
+    if args.json:
+        print(json.dumps(results, indent=4))
+        return
+    print('burst: {} datagrams sent back to back'.format(args.events))
+    line = '{:>10} {:>18} {:>10} {:>12} {:>8}'
+    print(line.format('window s', 'event', 'seconds', 'events/s', 'polls'))
+    for r in results['burst']:
+        print(line.format(r['window'], r['event'], r['seconds'], r['events_per_second'], r['polls']))
+    print('\nlatency: CHANGED:active datagram -> poll()')
+    line = '{:>10} {:>10} {:>10} {:>10}'
+    print(line.format('window s', 'samples', 'p50 ms', 'p99 ms'))
+    for r in results['latency']:
+        print(line.format(r['window'], r['samples'], *['-' if r[k] is None else r[k] for k in ('p50_ms', 'p99_ms')]))
+    print('\nidle: {} seconds of select timeouts every {} seconds, standby member'.format(args.idle_seconds, args.tick))
+    line = '{:>18} {:>8} {:>8} {:>14} {:>10}'
+    print(line.format('sender', 'ticks', 'polls', 'state reads', 'tick us'))
+    for r in results['idle']:
+        print(line.format(r['sender'], r['ticks'], r['polls'], r['state_reads'],
+                          '-' if r['tick_us'] is None else r['tick_us']))
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='aws_had.py ha.sock event handling micro-benchmark')
+    parser.add_argument('--events', type=int, default=10000, help='datagrams per burst')
+    parser.add_argument('--windows', type=float, nargs='+', default=[0, 0.02, 0.1],
+                        help='event_coalesce_window values to measure')
+    parser.add_argument('--samples', type=int, default=50, help='latency samples per window')
+    parser.add_argument('--idle-seconds', type=float, default=2.0, help='seconds of idle ticks per sender')
+    parser.add_argument('--tick', type=float, default=0.01, help='select timeout of the idle run')
+    parser.add_argument('--log-level', default='WARNING', help='aws_had logger level during the run')
+    parser.add_argument('--json', action='store_true', default=False, help='print results as JSON')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    report(run(args), args)
+
+
+if __name__ == '__main__':
+    main()
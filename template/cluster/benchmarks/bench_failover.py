@@ -0,0 +1,300 @@
+#!/usr/bin/env python3
+
+#   Copyright 2018 Check Point Software Technologies LTD
+
+"""
+End-to-end failover latency benchmark for aws_had.py.
+
+Runs the real Server.run() loop against local stand-ins (fake EC2 Query API, fake IMDS and a scripted
+"cphaprob stat") and measures the time from a CHANGED datagram on ha.sock to
+update_cluster_status_file(DONE), for topologies of a growing number of route tables.
+
+Run it on a lab gateway (or any host where $FWDIR/scripts provides aws.py, https.py and the aws_ha_*
+modules), for example:
+    python3 benchmarks/bench_failover.py --route-tables 1 10 100 500 --iterations 20 --rtt-ms 20
+"""
+
+import argparse
+import json
+import os
+import shutil
+import socket
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import fake_aws  # noqa: E402
+
+
+def percentile(samples, pct):
+    """Nearest-rank percentile"""
+    ordered = sorted(samples)
+    if not ordered:
+        return None
+    rank = max(0, min(len(ordered) - 1, int(round(pct / 100.0 * len(ordered) + 0.5)) - 1))
+    return ordered[rank]
+
+
+class StatusRecorder(object):
+    """Replaces aws_had.update_cluster_status_file and timestamps every status update"""
+
+    def __init__(self):
+        self.cond = threading.Condition()
+        self.updates = []
+
+    def __call__(self, status):
+        with self.cond:
+            self.updates.append((time.perf_counter(), status))
+            self.cond.notify_all()
+
+    def wait_for(self, status, since, timeout):
+        deadline = time.perf_counter() + timeout
+        with self.cond:
+            while True:
+                for ts, s in self.updates:
+                    if s == status and ts >= since:
+                        return ts
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    return None
+                self.cond.wait(remaining)
+
+
+class Bench(object):
+    """One aws_had instance wired to the stand-ins of a single topology"""
+
+    def __init__(self, aws_had, topology, args, work_dir):
+        self.aws_had = aws_had
+        self.topology = topology
+        self.args = args
+        self.work_dir = work_dir
+        self.state = fake_aws.FakeEC2State(topology)
+        rtt = args.rtt_ms / 1000.0
+        ec2 = fake_aws.FakeEC2(self.state, mutation_rate=args.throttle_rate, mutation_burst=args.throttle_burst)
+        self.ec2 = fake_aws.FakeServer(ec2, rtt=rtt, handshake_rtts=args.handshake_rtts)
+        self.imds = fake_aws.FakeServer(fake_aws.FakeIMDS(topology))
+        self.recorder = StatusRecorder()
+
+    def __enter__(self):
+        self.ec2.__enter__()
+        self.imds.__enter__()
+        self._configure()
+        return self
+
+    def __exit__(self, *args):
+        self._send('STOP')
+        self.server_thread.join(10)
+        self.ec2.__exit__(*args)
+        self.imds.__exit__(*args)
+
+    def _configure(self):
+        import aws
+        from aws_ha_globals import IFS, NAME, TYPE, AWSproperties
+        aws_had = self.aws_had
+        bin_dir = os.path.join(self.work_dir, 'bin')
+        os.makedirs(os.path.join(self.work_dir, 'tmp'), exist_ok=True)
+        os.makedirs(bin_dir, exist_ok=True)
+        eth0 = self.topology.interfaces[0]
+        self.cluster = fake_aws.ScriptedCluster(bin_dir, eth0['local_ip'], eth0['peer_ip'])
+        os.environ['PATH'] = bin_dir + os.pathsep + os.environ.get('PATH', '')
+        # Server() keeps ha.sock and ha.pid under $FWDIR/tmp - never touch the ones of a running daemon
+        os.environ['FWDIR'] = self.work_dir
+        os.chdir(self.work_dir)
+        with open('cphaconf.txt', 'w') as f:
+            json.dump(self.topology.cphaconf(IFS, NAME, TYPE, AWSproperties.IPADDR.value,
+                                             AWSproperties.OTHER_MEMBER_IF_IP.value), f)
+
+        with open('aws_had.json', 'w') as f:
+            json.dump({'calls_in_parallel': self.args.parallel, 'parallel_pool_size': self.args.pool_size,
+                       'keep_alive_client': not self.args.aws_py,
+                       'ec2_endpoint': 'http://' + self.ec2.address,
+                       'imds_endpoint': 'http://' + self.imds.address,
+                       'failover_plan_max_age': 0 if self.args.no_plan else 60,
+                       'route_index_max_age': 0 if self.args.no_plan else 30,
+                       'ec2_idle_timeout': self.args.idle_timeout,
+                       'ec2_prewarm_interval': 0 if self.args.no_prewarm else self.args.prewarm_interval}, f)
+
+        # Used if the IMDSv2 client of aws_had cannot reach the fake IMDS
+        aws.metadata = fake_aws.imds_metadata(self.imds.address)
+        # Used when keep_alive_client is cleared (--aws-py): a new connection per call, like aws.py
+        aws_had._aws = fake_aws.LocalEC2Client(self.ec2.address)
+        aws_had.update_cluster_status_file = self.recorder
+        aws_had.AWS_HAD_CONF = os.path.join(self.work_dir, 'aws_had.json')
+        aws_had.conf.update({'EC2_REGION': 'us-east-1', 'remote': True,
+                             'AWS_ACCESS_KEY': 'AKIDEXAMPLE', 'AWS_SECRET_KEY': 'secret',
+                             'replace_all_route_tables': not self.args.by_interface})
+        aws_had.reconf()
+        self.server = aws_had.Server()
+        self.server_thread = threading.Thread(target=self.server.run, name='aws_had-server')
+        self.server_thread.daemon = True
+        self.server_thread.start()
+
+    def _send(self, event):
+        s = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        try:
+            s.sendto(event.encode('utf-8'), self.server.sockpath)
+        finally:
+            s.close()
+
+    def _standby_poll(self):
+        # NOT_STARTED is only reported when the status changes, wait for the poll itself
+        polled = self.aws_had._poll_status['time']
+        self._send('CHANGED')
+        deadline = time.perf_counter() + self.args.timeout
+        while self.aws_had._poll_status['time'] == polled and time.perf_counter() < deadline:
+            time.sleep(0.005)
+
+    def failover(self):
+        """
+        Promote the local member, then give the routes back to the peer.
+        return: seconds until DONE, until the first and the last mutating EC2 call, EC2 calls made, routes left behind
+        """
+        time.sleep(self.args.settle)
+        self.state.clear_calls()
+        connections = self.ec2.connections
+        start = time.perf_counter()
+        self.cluster.set_local(active=True)
+        self._send('CHANGED')
+        done = self.recorder.wait_for(self.aws_had.DONE, start, self.args.timeout)
+        calls = dict(self.state.calls)
+        calls['connections'] = self.ec2.connections - connections
+        first = self.state.first_mutation
+        moved = self.state.last_mutation
+        left = sum(self.state.routes_pointing_to(i['peer_eni'], associated_only=self.args.by_interface)
+                   for i in self.topology.interfaces)
+        # Demote again and let the peer take the routes back, as it would when it becomes active, so that
+        # the next iteration starts from a standby member that has seen the peer owning the routes
+        self.cluster.set_local(active=False)
+        self._standby_poll()
+        self.state.reset()
+        # A plan built by the first standby poll has seen the addresses still on this member
+        self.aws_had.invalidate_failover_plan()
+        self._standby_poll()
+        return (done - start) if done else None, (first - start) if first else None, \
+            (moved - start) if moved else None, calls, left
+
+
+def _ms(seconds):
+    return round(seconds * 1000, 1) if seconds is not None else None
+
+
+def run(args):
+    import aws_had
+    aws_had.logger.setLevel(args.log_level)
+    if not args.sync_log:
+        aws_had.start_log_listener()
+    results = []
+    base_dir = tempfile.mkdtemp(prefix='aws_had_bench_')
+    cwd = os.getcwd()
+    try:
+        for size in args.route_tables:
+            topology = fake_aws.Topology(route_tables=size, vpcs=args.vpcs, peer_routes=args.peer_routes,
+                                         other_routes=args.other_routes)
+            work_dir = os.path.join(base_dir, str(size))
+            samples = []
+            first_samples = []
+            moved_samples = []
+            calls = {}
+            failures = 0
+            with Bench(aws_had, topology, args, work_dir) as bench:
+                for _ in range(args.warmup):
+                    bench.failover()
+                for _ in range(args.iterations):
+                    elapsed, first, moved, calls, left = bench.failover()
+                    if elapsed is None or left:
+                        failures += 1
+                        continue
+                    samples.append(elapsed)
+                    if first is not None:
+                        first_samples.append(first)
+                    if moved is not None:
+                        moved_samples.append(moved)
+            results.append({'route_tables': size,
+                            'iterations': args.iterations,
+                            'failures': failures,
+                            'p50_ms': _ms(percentile(samples, 50)),
+                            'p99_ms': _ms(percentile(samples, 99)),
+                            'min_ms': _ms(min(samples) if samples else None),
+                            'max_ms': _ms(max(samples) if samples else None),
+                            'first_p50_ms': _ms(percentile(first_samples, 50)),
+                            'moved_p50_ms': _ms(percentile(moved_samples, 50)),
+                            'moved_p99_ms': _ms(percentile(moved_samples, 99)),
+                            'ec2_calls': calls})
+            os.chdir(cwd)
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(base_dir, ignore_errors=True)
+    return results
+
+
+def report(results, args):
+    if args.json:
+        print(json.dumps({'parallel': args.parallel, 'pool_size': args.pool_size,
+                          'keep_alive_client': not args.aws_py, 'rtt_ms': args.rtt_ms,
+                          'results': results}, indent=4))
+        return
+    print('calls_in_parallel={} parallel_pool_size={} keep_alive_client={} rtt={}ms handshake_rtts={}'.format(
+        args.parallel, args.pool_size, not args.aws_py, args.rtt_ms, args.handshake_rtts))
+    print('DONE = CHANGED datagram -> update_cluster_status_file(DONE), '
+          'first/moved = CHANGED datagram -> first/last mutating EC2 call')
+    line = '{:>12} {:>10} {:>10} {:>10} {:>10} {:>13} {:>13} {:>13} {:>9}  {}'
+    print(line.format('route tables', 'p50 ms', 'p99 ms', 'min ms', 'max ms', 'first p50 ms', 'moved p50 ms',
+                      'moved p99 ms', 'failures', 'EC2 calls / failover'))
+    for r in results:
+        print(line.format(
+            r['route_tables'], *['-' if r[k] is None else r[k] for k in
+                                 ('p50_ms', 'p99_ms', 'min_ms', 'max_ms', 'first_p50_ms', 'moved_p50_ms',
+                                  'moved_p99_ms')],
+            r['failures'],
+            ', '.join('{}={}'.format(k, v) for k, v in sorted(r['ec2_calls'].items()))))
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='aws_had.py end-to-end failover latency benchmark')
+    parser.add_argument('--route-tables', type=int, nargs='+', default=[1, 10, 50, 100, 250, 500],
+                        help='topology sizes (route tables per cluster) to measure')
+    parser.add_argument('--vpcs', type=int, default=1, help='number of VPCs the route tables are spread over')
+    parser.add_argument('--peer-routes', type=int, default=1, help='routes per table pointing at the peer ENI')
+    parser.add_argument('--other-routes', type=int, default=2, help='unrelated routes per table')
+    parser.add_argument('--iterations', type=int, default=20, help='measured failovers per topology')
+    parser.add_argument('--warmup', type=int, default=1, help='unmeasured failovers per topology')
+    parser.add_argument('--parallel', action='store_true', default=False, help='set calls_in_parallel')
+    parser.add_argument('--pool-size', type=int, default=10, help='set parallel_pool_size')
+    parser.add_argument('--aws-py', action='store_true', default=False,
+                        help='clear keep_alive_client (a new connection for every EC2 call)')
+    parser.add_argument('--by-interface', action='store_true', default=False,
+                        help='clear replace_all_route_tables (update_route_table per interface)')
+    parser.add_argument('--no-plan', action='store_true', default=False,
+                        help='fail over without the failover plan and the route index prepared while standby')
+    parser.add_argument('--no-prewarm', action='store_true', default=False,
+                        help='fail over without the connections prepared while standby (ec2_prewarm_interval 0)')
+    parser.add_argument('--prewarm-interval', type=float, default=10, help='set ec2_prewarm_interval')
+    parser.add_argument('--idle-timeout', type=float, default=20,
+                        help='set ec2_idle_timeout, below --settle the standby connections expire before failover')
+    parser.add_argument('--rtt-ms', type=float, default=0.0, help='emulated round trip to the EC2 endpoint')
+    parser.add_argument('--handshake-rtts', type=int, default=2,
+                        help='round trips charged for every new EC2 connection (TCP + TLS)')
+    parser.add_argument('--throttle-rate', type=float, default=0.0,
+                        help='mutating calls per second the fake EC2 accepts before RequestLimitExceeded (0: none)')
+    parser.add_argument('--throttle-burst', type=int, default=20, help='bucket size of --throttle-rate')
+    parser.add_argument('--settle', type=float, default=1.0,
+                        help='seconds the standby member is left alone before every failover')
+    parser.add_argument('--timeout', type=float, default=120.0, help='seconds to wait for DONE')
+    parser.add_argument('--log-level', default='INFO', help='aws_had logger level during the run')
+    parser.add_argument('--sync-log', action='store_true', default=False,
+                        help='write the log from the caller threads, as before the log listener')
+    parser.add_argument('--json', action='store_true', default=False, help='print results as JSON')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    report(run(args), args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+
+#   Copyright 2018 Check Point Software Technologies LTD
+
+"""
+Cross AZ Cluster secondary IP pairing micro-benchmark for aws_had.py.
+
+Times the pairing part of update_cross_az_cluster_map() (drop the invalid pairs, find the unpaired secondary IPs of
+both members and pair them) with the CrossAZPairs index, against the list based implementation it replaced, and
+checks that both produce the same map. Scenarios, for N secondary IPs per member:
+    rebuild - empty map, every secondary IP is paired
+    update  - full map, 10% of the remote secondary IPs were replaced by new ones
+
+For example (49 secondary IPs is the per-ENI limit of the largest instance types):
+    python3 benchmarks/bench_pairing.py --sizes 1 10 29 49 1000
+"""
+
+import argparse
+import copy
+import json
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+LOCAL_MEM_PRIVATE_IP = 'local_mem_private_ip'
+REMOTE_MEM_PRIVATE_IP = 'remote_mem_private_ip'
+EIP = 'EIP'
+DYNAMIC_OBJECT_NAME = 'dynamic_object_name'
+
+
+class Legacy(object):
+    """The pairing of aws_had.py before the CrossAZPairs index, kept to compare the maps and the timings"""
+
+    def __init__(self, ip_map, get_remains):
+        self.map = ip_map
+        self.get_remains = get_remains
+
+    def remove_invalid_pairs(self, local_secondary_ips, remote_secondary_ips):
+        if not self.map:
+            return
+        invalid_pairs = []
+        for key, value in self.map.items():
+            if value[LOCAL_MEM_PRIVATE_IP] not in local_secondary_ips or \
+                    value[REMOTE_MEM_PRIVATE_IP] not in remote_secondary_ips:
+                invalid_pairs.append(key)
+        for invalid_pair in invalid_pairs:
+            del self.map[invalid_pair]
+
+    def remain_secondary_ips(self, secondary_ips, is_local):
+        if not self.map:
+            return secondary_ips
+        remain_ips = secondary_ips
+        for key, value in self.map.items():
+            if is_local and value[LOCAL_MEM_PRIVATE_IP] in secondary_ips:
+                remain_ips.remove(value[LOCAL_MEM_PRIVATE_IP])
+            else:
+                if value[REMOTE_MEM_PRIVATE_IP] in secondary_ips:
+                    remain_ips.remove(value[REMOTE_MEM_PRIVATE_IP])
+        return remain_ips
+
+    def insert(self, local_ip, remote_ip, eip):
+        self.map[remote_ip] = {LOCAL_MEM_PRIVATE_IP: local_ip, REMOTE_MEM_PRIVATE_IP: remote_ip, EIP: eip,
+                               DYNAMIC_OBJECT_NAME: 'LocalGatewayExternal-' + eip}
+
+    def create_ip_pairs(self, ips_without_eip, ips_with_eip, local_have_eip):
+        if len(ips_without_eip) != len(ips_with_eip):
+            return 1
+        for ip_without_eip, ip_with_eip in zip(ips_without_eip, ips_with_eip.keys()):
+            if local_have_eip:
+                self.insert(ip_with_eip, ip_without_eip, ips_with_eip[ip_with_eip])
+            else:
+                self.insert(ip_without_eip, ip_with_eip, ips_with_eip[ip_with_eip])
+        return 0
+
+    def pair(self, scenario):
+        local_ips, remote_ips = list(scenario['local_ips']), list(scenario['remote_ips'])
+        self.remove_invalid_pairs(local_ips, remote_ips)
+        remain_locals = self.remain_secondary_ips(local_ips, 1)
+        remain_remotes = self.remain_secondary_ips(remote_ips, 0)
+        locals_without_eip, locals_with_eip = self.get_remains(remain_locals, scenario['local_eips'])
+        remotes_without_eip, remotes_with_eip = self.get_remains(remain_remotes, scenario['remote_eips'])
+        remote_vip, local_vip = scenario['remote_vip'], scenario['local_vip']
+        result = 0
+        if remote_vip in remain_remotes and local_vip in locals_with_eip:
+            self.insert(local_vip, remote_vip, locals_with_eip[local_vip])
+            remotes_without_eip.remove(remote_vip)
+            del locals_with_eip[local_vip]
+        result += self.create_ip_pairs(locals_without_eip, remotes_with_eip, 0)
+        result += self.create_ip_pairs(remotes_without_eip, locals_with_eip, 1)
+        return result
+
+
+class NullBatch(object):
+    """Stands for DynamicObjectBatch, dynamic objects are not created by the benchmark"""
+
+    def create(self, local_ip, dynamic_object_name):
+        pass
+
+    def delete(self, dynamic_object_name, check=True):
+        pass
+
+
+def make_scenario(name, size):
+    """Secondary IPs of both members, the local ones carry the EIPs"""
+    local_ips = ['10.1.{}.{}'.format(i // 250, i % 250 + 4) for i in range(size)]
+    remote_ips = ['10.2.{}.{}'.format(i // 250, i % 250 + 4) for i in range(size)]
+    local_eips = {ip: '52.0.{}.{}'.format(i // 250, i % 250 + 1) for i, ip in enumerate(local_ips)}
+    ip_map = {}
+    if name == 'update':
+        for local_ip, remote_ip in zip(local_ips, remote_ips):
+            ip_map[remote_ip] = {LOCAL_MEM_PRIVATE_IP: local_ip, REMOTE_MEM_PRIVATE_IP: remote_ip,
+                                 EIP: local_eips[local_ip], DYNAMIC_OBJECT_NAME: 'LocalGatewayExternal-' +
+                                 local_eips[local_ip]}
+        for i in range(0, size, 10):
+            remote_ips[i] = '10.3.{}.{}'.format(i // 250, i % 250 + 4)
+    return {'name': name, 'size': size, 'map': ip_map, 'local_ips': local_ips, 'remote_ips': remote_ips,
+            'local_eips': local_eips, 'remote_eips': {}, 'local_vip': local_ips[0], 'remote_vip': remote_ips[0]}
+
+
+def pair_indexed(aws_had, scenario):
+    aws_had._cross_az_cluster_ip_map = copy.deepcopy(scenario['map'])
+    aws_had._cross_az_pairs = aws_had.CrossAZPairs(aws_had._cross_az_cluster_ip_map)
+    batch = NullBatch()
+    local_ips, remote_ips = list(scenario['local_ips']), list(scenario['remote_ips'])
+    aws_had.remove_invalid_pair_from_exist_cross_az_cluster_ip_map(local_ips, remote_ips, batch)
+    remain_locals = aws_had.remain_secondary_ips(local_ips, 1)
+    remain_remotes = aws_had.remain_secondary_ips(remote_ips, 0)
+    result = aws_had.create_updated_cross_az_cluster_ip_map(remain_locals, remain_remotes, scenario['local_eips'],
+                                                           scenario['remote_eips'], scenario['remote_vip'], batch)
+    return result, aws_had._cross_az_cluster_ip_map
+
+
+def pair_legacy(aws_had, scenario):
+    legacy = Legacy(copy.deepcopy(scenario['map']), aws_had._get_remains_ips_with_and_without_eips)
+    return legacy.pair(scenario), legacy.map
+
+
+def best_of(func, repeat):
+    timer = timeit.Timer(func)
+    number, _ = timer.autorange()
+    return min(timer.repeat(repeat=repeat, number=number)) / number
+
+
+def run(args):
+    import aws_had
+    aws_had.logger.setLevel(args.log_level)
+    results = []
+    for size in args.sizes:
+        for name in ('rebuild', 'update'):
+            scenario = make_scenario(name, size)
+            aws_had.get_private_local_ip = lambda interface, interface_pos: scenario['local_vip']
+            indexed_result, indexed_map = pair_indexed(aws_had, scenario)
+            legacy_result, legacy_map = pair_legacy(aws_had, scenario)
+            if indexed_map != legacy_map or list(indexed_map) != list(legacy_map) or indexed_result != legacy_result:
+                raise SystemExit('{} of {} secondary IPs: the maps differ'.format(name, size))
+            indexed = best_of(lambda: pair_indexed(aws_had, scenario), args.repeat)
+            legacy = best_of(lambda: pair_legacy(aws_had, scenario), args.repeat)
+            results.append({'scenario': name, 'secondary_ips': size, 'pairs': len(indexed_map),
+                            'indexed_us': round(indexed * 1e6, 1), 'legacy_us': round(legacy * 1e6, 1),
+                            'speedup': round(legacy / indexed, 1)})
+    return results
+
+
+def report(results, args):
+    if args.json:
+        print(json.dumps(results, indent=4))
+        return
+    line = '{:>10} {:>14} {:>8} {:>12} {:>12} {:>8}'
+    print(line.format('scenario', 'secondary IPs', 'pairs', 'indexed us', 'legacy us', 'speedup'))
+    for r in results:
+        print(line.format(r['scenario'], r['secondary_ips'], r['pairs'], r['indexed_us'], r['legacy_us'],
+                          r['speedup']))
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='aws_had.py Cross AZ Cluster secondary IP pairing micro-benchmark')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1, 10, 29, 49],
+                        help='secondary IPs per member to measure')
+    parser.add_argument('--repeat', type=int, default=5, help='timeit repeats, the best one is reported')
+    parser.add_argument('--log-level', default='WARNING', help='aws_had logger level during the run')
+    parser.add_argument('--json', action='store_true', default=False, help='print results as JSON')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    report(run(args), args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,234 @@
+#!/usr/bin/env python3
+
+#   Copyright 2018 Check Point Software Technologies LTD
+
+"""
+Scaling micro-benchmark of the pure Python parts of aws_had.py.
+
+Builds synthetic topologies (fake_aws.Topology: VPCs, route tables, routes, ENIs and secondary IPs) of a growing size
+and records the best time (timeit style, over --repeat runs) and the tracemalloc peak of:
+    set_all_route_tables     - route index refresh and route matching of a fail over without a fresh index
+    update_route_table       - route matching of every internal interface (replace_all_route_tables off), with
+                               the VPC route tables of a Cross AZ Cluster
+    cross_az_pairing         - Cross AZ Cluster secondary IP pairing from an empty map
+    translate_route_tables   - the aws_rtb.json translation of reconf()
+
+EC2 is not called: aws_had.request answers from a fake EC2 state with bodies parsed (as aws.py does) ahead of the
+timed runs, and replace_route does nothing. Size is the number of route tables, or of secondary IPs per
+member for cross_az_pairing.
+
+For example:
+    python3 benchmarks/bench_scaling.py --sizes 10 100 1000 5000 --vpcs 4 --routes 20
+"""
+
+import argparse
+import copy
+import json
+import os
+import sys
+import time
+import tracemalloc
+from urllib.parse import parse_qsl
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import fake_aws  # noqa: E402
+import bench_pairing  # noqa: E402
+
+
+class EC2Replay(object):
+    """Stands for aws_had.request, answering from a fake EC2 state with bodies parsed before prepare() returns"""
+
+    def __init__(self, state):
+        self.state = state
+        self.urls = []
+        self.ready = {}
+
+    def __call__(self, url):
+        ready = self.ready.get(url)
+        if ready:
+            return ready.pop()
+        self.urls.append(url)
+        return fake_aws.ec2_payload(self.state, dict(parse_qsl(url)))
+
+    def prepare(self):
+        """Parse the bodies of the requests of the last run for the next one (aws.listify changes them in place)"""
+        urls = self.urls
+        self.urls = []
+        self.ready = {}
+        for url in urls:
+            self.ready.setdefault(url, []).append(fake_aws.ec2_payload(self.state, dict(parse_qsl(url))))
+        self.urls = urls
+
+
+class Case(object):
+    """One function of aws_had on one topology: run() is timed, prepare() is called before every run"""
+
+    def __init__(self, name, size, run, prepare=None, items=None):
+        self.name = name
+        self.size = size
+        self.run = run
+        self.prepare = prepare or (lambda: None)
+        self.items = items
+
+
+def cluster_interfaces(aws_had, topology):
+    from aws_ha_globals import NAME
+    return [{NAME: i['name'], 'vpc-id': i['vpc'], 'subnet-id': i['subnet'], 'interface-id': i['local_eni'],
+             'peer-interface': {'networkInterfaceId': i['peer_eni']}} for i in topology.interfaces]
+
+
+def make_topology(args, size):
+    return fake_aws.Topology(route_tables=size, vpcs=args.vpcs, peer_routes=args.peer_routes,
+                             other_routes=args.routes, enis_per_vpc=args.enis_per_vpc,
+                             secondary_ips=args.secondary_ips)
+
+
+def case_set_all_route_tables(aws_had, args, size):
+    from aws_ha_globals import IFS
+    topology = make_topology(args, size)
+    replay = EC2Replay(fake_aws.FakeEC2State(topology))
+    interfaces = cluster_interfaces(aws_had, topology)
+
+    def run():
+        aws_had.request = replay
+        aws_had.cphaconf = {IFS: interfaces}
+        aws_had._route_index.invalidate()
+        aws_had.set_all_route_tables(None)
+
+    return Case('set_all_route_tables', size, run, replay.prepare, items=size)
+
+
+def case_update_route_table(aws_had, args, size):
+    from aws_ha_globals import IFS
+    import aws_ha_mode as mode
+    topology = make_topology(args, size)
+    replay = EC2Replay(fake_aws.FakeEC2State(topology))
+    interfaces = [i for i in cluster_interfaces(aws_had, topology) if i['vpc-id'] and i['name'] != 'eth0']
+
+    def run():
+        aws_had.request = replay
+        aws_had.cphaconf = {IFS: interfaces}
+        # Single AZ High Availability describes the route table of the interface subnet only
+        aws_had.conf['deploy_mode'] = mode.DEPLOY_MODE_CROSS_AZ
+        for interface in interfaces:
+            aws_had.update_route_table(interface)
+
+    return Case('update_route_table', size, run, replay.prepare, items=size)
+
+
+def case_cross_az_pairing(aws_had, args, size):
+    scenario = bench_pairing.make_scenario('rebuild', size)
+
+    def run():
+        aws_had.get_private_local_ip = lambda interface, interface_pos: scenario['local_vip']
+        bench_pairing.pair_indexed(aws_had, scenario)
+
+    return Case('cross_az_pairing', size, run, items=size)
+
+
+def case_translate_route_tables(aws_had, args, size):
+    from aws_ha_globals import IFS
+    topology = make_topology(args, size)
+    interfaces = cluster_interfaces(aws_had, topology)
+    rtbs = topology.aws_rtb()
+    state = {}
+
+    def prepare():
+        # translate_route_tables replaces the targets in place
+        state['rtbs'] = copy.deepcopy(rtbs)
+
+    def run():
+        aws_had.cphaconf = {IFS: interfaces}
+        aws_had.translate_route_tables(state['rtbs'])
+
+    return Case('translate_route_tables', size, run, prepare, items=size)
+
+
+CASES = {'set_all_route_tables': case_set_all_route_tables,
+         'update_route_table': case_update_route_table,
+         'cross_az_pairing': case_cross_az_pairing,
+         'translate_route_tables': case_translate_route_tables}
+
+
+def measure(case, repeat):
+    """return: best seconds of repeat runs and the tracemalloc peak bytes of one run"""
+    case.prepare()
+    case.run()
+    best = None
+    for _ in range(repeat):
+        case.prepare()
+        start = time.perf_counter()
+        case.run()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    case.prepare()
+    tracemalloc.start()
+    try:
+        case.run()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return best, peak
+
+
+def run(args):
+    import aws_had
+    aws_had.logger.setLevel(args.log_level)
+    saved = {name: getattr(aws_had, name) for name in ('request', 'replace_route', 'get_private_local_ip',
+                                                       'cphaconf')}
+    saved_conf = dict(aws_had.conf)
+    aws_had.replace_route = lambda *route: None
+    results = []
+    try:
+        for name in args.cases:
+            for size in args.sizes:
+                case = CASES[name](aws_had, args, size)
+                seconds, peak = measure(case, args.repeat)
+                results.append({'case': name, 'size': size, 'ms': round(seconds * 1000, 3),
+                                'us_per_item': round(seconds * 1e6 / max(1, case.items), 2),
+                                'peak_kb': round(peak / 1024.0, 1)})
+    finally:
+        for name, value in saved.items():
+            setattr(aws_had, name, value)
+        aws_had.conf.update(saved_conf)
+    return results
+
+
+def report(results, args):
+    if args.json:
+        print(json.dumps({'vpcs': args.vpcs, 'routes': args.routes, 'peer_routes': args.peer_routes,
+                          'enis_per_vpc': args.enis_per_vpc, 'results': results}, indent=4))
+        return
+    print('{} VPCs, {} ENIs per VPC, {} peer and {} other routes per route table'.format(
+        args.vpcs, args.enis_per_vpc, args.peer_routes, args.routes))
+    line = '{:>24} {:>8} {:>12} {:>12} {:>12}'
+    print(line.format('case', 'size', 'ms', 'us / item', 'peak KB'))
+    for r in results:
+        print(line.format(r['case'], r['size'], r['ms'], r['us_per_item'], r['peak_kb']))
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='aws_had.py scaling micro-benchmark')
+    parser.add_argument('--cases', nargs='+', choices=sorted(CASES), default=list(CASES), help='functions to measure')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10, 100, 1000],
+                        help='route tables (secondary IPs per member for cross_az_pairing) to measure')
+    parser.add_argument('--vpcs', type=int, default=1, help='number of VPCs the route tables are spread over')
+    parser.add_argument('--enis-per-vpc', type=int, default=1, help='internal interfaces per VPC')
+    parser.add_argument('--peer-routes', type=int, default=1, help='routes per table pointing at the peer ENI')
+    parser.add_argument('--routes', type=int, default=20, help='unrelated routes per table')
+    parser.add_argument('--secondary-ips', type=int, default=1, help='secondary IPs of the external interface')
+    parser.add_argument('--repeat', type=int, default=5, help='timed runs, the best one is reported')
+    parser.add_argument('--log-level', default='WARNING', help='aws_had logger level during the run')
+    parser.add_argument('--json', action='store_true', default=False, help='print results as JSON')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    report(run(args), args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,590 @@
+#!/usr/bin/env python3
+
+#   Copyright 2018 Check Point Software Technologies LTD
+
+"""
+Local stand-ins for the services aws_had.py talks to during a failover:
+an EC2 Query API endpoint, an IMDSv2 endpoint and a scripted "cphaprob stat".
+They are only meant for benchmarking aws_had.py off the production path.
+"""
+
+import itertools
+import json
+import os
+import stat
+import threading
+import time
+import uuid
+import xml.etree.ElementTree as ET
+
+import http.client as http_client
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from socketserver import ThreadingMixIn
+from urllib.parse import urlparse, parse_qsl
+
+EC2_NS = 'http://ec2.amazonaws.com/doc/2016-11-15/'
+LOCAL_INSTANCE_ID = 'i-0000000000000aaaa'
+PEER_INSTANCE_ID = 'i-0000000000000bbbb'
+IAM_ROLE = 'bench-cluster-role'
+# Tag of the route tables that point to the cluster members
+CLUSTER_TAG = ('x-chkp-cluster', 'bench')
+
+
+class Topology(object):
+    """Synthetic cluster topology: two members, their ENIs and the VPC route tables.
+    other_tables: route tables of the same VPCs that have no route to the cluster members (other appliances)
+    enis_per_vpc: internal interfaces of every VPC, the route tables of the VPC point to them in turn
+    secondary_ips: secondary IPs (VIPs) of the external interface, at most 150
+    """
+
+    def __init__(self, route_tables=1, vpcs=1, peer_routes=1, other_routes=2, other_tables=0, enis_per_vpc=1,
+                 secondary_ips=1):
+        self.vpcs = ['vpc-{:08x}'.format(v + 1) for v in range(vpcs)]
+        self.interfaces = []
+        # eth0 is the external interface (VPC #1) carrying the cluster VIP,
+        # every VPC gets internal interfaces behind which the route tables point.
+        self._add_interface('eth0', 'external', 0, 1, secondary_ips)
+        internals = []
+        for v in range(vpcs):
+            internals.append([])
+            for _ in range(enis_per_vpc):
+                internals[v].append(self._add_interface('eth{}'.format(len(self.interfaces)), 'internal', v, 2))
+        self.route_tables = []
+        for t in range(route_tables):
+            v = t % vpcs
+            internal = internals[v][t // vpcs % enis_per_vpc]
+            routes = [{'destinationCidrBlock': '10.{}.0.0/16'.format(v + 1), 'gatewayId': 'local'},
+                      {'destinationCidrBlock': '0.0.0.0/0', 'networkInterfaceId': internal['peer_eni']}]
+            for r in range(peer_routes - 1):
+                routes.append({'destinationCidrBlock': '172.{}.{}.0/24'.format(16 + r % 16, t % 256),
+                               'networkInterfaceId': internal['peer_eni']})
+            for r in range(other_routes):
+                routes.append({'destinationCidrBlock': '192.168.{}.{}/32'.format(r % 256, t % 256),
+                               'gatewayId': 'igw-{:08x}'.format(v + 1)})
+            self.route_tables.append({'routeTableId': 'rtb-{:08x}'.format(t + 1),
+                                      'vpcId': self.vpcs[v],
+                                      'main': t < vpcs,
+                                      'subnets': [internal['subnet']] if t < vpcs else [],
+                                      'routes': routes,
+                                      'tags': dict([CLUSTER_TAG])})
+        for t in range(other_tables):
+            v = t % vpcs
+            routes = [{'destinationCidrBlock': '10.{}.0.0/16'.format(v + 1), 'gatewayId': 'local'},
+                      {'destinationCidrBlock': '0.0.0.0/0', 'networkInterfaceId': 'eni-{:08x}f'.format(t)}]
+            for r in range(other_routes):
+                routes.append({'destinationCidrBlock': '192.168.{}.{}/32'.format(r % 256, t % 256),
+                               'gatewayId': 'igw-{:08x}'.format(v + 1)})
+            self.route_tables.append({'routeTableId': 'rtb-{:08x}'.format(route_tables + t + 1),
+                                      'vpcId': self.vpcs[v], 'main': False, 'subnets': [], 'routes': routes,
+                                      'tags': {}})
+
+    def _add_interface(self, name, if_type, vpc_index, subnet_index, secondary_ips=0):
+        index = len(self.interfaces)
+        net = '10.{}.{}'.format(vpc_index + 1, subnet_index + 10 * index)
+        interface = {
+            'name': name,
+            'type': if_type,
+            'vpc': self.vpcs[vpc_index],
+            'subnet': 'subnet-{:08x}'.format(index + 1),
+            'mac': '0e:00:00:00:00:{:02x}'.format(index),
+            'local_eni': 'eni-{:08x}a'.format(index),
+            'peer_eni': 'eni-{:08x}b'.format(index),
+            'local_ip': net + '.10',
+            'peer_ip': net + '.20',
+            'vips': ['{}.{}'.format(net, 100 + i) for i in range(min(secondary_ips, 150))],
+        }
+        self.interfaces.append(interface)
+        return interface
+
+    def cphaconf(self, ifs_key, name_key, type_key, ipaddr_key, other_ip_key):
+        """Return the "cphaconf aws_mode" document for the local member"""
+        return {ifs_key: [{name_key: i['name'], type_key: i['type'], ipaddr_key: i['local_ip'],
+                           other_ip_key: i['peer_ip'], 'mac-addr': i['mac']} for i in self.interfaces]}
+
+    def aws_rtb(self):
+        """Return the $FWDIR/conf/aws_rtb.json document: the peer routes of every route table, by interface name"""
+        names = {i['peer_eni']: i['name'] for i in self.interfaces}
+        return {rtb['routeTableId']: [{'destination': r['destinationCidrBlock'],
+                                       'target': names[r['networkInterfaceId']]}
+                                      for r in rtb['routes'] if r.get('networkInterfaceId') in names]
+                for rtb in self.route_tables}
+
+
+class FakeEC2State(object):
+    """Mutable EC2 state shared by the fake endpoint handler threads"""
+
+    def __init__(self, topology):
+        self.topology = topology
+        self.lock = threading.Lock()
+        self.calls = {}
+        self.last_mutation = None
+        self.reset()
+
+    def reset(self):
+        """Point every route and VIP back at the peer member (the member that is active before failover)"""
+        with self.lock:
+            self.route_tables = json.loads(json.dumps(self.topology.route_tables))
+            self.secondary_ips = {}
+            for i in self.topology.interfaces:
+                self.secondary_ips[i['local_eni']] = []
+                self.secondary_ips[i['peer_eni']] = list(i['vips'])
+        self.clear_calls()
+
+    def clear_calls(self):
+        with self.lock:
+            self.calls = {}
+            self.first_mutation = None
+            self.last_mutation = None
+
+    def count(self, action):
+        with self.lock:
+            self.calls[action] = self.calls.get(action, 0) + 1
+
+    def routes_pointing_to(self, eni, associated_only=False):
+        """return: number of routes targeting eni, optionally only in main or subnet associated route tables"""
+        with self.lock:
+            return sum(1 for rtb in self.route_tables for r in rtb['routes']
+                       if r.get('networkInterfaceId') == eni and (rtb['main'] or rtb['subnets'] or not associated_only))
+
+
+def _filters(params):
+    """Collect EC2 Filter.N.Name / Filter.N.Value[.M] query parameters as {name: [values]}"""
+    names = {}
+    values = {}
+    for k, v in params.items():
+        parts = k.split('.')
+        if parts[0] != 'Filter' or len(parts) < 3:
+            continue
+        if parts[2] == 'Name':
+            names[parts[1]] = v
+        elif parts[2] == 'Value':
+            values.setdefault(parts[1], []).append(v)
+    return {names[n]: values.get(n, []) for n in names}
+
+
+def _indexed(params, prefix):
+    """Collect Prefix.N style query parameters as a list"""
+    return [v for k, v in sorted(params.items()) if k == prefix or k.startswith(prefix + '.')]
+
+
+def _to_xml(parent, obj):
+    if isinstance(obj, dict):
+        for k, v in obj.items():
+            _to_xml(ET.SubElement(parent, k), v)
+    elif isinstance(obj, list):
+        for v in obj:
+            _to_xml(ET.SubElement(parent, 'item'), v)
+    elif obj is not None:
+        parent.text = str(obj)
+
+
+def render(action, body):
+    root = ET.Element(action + 'Response', xmlns=EC2_NS)
+    _to_xml(root, dict(itertools.chain([('requestId', str(uuid.uuid4()))], body.items())))
+    return ET.tostring(root)
+
+
+def render_error(code, message):
+    root = ET.Element('Response')
+    _to_xml(root, {'Errors': {'Error': {'Code': code, 'Message': message}}, 'RequestID': str(uuid.uuid4())})
+    return ET.tostring(root)
+
+
+class FakeEC2(object):
+    """Minimal EC2 Query API: DescribeRouteTables, ReplaceRoute, CreateRoute, DescribeNetworkInterfaces,
+    AssignPrivateIpAddresses and AssociateAddress.
+
+    mutation_rate/mutation_burst: token bucket of the mutating calls, calls above it fail with
+    RequestLimitExceeded like EC2 API throttling does (0 disables it).
+    """
+
+    def __init__(self, state, mutation_rate=0.0, mutation_burst=0):
+        self.state = state
+        self.mutation_rate = mutation_rate
+        self.mutation_burst = mutation_burst
+        self._tokens = float(mutation_burst)
+        self._stamp = time.monotonic()
+
+    def _throttled(self):
+        if not self.mutation_rate:
+            return False
+        now = time.monotonic()
+        self._tokens = min(self.mutation_burst, self._tokens + (now - self._stamp) * self.mutation_rate)
+        self._stamp = now
+        if self._tokens < 1:
+            return True
+        self._tokens -= 1
+        return False
+
+    def handle(self, params):
+        action = params.get('Action')
+        self.state.count(action)
+        handler = getattr(self, 'do_' + (action or ''), None)
+        if not handler:
+            return 400, render_error('InvalidAction', 'The action {} is not valid'.format(action))
+        if not action.startswith('Describe'):
+            with self.state.lock:
+                throttled = self._throttled()
+            if throttled:
+                self.state.count('RequestLimitExceeded')
+                return 503, render_error('RequestLimitExceeded', 'Request limit exceeded.')
+        with self.state.lock:
+            code, payload = handler(params)
+            if code == 200 and not action.startswith('Describe'):
+                self.state.last_mutation = time.perf_counter()
+                if self.state.first_mutation is None:
+                    self.state.first_mutation = self.state.last_mutation
+            return code, payload
+
+    def _route_table(self, rtb):
+        associations = [{'routeTableAssociationId': 'rtbassoc-' + rtb['routeTableId'][4:], 'main': 'true'}] \
+            if rtb['main'] else []
+        associations += [{'routeTableAssociationId': 'rtbassoc-' + s[7:], 'subnetId': s, 'main': 'false'}
+                         for s in rtb['subnets']]
+        return {'routeTableId': rtb['routeTableId'], 'vpcId': rtb['vpcId'],
+                'routeSet': [dict(r, state='active') for r in rtb['routes']],
+                'associationSet': associations,
+                'tagSet': [{'key': k, 'value': v} for k, v in sorted(rtb.get('tags', {}).items())]}
+
+    def do_DescribeRouteTables(self, params):
+        filters = _filters(params)
+        ids = _indexed(params, 'RouteTableId')
+        tables = []
+        for rtb in self.state.route_tables:
+            if ids and rtb['routeTableId'] not in ids:
+                continue
+            if 'vpc-id' in filters and rtb['vpcId'] not in filters['vpc-id']:
+                continue
+            if 'association.subnet-id' in filters and \
+                    not set(rtb['subnets']) & set(filters['association.subnet-id']):
+                continue
+            if 'association.main' in filters and str(rtb['main']).lower() not in filters['association.main']:
+                continue
+            if 'route.network-interface-id' in filters and \
+                    not {r.get('networkInterfaceId') for r in rtb['routes']} & set(filters['route.network-interface-id']):
+                continue
+            tags = rtb.get('tags', {})
+            if 'tag-key' in filters and not set(tags) & set(filters['tag-key']):
+                continue
+            if any(name.startswith('tag:') and tags.get(name[4:]) not in values for name, values in filters.items()):
+                continue
+            tables.append(rtb)
+        body = {}
+        max_results = params.get('MaxResults')
+        if max_results:
+            start = int(params.get('NextToken') or 0)
+            end = start + int(max_results)
+            if end < len(tables):
+                body['nextToken'] = str(end)
+            tables = tables[start:end]
+        body['routeTableSet'] = [self._route_table(rtb) for rtb in tables]
+        return 200, render('DescribeRouteTables', body)
+
+    def _find_route(self, params):
+        for rtb in self.state.route_tables:
+            if rtb['routeTableId'] != params.get('RouteTableId'):
+                continue
+            for route in rtb['routes']:
+                if params.get('DestinationPrefixListId') and \
+                        route.get('destinationPrefixListId') == params['DestinationPrefixListId']:
+                    return rtb, route
+                if params.get('DestinationCidrBlock') and \
+                        route.get('destinationCidrBlock') == params['DestinationCidrBlock']:
+                    return rtb, route
+            return rtb, None
+        return None, None
+
+    def do_ReplaceRoute(self, params):
+        rtb, route = self._find_route(params)
+        if not route:
+            return 400, render_error('InvalidRoute.NotFound', 'no route matching {}'.format(params))
+        route.pop('gatewayId', None)
+        route['networkInterfaceId'] = params['NetworkInterfaceId']
+        return 200, render('ReplaceRoute', {'return': 'true'})
+
+    def do_CreateRoute(self, params):
+        rtb, route = self._find_route(params)
+        if not rtb:
+            return 400, render_error('InvalidRouteTableID.NotFound', params.get('RouteTableId'))
+        if route:
+            return 400, render_error('RouteAlreadyExists', 'route already exists')
+        new_route = {'networkInterfaceId': params['NetworkInterfaceId']}
+        if params.get('DestinationPrefixListId'):
+            new_route['destinationPrefixListId'] = params['DestinationPrefixListId']
+        else:
+            new_route['destinationCidrBlock'] = params['DestinationCidrBlock']
+        rtb['routes'].append(new_route)
+        return 200, render('CreateRoute', {'return': 'true'})
+
+    def _interfaces(self):
+        for i in self.state.topology.interfaces:
+            for member in ('local', 'peer'):
+                yield i, member, i[member + '_eni'], i[member + '_ip']
+
+    def _network_interface(self, i, member, eni, ip):
+        addresses = [{'privateIpAddress': ip, 'primary': 'true'}]
+        addresses += [{'privateIpAddress': vip, 'primary': 'false'} for vip in self.state.secondary_ips[eni]]
+        return {'networkInterfaceId': eni, 'subnetId': i['subnet'], 'vpcId': i['vpc'],
+                'privateIpAddress': ip, 'sourceDestCheck': 'false', 'status': 'in-use',
+                'attachment': {'instanceId': LOCAL_INSTANCE_ID if member == 'local' else PEER_INSTANCE_ID},
+                'privateIpAddressesSet': addresses,
+                'tagSet': [{'key': 'x-chkp-interface-type', 'value': i['type']}]}
+
+    def do_DescribeNetworkInterfaces(self, params):
+        filters = _filters(params)
+        ids = _indexed(params, 'NetworkInterfaceId')
+        result = []
+        for i, member, eni, ip in self._interfaces():
+            instance = LOCAL_INSTANCE_ID if member == 'local' else PEER_INSTANCE_ID
+            if ids and eni not in ids:
+                continue
+            if 'vpc-id' in filters and i['vpc'] not in filters['vpc-id']:
+                continue
+            if 'attachment.instance-id' in filters and instance not in filters['attachment.instance-id']:
+                continue
+            if 'private-ip-address' in filters and \
+                    not set([ip] + self.state.secondary_ips[eni]) & set(filters['private-ip-address']):
+                continue
+            result.append(self._network_interface(i, member, eni, ip))
+        return 200, render('DescribeNetworkInterfaces', {'networkInterfaceSet': result})
+
+    def do_AssignPrivateIpAddresses(self, params):
+        eni = params.get('NetworkInterfaceId')
+        if eni not in self.state.secondary_ips:
+            return 400, render_error('InvalidNetworkInterfaceID.NotFound', eni)
+        for ip in _indexed(params, 'PrivateIpAddress'):
+            for owner in self.state.secondary_ips.values():
+                if ip in owner:
+                    owner.remove(ip)
+            self.state.secondary_ips[eni].append(ip)
+        return 200, render('AssignPrivateIpAddresses', {'return': 'true'})
+
+    def do_AssociateAddress(self, params):
+        if params.get('NetworkInterfaceId') not in self.state.secondary_ips:
+            return 400, render_error('InvalidNetworkInterfaceID.NotFound', params.get('NetworkInterfaceId'))
+        return 200, render('AssociateAddress', {'return': 'true', 'associationId': 'eipassoc-' + uuid.uuid4().hex[:8]})
+
+
+class FakeIMDS(object):
+    """IMDSv2 stand-in serving the metadata paths aws_had.py reads"""
+
+    def __init__(self, topology, region='us-east-1'):
+        self.topology = topology
+        self.region = region
+        self.token = uuid.uuid4().hex
+        self.calls = 0
+
+    def handle(self, method, path, headers):
+        self.calls += 1
+        if method == 'PUT' and path == '/latest/api/token':
+            return 200, self.token.encode('utf-8')
+        if headers.get('X-aws-ec2-metadata-token') != self.token:
+            return 401, b''
+        values = {'/latest/meta-data/instance-id': LOCAL_INSTANCE_ID,
+                  '/latest/meta-data/placement/availability-zone': self.region + 'a',
+                  '/latest/meta-data/services/domain': 'amazonaws.com',
+                  '/latest/meta-data/iam/security-credentials/': IAM_ROLE,
+                  '/latest/meta-data/iam/security-credentials/' + IAM_ROLE: json.dumps({
+                      'Code': 'Success', 'AccessKeyId': 'ASIABENCHMARK', 'SecretAccessKey': 'bench',
+                      'Token': 'bench-token',
+                      'Expiration': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(time.time() + 6 * 3600))}),
+                  '/latest/meta-data/network/interfaces/macs/': '\n'.join(
+                      i['mac'] + '/' for i in self.topology.interfaces)}
+        for i in self.topology.interfaces:
+            prefix = '/latest/meta-data/network/interfaces/macs/{}/'.format(i['mac'])
+            values[prefix + 'vpc-id'] = i['vpc']
+            values[prefix + 'subnet-id'] = i['subnet']
+            values[prefix + 'interface-id'] = i['local_eni']
+        value = values.get(path)
+        if value is None:
+            return 404, b''
+        return 200, value.encode('utf-8')
+
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+    request_queue_size = 128
+
+
+class FakeServer(object):
+    """Runs a fake service on 127.0.0.1 in a background thread.
+
+    rtt: seconds added to every request, handshake_rtts: extra round trips charged once per new
+    connection to model a TCP+TLS handshake towards a remote (for example parent-region) endpoint.
+    """
+
+    def __init__(self, service, rtt=0.0, handshake_rtts=0):
+        self.service = service
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            disable_nagle_algorithm = True
+
+            def setup(self):
+                BaseHTTPRequestHandler.setup(self)
+                server.connections += 1
+                if rtt and handshake_rtts:
+                    time.sleep(rtt * handshake_rtts)
+
+            def log_message(self, *args):
+                pass
+
+            def _reply(self, code, payload, content_type):
+                if rtt:
+                    time.sleep(rtt)
+                with server.lock:
+                    server.bytes_sent += len(payload)
+                self.send_response(code)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def _dispatch(self, method):
+                url = urlparse(self.path)
+                length = int(self.headers.get('Content-Length') or 0)
+                data = self.rfile.read(length).decode('utf-8') if length else ''
+                if isinstance(server.service, FakeIMDS):
+                    code, payload = server.service.handle(method, url.path, self.headers)
+                    self._reply(code, payload, 'text/plain')
+                    return
+                params = dict(parse_qsl(url.query or data, keep_blank_values=True))
+                code, payload = server.service.handle(params)
+                self._reply(code, payload, 'text/xml;charset=UTF-8')
+
+            def do_GET(self):
+                self._dispatch('GET')
+
+            def do_POST(self):
+                self._dispatch('POST')
+
+            def do_PUT(self):
+                self._dispatch('PUT')
+
+        self.connections = 0
+        self.bytes_sent = 0
+        self.lock = threading.Lock()
+        self.httpd = _ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.thread = threading.Thread(target=self.httpd.serve_forever, name=type(service).__name__)
+        self.thread.daemon = True
+
+    @property
+    def address(self):
+        return '127.0.0.1:{}'.format(self.httpd.server_address[1])
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+def _strip_ns(tag):
+    return tag.split('}', 1)[-1]
+
+
+def xml_to_obj(element):
+    """Convert an EC2 XML element to the nested dict layout aws.py produces (repeated tags become lists)"""
+    children = list(element)
+    if not children:
+        return element.text or ''
+    obj = {}
+    for child in children:
+        key = _strip_ns(child.tag)
+        value = xml_to_obj(child)
+        if key in obj:
+            if not isinstance(obj[key], list):
+                obj[key] = [obj[key]]
+            obj[key].append(value)
+        else:
+            obj[key] = value
+    return obj
+
+
+def ec2_payload(state, params):
+    """Return the body of a FakeEC2 answer to params as aws.py parses it, for timing code without the HTTP round trip"""
+    code, payload = FakeEC2(state).handle(params)
+    return xml_to_obj(ET.fromstring(payload))
+
+
+class LocalEC2Client(object):
+    """Drop-in for aws.AWS talking plain HTTP to a FakeEC2 server, one connection per call like aws.py"""
+
+    def __init__(self, address):
+        self.address = address
+
+    def request(self, service, region, method, path, body, **kwargs):
+        conn = http_client.HTTPConnection(self.address, timeout=kwargs.get('max_time') or 30)
+        try:
+            conn.request(method, path, body or None, {'Connection': 'close'})
+            response = conn.getresponse()
+            payload = response.read()
+        finally:
+            conn.close()
+        headers = {'_code': str(response.status), '_reason': response.reason, '_parsed': True}
+        return headers, xml_to_obj(ET.fromstring(payload))
+
+
+def imds_metadata(address, token_ttl=21600):
+    """Return an aws.metadata() replacement reading from a FakeIMDS server"""
+    def metadata(path):
+        conn = http_client.HTTPConnection(address, timeout=5)
+        try:
+            conn.request('PUT', '/latest/api/token', '',
+                         {'X-aws-ec2-metadata-token-ttl-seconds': str(token_ttl)})
+            token = conn.getresponse().read().decode('utf-8')
+            conn.request('GET', path if path.startswith('/latest') else '/latest/meta-data' + path, None,
+                         {'X-aws-ec2-metadata-token': token})
+            response = conn.getresponse()
+            text = response.read().decode('utf-8')
+        finally:
+            conn.close()
+        if response.status != 200:
+            raise IOError('{} {}'.format(response.status, path))
+        return text
+    return metadata
+
+
+CPHAPROB_SCRIPT = '''#!/bin/sh
+cat "{state_file}"
+'''
+
+CPHAPROB_OUTPUT = '''
+Cluster Mode:   High Availability (Active Up) with IGMP Membership
+
+ID         Unique Address  Assigned Load   State          Name
+
+1 (local)  {local_ip:<15} {local_load:<15} {local_state:<14} member-a
+2          {peer_ip:<15} {peer_load:<15} {peer_state:<14} member-b
+'''
+
+
+class ScriptedCluster(object):
+    """Installs fake "cphaprob" and "fw" executables in bin_dir; the member states are switched with set_local()"""
+
+    def __init__(self, bin_dir, local_ip, peer_ip):
+        self.state_file = os.path.join(bin_dir, 'cphaprob.state')
+        self.local_ip = local_ip
+        self.peer_ip = peer_ip
+        for name, script in [('cphaprob', CPHAPROB_SCRIPT.format(state_file=self.state_file)),
+                             ('fw', '#!/bin/sh\nexit 0\n')]:
+            path = os.path.join(bin_dir, name)
+            with open(path, 'w') as f:
+                f.write(script)
+            os.chmod(path, os.stat(path).st_mode | stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH)
+        self.set_local(active=False)
+
+    def set_local(self, active):
+        # Replace the file at once, a "cphaprob" running meanwhile must never read it half written
+        tmp = self.state_file + '.tmp'
+        with open(tmp, 'w') as f:
+            f.write(CPHAPROB_OUTPUT.format(local_ip=self.local_ip, peer_ip=self.peer_ip,
+                                           local_load='100%' if active else '0%',
+                                           peer_load='0%' if active else '100%',
+                                           local_state='ACTIVE' if active else 'STANDBY',
+                                           peer_state='STANDBY' if active else 'ACTIVE'))
+        os.replace(tmp, self.state_file)